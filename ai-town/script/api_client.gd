@@ -6,35 +6,71 @@ signal chat_response_received(npc_name: String, message: String)
 signal chat_error(error_message: String)
 signal npc_status_received(dialogues: Dictionary)
 signal npc_list_received(npcs: Array)
+signal greeting_received(npc_name: String, greeting: String)
 
 # HTTP请求节点
 var http_chat: HTTPRequest
 var http_status: HTTPRequest
 var http_npcs: HTTPRequest
+var http_presence: HTTPRequest
+var http_prewarm: HTTPRequest
+var http_greeting: HTTPRequest
+
+# NPC状态版本号(用于增量获取,-1表示尚未获取过)
+var status_version: int = -1
+
+# 玩家ID(对话、位置上报、预热、问候语都带上)
+var player_id: String = ""
 
 func _ready():
+	player_id = _load_player_id()
+
 	# 创建HTTP请求节点
 	http_chat = HTTPRequest.new()
 	http_status = HTTPRequest.new()
 	http_npcs = HTTPRequest.new()
+	http_presence = HTTPRequest.new()
+	http_prewarm = HTTPRequest.new()
+	http_greeting = HTTPRequest.new()
 
 	add_child(http_chat)
 	add_child(http_status)
 	add_child(http_npcs)
+	add_child(http_presence)
+	add_child(http_prewarm)
+	add_child(http_greeting)
 
 	# 连接信号
 	http_chat.request_completed.connect(_on_chat_request_completed)
 	http_status.request_completed.connect(_on_status_request_completed)
 	http_npcs.request_completed.connect(_on_npcs_request_completed)
-
-	print("[INFO] API客户端初始化完成")
+	http_prewarm.request_completed.connect(_on_prewarm_request_completed)
+	http_greeting.request_completed.connect(_on_greeting_request_completed)
+
+	print("[INFO] API客户端初始化完成, 玩家ID: ", player_id)
+
+func _load_player_id() -> String:
+	"""读取保存的玩家ID, 没有时生成一个并保存"""
+	if FileAccess.file_exists(Config.PLAYER_ID_FILE):
+		var saved_file = FileAccess.open(Config.PLAYER_ID_FILE, FileAccess.READ)
+		if saved_file:
+			var saved = saved_file.get_as_text().strip_edges()
+			if saved != "":
+				return saved
+
+	var generated = "player_%d_%d" % [Time.get_unix_time_from_system(), randi() % 1000000]
+	var new_file = FileAccess.open(Config.PLAYER_ID_FILE, FileAccess.WRITE)
+	if new_file:
+		new_file.store_string(generated)
+	return generated
 
 # ==================== 对话API ====================
 func send_chat(npc_name: String, message: String) -> void:
 	"""发送对话请求"""
 	var data = {
 		"npc_name": npc_name,
-		"message": message
+		"message": message,
+		"player_id": player_id
 	}
 
 	var json_string = JSON.stringify(data)
@@ -86,9 +122,13 @@ func get_npc_status() -> void:
 		print("[WARN] NPC状态请求正在处理中,跳过本次请求")
 		return
 
-	print("[API] GET /npcs/status")
+	var url = Config.API_NPC_STATUS
+	if status_version >= 0:
+		url += "?since=%d" % status_version
+
+	print("[API] GET ", url)
 
-	var error = http_status.request(Config.API_NPC_STATUS)
+	var error = http_status.request(url)
 
 	if error != OK:
 		print("[ERROR] 获取NPC状态失败: ", error)
@@ -108,6 +148,9 @@ func _on_status_request_completed(_result: int, response_code: int, _headers: Pa
 
 	var response = json.data
 
+	if response.has("version"):
+		status_version = int(response["version"])
+
 	if response.has("dialogues"):
 		var dialogues = response["dialogues"]
 		print("[INFO] 收到NPC状态更新: ", dialogues.size(), "个NPC")
@@ -142,4 +185,78 @@ func _on_npcs_request_completed(_result: int, response_code: int, _headers: Pack
 		var npcs = response["npcs"]
 		print("[INFO] 收到NPC列表: ", npcs.size(), "个NPC")
 		npc_list_received.emit(npcs)
-	
+
+# ==================== 玩家位置API ====================
+func report_presence(nearby_npcs: Array) -> void:
+	"""上报玩家附近的NPC(后端只为这些NPC生成环境对话)"""
+	if http_presence.get_http_client_status() != HTTPClient.STATUS_DISCONNECTED:
+		return
+
+	var data = {
+		"player_id": player_id,
+		"nearby_npcs": nearby_npcs
+	}
+
+	var json_string = JSON.stringify(data)
+	var headers = ["Content-Type: application/json"]
+
+	var error = http_presence.request(
+		Config.API_PLAYER_PRESENCE,
+		headers,
+		HTTPClient.METHOD_POST,
+		json_string
+	)
+
+	if error != OK:
+		print("[ERROR] 上报玩家位置失败: ", error)
+
+# ==================== 对话预热API ====================
+func prewarm_npc(npc_name: String) -> void:
+	"""玩家进入NPC交互范围时预热首轮对话(好感度、记忆、LLM连接)"""
+	if http_prewarm.get_http_client_status() != HTTPClient.STATUS_DISCONNECTED:
+		return
+
+	var url = Config.API_NPC_PREWARM % npc_name.uri_encode() + "?player_id=" + player_id.uri_encode()
+	var headers = ["Content-Type: application/json"]
+
+	print("[API] POST ", url)
+
+	var error = http_prewarm.request(url, headers, HTTPClient.METHOD_POST, "")
+
+	if error != OK:
+		print("[ERROR] 预热对话失败: ", error)
+
+func _on_prewarm_request_completed(_result: int, response_code: int, _headers: PackedStringArray, _body: PackedByteArray) -> void:
+	"""处理预热响应(开场白在打开对话时通过问候语接口取用)"""
+	if response_code != 200:
+		print("[ERROR] 预热请求失败: HTTP ", response_code)
+
+# ==================== 问候语API ====================
+func request_greeting(npc_name: String) -> void:
+	"""打开对话时获取NPC的问候语(后端预先生成, 按好感度等级取用)"""
+	if http_greeting.get_http_client_status() != HTTPClient.STATUS_DISCONNECTED:
+		http_greeting.cancel_request()
+
+	var url = Config.API_NPC_GREETING % npc_name.uri_encode() + "?player_id=" + player_id.uri_encode()
+	var headers = ["Content-Type: application/json"]
+
+	print("[API] POST ", url)
+
+	var error = http_greeting.request(url, headers, HTTPClient.METHOD_POST, "")
+
+	if error != OK:
+		print("[ERROR] 获取问候语失败: ", error)
+
+func _on_greeting_request_completed(_result: int, response_code: int, _headers: PackedStringArray, body: PackedByteArray) -> void:
+	"""处理问候语响应"""
+	if response_code != 200:
+		print("[ERROR] 问候语请求失败: HTTP ", response_code)
+		return
+
+	var json = JSON.new()
+	if json.parse(body.get_string_from_utf8()) != OK:
+		return
+
+	var response = json.data
+	if response.get("greeting") != null:
+		greeting_received.emit(response["npc_name"], response["greeting"])
@@ -6,19 +6,29 @@ const API_BASE_URL = "http://localhost:8000"
 const API_CHAT = API_BASE_URL + "/chat"
 const API_NPCS = API_BASE_URL + "/npcs"
 const API_NPC_STATUS = API_BASE_URL + "/npcs/status"
+const API_PLAYER_PRESENCE = API_BASE_URL + "/players/presence"
+const API_NPC_PREWARM = API_BASE_URL + "/npcs/%s/prewarm"  # 玩家走近NPC时预热首轮对话
+const API_NPC_GREETING = API_BASE_URL + "/npcs/%s/greeting"  # 打开对话时NPC的问候语
+
+# ==================== 玩家配置 ====================
+const PLAYER_ID_FILE = "user://player_id.txt"  # 玩家ID(首次运行时生成, 后端按玩家区分记忆和好感度)
 
 # ==================== NPC配置 ====================
-const NPC_NAMES = ["张三", "李四", "王五"]
+const NPC_NAMES = ["张三", "李四", "王五", "赵六", "孙七", "周八"]
 const NPC_TITLES = {
 	"张三": "Python工程师",
 	"李四": "产品经理",
-	"王五": "UI设计师"
+	"王五": "UI设计师",
+	"赵六": "测试工程师",
+	"孙七": "运维工程师",
+	"周八": "数据分析师"
 }
 
 # ==================== 游戏配置 ====================
 const PLAYER_SPEED = 200.0  # 玩家移动速度
 const INTERACTION_DISTANCE = 80.0  # 交互距离
-const NPC_STATUS_UPDATE_INTERVAL = 30.0  # NPC状态更新间隔(秒)
+const NPC_STATUS_UPDATE_INTERVAL = 10.0  # NPC状态更新间隔(秒), 短于后端环境对话的逐句播放间隔
+const INTEREST_RADIUS = 600.0  # 玩家关注范围(范围内的NPC才会生成环境对话)
 
 # ==================== UI配置 ====================
 const DIALOGUE_FADE_TIME = 0.3  # 对话框淡入淡出时间
@@ -33,6 +33,7 @@ func _ready():
 	if api_client:
 		api_client.chat_response_received.connect(_on_chat_response_received)
 		api_client.chat_error.connect(_on_chat_error)
+		api_client.greeting_received.connect(_on_greeting_received)
 
 	print("[INFO] 对话UI初始化完成")
 
@@ -97,6 +98,10 @@ func start_dialogue(npc_name: String):
 	dialogue_text.clear()
 	dialogue_text.append_text("[color=gray]与 " + npc_name + " 的对话开始...[/color]\n")
 
+	# NPC的问候语(后端预先生成, 收到后显示)
+	if api_client:
+		api_client.request_greeting(npc_name)
+
 	# 清空输入框
 	player_input.text = ""
 
@@ -168,6 +173,13 @@ func send_message():
 	else:
 		print("[ERROR] API客户端未找到")
 
+func _on_greeting_received(npc_name: String, greeting: String):
+	"""收到NPC的问候语"""
+	if npc_name != current_npc_name or not visible:
+		return
+
+	dialogue_text.append_text("[color=yellow]" + npc_name + ":[/color] " + greeting + "\n")
+
 func _on_chat_response_received(npc_name: String, message: String):
 	"""收到NPC回复"""
 	if npc_name != current_npc_name:
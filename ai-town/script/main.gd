@@ -1,11 +1,6 @@
 # 主场景脚本
 extends Node2D
 
-# NPC节点引用
-@onready var npc_zhang: Node2D = $NPCs/NPC_Zhang
-@onready var npc_li: Node2D = $NPCs/NPC_Li
-@onready var npc_wang: Node2D = $NPCs/NPC_Wang
-
 # API客户端
 var api_client: Node = null
 
@@ -31,8 +26,21 @@ func _process(delta: float):
 	if status_update_timer >= Config.NPC_STATUS_UPDATE_INTERVAL:
 		status_update_timer = 0.0
 		if api_client:
+			api_client.report_presence(get_nearby_npc_names())
 			api_client.get_npc_status()
 
+func get_nearby_npc_names() -> Array:
+	"""获取玩家关注范围内的NPC名字"""
+	var names = []
+	var player = get_tree().get_first_node_in_group("player")
+	if player == null:
+		return names
+
+	for npc in get_tree().get_nodes_in_group("npcs"):
+		if player.global_position.distance_to(npc.global_position) <= Config.INTEREST_RADIUS:
+			names.append(npc.npc_name)
+	return names
+
 func _on_npc_status_received(dialogues: Dictionary):
 	"""收到NPC状态更新"""
 	print("[INFO] 更新NPC状态: ", dialogues)
@@ -49,13 +57,8 @@ func update_npc_dialogue(npc_name: String, dialogue: String):
 		npc_node.update_dialogue(dialogue)
 
 func get_npc_node(npc_name: String) -> Node2D:
-	"""根据名字获取NPC节点"""
-	match npc_name:
-		"张三":
-			return npc_zhang
-		"李四":
-			return npc_li
-		"王五":
-			return npc_wang
-		_:
-			return null
+	"""根据名字获取NPC节点(场景中npcs组的全部NPC)"""
+	for npc in get_tree().get_nodes_in_group("npcs"):
+		if npc.npc_name == npc_name:
+			return npc
+	return null
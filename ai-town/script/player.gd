@@ -151,6 +151,11 @@ func set_nearby_npc(npc: Node):
 	if npc != null:
 		print("[INFO] ✅ 进入NPC范围: ", npc.npc_name)
 		Config.log_info("进入NPC范围: " + npc.npc_name)
+
+		# 预热首轮对话(玩家按E前后端已准备好好感度和记忆)
+		var api_client = get_node_or_null("/root/APIClient")
+		if api_client:
+			api_client.prewarm_npc(npc.npc_name)
 	else:
 		print("[INFO] ❌ 离开NPC范围")
 		Config.log_info("离开NPC范围")
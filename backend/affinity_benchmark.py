@@ -0,0 +1,154 @@
+"""好感度规则分类器离线一致性评估
+
+读取 logs/affinity_verdicts.jsonl 中记录的LLM判定结果,
+在不同置信度阈值下对比本地规则分类器的结论, 用于调整 AFFINITY_RULE_THRESHOLD
+
+记录时规则命中的消息只按 AFFINITY_VERDICT_SHADOW_RATE 比例调用LLM对照,
+统计时这些样本按 1/比例 加权, 还原真实的消息分布
+
+使用方法:
+  python affinity_benchmark.py                          # 使用默认记录文件
+  python affinity_benchmark.py path/to/verdicts.jsonl   # 指定记录文件
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from affinity_rules import get_rule_classifier
+
+# 默认判定记录文件(由 RelationshipManager 写入)
+DEFAULT_VERDICTS_FILE = Path(os.getenv("LOGS_DIR", Path(__file__).parent / "logs")) / "affinity_verdicts.jsonl"
+
+# 评估的阈值列表
+THRESHOLDS = [0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+
+# 推荐阈值需达到的情感一致率
+TARGET_AGREEMENT = 0.95
+
+
+def load_verdicts(filename:Path)->List[Dict]:
+    """加载LLM判定记录"""
+    records = []
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record.get("verdict"), dict) and record.get("player_message") is not None:
+                records.append(record)
+    return records
+
+
+def evaluate(records:List[Dict], thresholds:List[float] = THRESHOLDS)->List[Dict]:
+    """
+    计算各阈值下的覆盖率和一致率
+    :param records: LLM判定记录
+    :param thresholds: 置信度阈值列表
+    :return: 每个阈值的统计结果
+    """
+    classifier = get_rule_classifier()
+
+    start = time.perf_counter()
+    predictions = [classifier.classify(record["player_message"]) for record in records]
+    elapsed = time.perf_counter() - start
+    per_message_us = elapsed / max(len(records), 1) * 1_000_000
+
+    # 影子对照样本(记录时规则已命中)按采样比例的倒数加权
+    weights = [1.0 / record["shadow_rate"] if record.get("rule") and record.get("shadow_rate") else 1.0 for record in records]
+    total_weight = sum(weights)
+
+    results = []
+    for threshold in thresholds:
+        covered = 0
+        covered_weight = 0.0
+        sentiment_agree = 0.0
+        direction_agree = 0.0
+        abs_error = 0.0
+
+        for record, prediction, weight in zip(records, predictions, weights):
+            if prediction["confidence"] < threshold:
+                continue
+
+            covered += 1
+            covered_weight += weight
+            verdict = record["verdict"]
+            llm_amount = int(verdict.get("change_amount", 0)) if verdict.get("should_change") else 0
+            llm_sentiment = verdict.get("sentiment", "neutral")
+
+            if prediction["sentiment"] == llm_sentiment:
+                sentiment_agree += weight
+            # 变化方向一致(同为正/负/零)
+            if (prediction["change_amount"] > 0) == (llm_amount > 0) and \
+                    (prediction["change_amount"] < 0) == (llm_amount < 0):
+                direction_agree += weight
+            abs_error += weight * abs(prediction["change_amount"] - llm_amount)
+
+        results.append({
+            "threshold": threshold,
+            "covered": covered,
+            "coverage": covered_weight / total_weight if records else 0.0,
+            "sentiment_agreement": sentiment_agree / covered_weight if covered else 0.0,
+            "direction_agreement": direction_agree / covered_weight if covered else 0.0,
+            "mean_abs_error": abs_error / covered_weight if covered else 0.0,
+            "per_message_us": per_message_us
+        })
+
+    return results
+
+
+def recommend_threshold(results:List[Dict], target:float = TARGET_AGREEMENT):
+    """选择一致率达标且覆盖率最高的阈值"""
+    qualified = [r for r in results if r["covered"] and r["sentiment_agreement"] >= target]
+    if not qualified:
+        return None
+    return max(qualified, key=lambda r: (r["coverage"], -r["threshold"]))
+
+
+def print_report(records:List[Dict], results:List[Dict]):
+    """打印评估报告"""
+    print("\n" + "=" * 60)
+    print("📊 好感度规则分类器一致性评估")
+    print(f"📂 样本数: {len(records)}")
+    if results:
+        print(f"⚡ 规则分类耗时: {results[0]['per_message_us']:.1f} μs/条")
+    print("=" * 60)
+    print(f"{'阈值':>6} {'覆盖数':>6} {'覆盖率':>8} {'情感一致':>8} {'方向一致':>8} {'平均误差':>8}")
+
+    for r in results:
+        print(
+            f"{r['threshold']:>8.2f} {r['covered']:>8d} {r['coverage']:>10.1%} "
+            f"{r['sentiment_agreement']:>11.1%} {r['direction_agreement']:>11.1%} {r['mean_abs_error']:>11.2f}"
+        )
+
+    best = recommend_threshold(results)
+    print()
+    if best:
+        print(f"✅ 推荐阈值: {best['threshold']:.2f} "
+              f"(覆盖率 {best['coverage']:.1%}, 情感一致率 {best['sentiment_agreement']:.1%})")
+    else:
+        print(f"⚠️  没有阈值达到 {TARGET_AGREEMENT:.0%} 的一致率, 建议保持较高阈值或扩充规则词典")
+    print("=" * 60 + "\n")
+
+
+if __name__ == '__main__':
+    verdicts_file = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_VERDICTS_FILE
+
+    if not verdicts_file.exists():
+        print(f"❌ 判定记录文件不存在: {verdicts_file}")
+        print("   请先开启 AFFINITY_VERDICT_RECORDING 并运行一段时间对话")
+        sys.exit(1)
+
+    verdict_records = load_verdicts(verdicts_file)
+    if not verdict_records:
+        print("📭 判定记录为空")
+        sys.exit(0)
+
+    print_report(verdict_records, evaluate(verdict_records))
@@ -0,0 +1,159 @@
+"""好感度本地规则分类器 - 明显的正面/负面消息无需调用LLM"""
+
+import re
+from typing import Dict, List, Tuple
+
+# 规则格式: (正则, 好感度变化, 原因, 情感, 置信度)
+AffinityRule = Tuple[str, int, str, str, float]
+
+# 纯问候(整句只有问候语时才命中)
+GREETING_RULES:List[AffinityRule] = [
+    (r"^(你好|您好|嗨|哈喽|hi|hello|hey|早上好|早安|早|中午好|下午好|晚上好|晚安)(呀|啊|哇|哦)?[!！~～。.， ]*$",
+     2, "友好问候", "positive", 0.95),
+]
+
+# 关键词规则(在消息任意位置命中)
+# 只收录几乎没有歧义的词: "垃圾(回收)""滚(动条)""没用(过)""优秀"等常出现在正常的工作对话中, 交给LLM判断
+KEYWORD_RULES:List[AffinityRule] = [
+    # 正面
+    (r"谢谢|感谢|多谢|辛苦了|thanks|thank you|thx", 5, "表达感谢", "positive", 0.9),
+    (r"真棒|真厉害|太厉害|好厉害|太强了|佩服|了不起|真优秀|太优秀|很优秀|牛逼|太赞了|真赞|崇拜", 7, "赞美称赞", "positive", 0.9),
+    (r"请教|教教我|指点一下|向你学习|能教我", 5, "请教学习", "positive", 0.8),
+    (r"很高兴认识你|认识你真好|喜欢你|和你聊天很开心", 5, "友好表达", "positive", 0.85),
+    # 负面
+    (r"傻逼|傻瓜|笨蛋|蠢货|白痴|智障|废物|去死|滚开|闭嘴|脑残", -12, "侮辱攻击", "negative", 0.95),
+    (r"太丑|真丑|难看|真差|太差|烂透|无聊死|烦死|不耐烦", -5, "批评不满", "negative", 0.85),
+]
+
+# 否定词: 出现在关键词之前的窗口内时(如"不够优秀""不是笨蛋"),规则语义可能反转
+NEGATION_CHARS = "不没别未无非"
+NEGATION_WINDOW = 3
+
+# 技术语境: 关键词可能是术语或在讨论代码, 不是对NPC的评价
+TECHNICAL_PATTERN = re.compile(
+    r"代码|函数|方法|机制|算法|程序|接口|变量|模块|框架|数据库|内存|bug|报错|编译|部署|python|java|api",
+    re.IGNORECASE
+)
+
+# 存在否定或技术语境时的置信度上限(低于任何合理的阈值, 一律交给LLM)
+UNCERTAIN_CONFIDENCE = 0.3
+
+# 转折词: 出现时说明消息情感复杂,降低置信度
+CONTRAST_PATTERN = re.compile(r"但是|不过|可是|然而|只是|就是有点")
+
+# 问号: 正面词出现在问句中可能是反问或讽刺
+QUESTION_PATTERN = re.compile(r"[?？]")
+
+# 超过此长度的消息内容较多,规则难以覆盖全部语义
+LONG_MESSAGE_CHARS = 40
+
+
+class AffinityRuleClassifier:
+    """
+    基于词典和模式的好感度分类器
+
+    返回与LLM分析相同结构的字典, 额外附带 confidence 字段:
+    {"should_change", "change_amount", "reason", "sentiment", "confidence"}
+    置信度为0表示无法判断, 由调用方交给LLM处理
+    """
+
+    def __init__(self):
+        self.greeting_rules = [
+            (re.compile(pattern, re.IGNORECASE), amount, reason, sentiment, confidence)
+            for pattern, amount, reason, sentiment, confidence in GREETING_RULES
+        ]
+        self.keyword_rules = [
+            (re.compile(pattern, re.IGNORECASE), amount, reason, sentiment, confidence)
+            for pattern, amount, reason, sentiment, confidence in KEYWORD_RULES
+        ]
+
+    @staticmethod
+    def _unknown()->Dict:
+        """无法判断时的结果"""
+        return {
+            "should_change": False,
+            "change_amount": 0,
+            "reason": "规则未命中",
+            "sentiment": "neutral",
+            "confidence": 0.0
+        }
+
+    def classify(self, player_message:str)->Dict:
+        """
+        分类玩家消息
+        :param player_message: 玩家消息
+        :return: 分析结果字典(含confidence)
+        """
+        message = (player_message or "").strip()
+        if not message:
+            return self._unknown()
+
+        # 1.纯问候
+        for pattern, amount, reason, sentiment, confidence in self.greeting_rules:
+            if pattern.match(message):
+                return {
+                    "should_change": True,
+                    "change_amount": amount,
+                    "reason": reason,
+                    "sentiment": sentiment,
+                    "confidence": confidence
+                }
+
+        # 2.关键词匹配
+        hits = []
+        negated = False
+        for pattern, amount, reason, sentiment, confidence in self.keyword_rules:
+            match = pattern.search(message)
+            if not match:
+                continue
+
+            # 关键词之前几个字内有否定词(如"不够优秀""你不是笨蛋"),语义不确定
+            window = message[max(0, match.start() - NEGATION_WINDOW):match.start()]
+            if any(char in NEGATION_CHARS for char in window):
+                negated = True
+
+            hits.append((amount, reason, sentiment, confidence))
+
+        if not hits:
+            return self._unknown()
+
+        # 正负情感同时出现,交给LLM判断
+        sentiments = {hit[2] for hit in hits}
+        if len(sentiments) > 1:
+            return self._unknown()
+
+        # 取变化幅度最大的规则
+        amount, reason, sentiment, confidence = max(hits, key=lambda hit: abs(hit[0]))
+
+        # 多条同向规则命中,置信度略微提升
+        confidence = min(0.99, confidence + 0.03 * (len(hits) - 1))
+
+        # 转折、长消息、反问(请教本身就是提问,除外)都会降低置信度
+        if CONTRAST_PATTERN.search(message):
+            confidence *= 0.5
+        if len(message) > LONG_MESSAGE_CHARS:
+            confidence *= 0.8
+        if sentiment == "positive" and reason != "请教学习" and QUESTION_PATTERN.search(message):
+            confidence *= 0.85
+        # 否定和技术语境下规则可能完全判反, 置信度压到阈值以下
+        if negated or TECHNICAL_PATTERN.search(message):
+            confidence = min(confidence, UNCERTAIN_CONFIDENCE)
+
+        return {
+            "should_change": True,
+            "change_amount": amount,
+            "reason": reason,
+            "sentiment": sentiment,
+            "confidence": round(confidence, 3)
+        }
+
+
+# 全局单例
+_rule_classifier = None
+
+def get_rule_classifier()->AffinityRuleClassifier:
+    """获取规则分类器单例"""
+    global _rule_classifier
+    if _rule_classifier is None:
+        _rule_classifier = AffinityRuleClassifier()
+    return _rule_classifier
@@ -2,80 +2,36 @@
 
 import sys
 import os
+import threading
+import time
+from collections import defaultdict
 
 # 添加HelloAgents到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'HelloAgents'))
 
 from hello_agents import SimpleAgent, HelloAgentsLLM
-from hello_agents.memory import MemoryManager, MemoryConfig, MemoryItem, EpisodicMemory
-from typing import Dict, List, Optional
+from hello_agents.core.message import Message
+from hello_agents.memory import MemoryItem
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from relationship_manager import RelationshipManager
+from clock import get_clock
+from conversation_history import ConversationHistoryManager
+from greeting_pool import GreetingPool
+from memory_store import NPCMemory, get_memory_store
+from config import settings
+from llm_limiter import llm_slot
+from metrics import CHAT_SECONDS, PREWARMS, chat_stage, record_llm_call
+from tracing import span, start_trace
+from roster import get_roster
+from sharding import get_shard_router
 from logger import (
     log_dialogue_start, log_affinity, log_memory_retrieval,
     log_generating_response, log_npc_response, log_analyzing_affinity,
-    log_affinity_change, log_memory_saved, log_dialogue_end, log_info
+    log_affinity_change, log_memory_saved, log_dialogue_end, log_dialogue_failed, log_info
 )
 
 
-# NPC角色配置
-NPC_ROLES = {
-    "张三": {
-        "title": "Python工程师",
-        "location": "工位区",
-        "activity": "写代码",
-        "personality": "技术宅,喜欢讨论算法和框架",
-        "expertise": "多智能体系统、HelloAgents框架、Python开发、代码优化",
-        "style": "简洁专业,喜欢用技术术语,偶尔吐槽bug",
-        "hobbies": "看技术博客、刷LeetCode、研究新框架"
-    },
-    "李四": {
-        "title": "产品经理",
-        "location": "会议室",
-        "activity": "整理需求",
-        "personality": "外向健谈,善于沟通协调",
-        "expertise": "需求分析、产品规划、用户体验、项目管理",
-        "style": "友好热情,善于引导对话,喜欢用比喻",
-        "hobbies": "看产品分析、研究竞品、思考用户需求"
-    },
-    "王五": {
-        "title": "UI设计师",
-        "location": "休息区",
-        "activity": "喝咖啡",
-        "personality": "细腻敏感,注重美感",
-        "expertise": "界面设计、交互设计、视觉呈现、用户体验",
-        "style": "优雅简洁,喜欢用艺术化的表达,追求完美",
-        "hobbies": "看设计作品、逛Dribbble、品咖啡"
-    },
-    "赵六": {
-        "title": "测试工程师",
-        "location": "测试区",
-        "activity": "编写测试用例",
-        "personality": "严谨细致，善于发现细节问题",
-        "expertise": "自动化测试、性能测试、质量保障、缺陷追踪",
-        "style": "逻辑清晰，注重细节，善于提问和验证",
-        "hobbies": "研究测试工具、下棋、拼图"
-    },
-    "孙七": {
-        "title": "运维工程师",
-        "location": "服务器机房",
-        "activity": "监控系统状态",
-        "personality": "冷静沉稳，应急反应能力强",
-        "expertise": "系统部署、性能调优、故障排查、容器化技术",
-        "style": "务实高效，善于用运维数据说话",
-        "hobbies": "研究新技术、打游戏、登山"
-    },
-    "周八": {
-        "title": "数据分析师",
-        "location": "数据分析区",
-        "activity": "分析业务数据",
-        "personality": "理性客观，对数据敏感",
-        "expertise": "数据挖掘、统计分析、数据可视化、机器学习",
-        "style": "善于用数据支撑观点，喜欢图表化表达",
-        "hobbies": "研究数据算法、玩数独、看科幻电影"
-    }
-}
-
 def create_system_prompt(name:str, role:Dict[str, str])->str:
     """
     创建NPC的系统提示词
@@ -133,74 +89,149 @@ class NPCAgentManager:
             self.llm = None
 
         self.agents: Dict[str, SimpleAgent] = {}
-        self.memories: Dict[str, MemoryManager] = {}
+        self.memories: Dict[str, NPCMemory] = {}
         self.relationship_manager: Optional[RelationshipManager] = None
 
         # 初始化好感度管理器
         if self.llm:
             self.relationship_manager = RelationshipManager(self.llm)
 
-        self._create_agents()
+        # 会话历史(限制轮数和token, 更早的对话在后台压缩为摘要)
+        self.history = ConversationHistoryManager(self.llm)
 
-    def _create_memory_manager(self, npc_name:str):
-        """为NPC创建记忆管理器"""
-        # 创建记忆存储目录
-        memory_dir = os.path.join(os.path.dirname(__file__), 'memory_data', npc_name)
-        os.makedirs(memory_dir, exist_ok=True)
-
-        # 配置记忆系统
-        memory_config = MemoryConfig(
-            storage_path = memory_dir,
-            working_memory_capacity = 10, # 最近十条对话
-            working_memory_tokens = 2000, # 最多2000个token
-
-            episodic_memory_capacity=100,  # 最多100条长期记忆
-            enable_forgetting=True,  # 启用遗忘机制
-            forgetting_threshold=0.3  # 重要性低于0.3的记忆会被遗忘
-        )
+        # 对话预热结果 {(npc_name, player_id): {...}}, 首轮对话使用后移除, 好感度变化时失效
+        self._prewarmed:Dict[Tuple[str, str], Dict] = {}
+        self._llm_warmed_at = 0.0
+        # 等待玩家回应的问候语 {(npc_name, player_id): (问候语, 过期时间)}, 只进入该玩家下一轮对话的提示词
+        self._greeted:Dict[Tuple[str, str], Tuple[str, float]] = {}
+        # 每个NPC的Agent被所有玩家共用: 同一NPC的生成回复和裁剪历史按顺序执行(对话在工作线程中并发处理)
+        self._agent_locks:Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        if self.relationship_manager:
+            self.relationship_manager.subscribe(lambda npc_name, player_id: self._prewarmed.pop((npc_name, player_id), None))
 
-        # 创建记忆管理器
-        memory_manager = MemoryManager(
-            config=memory_config,
-            user_id=npc_name,
-            enable_working=True,# 启用工作记忆(短期)
-            enable_episodic=True, # 启用情景记忆(长期)
-            enable_semantic=False, # 不需要语义记忆
-            enable_perceptual=False # 不需要感知记忆
-        )
+        # NPC名册(数据文件驱动,变化时只重建受影响的Agent)
+        self.roster = get_roster()
+        self.roster.subscribe(self._on_roster_changed)
+
+        # NPC分片(启用时只加载本进程负责的NPC, 分片成员变化时重新分配)
+        self.shard_router = get_shard_router()
+        if self.shard_router:
+            self.shard_router.subscribe(self._on_shards_changed)
+
+        # 问候语池(后台按好感度等级预先生成, 打开对话时直接取用)
+        self.greetings = GreetingPool(self.llm if self.relationship_manager else None, self.relationship_manager, self.owns)
 
-        print(f"  💾 {npc_name}的记忆系统已初始化 (存储路径: {memory_dir})")
+        self._create_agents()
+
+    def owns(self, npc_name:str)->bool:
+        """NPC是否由本进程负责(未启用分片时负责全部NPC)"""
+        return self.shard_router is None or self.shard_router.is_local(npc_name)
+
+    def _create_memory_manager(self, npc_name:str)->NPCMemory:
+        """
+        为NPC创建记忆管理器
+        所有NPC共用一个记忆数据库(memory_store), 这里只创建该NPC的视图, 不加载历史记忆
+        """
+        memory_manager = get_memory_store().for_npc(npc_name)
+        print(f"  💾 {npc_name}的记忆系统已初始化 (存储路径: {memory_manager.store.db_path})")
         return memory_manager
 
+    def _create_agent(self, name:str, role:Dict[str, str], memory_manager:Optional[NPCMemory] = None):
+        """
+        创建单个NPC Agent 和记忆系统
+        :param memory_manager: 已有的记忆管理器(角色设定变化时复用,不丢失记忆)
+        """
+        try:
+            system_prompt = create_system_prompt(name, role)
+
+            if self.llm:
+                agent = SimpleAgent(
+                    name= f"{name}-{role['title']}",
+                    llm=self.llm,
+                    system_prompt=system_prompt
+                )
+            else:
+                # 模拟模式
+                agent = None
+
+            self.agents[name] = agent
+            if agent is not None:
+                self.history.attach(name, agent)
+
+            # 创建记忆管理器
+            if memory_manager is None:
+                memory_manager = self._create_memory_manager(name)
+            self.memories[name] = memory_manager
+
+            print(f"✅ {name}({role['title']}) Agent创建成功 (记忆系统已启用)")
+        except Exception as e:
+            print(f"❌ {name} Agent创建失败: {e}")
+            self.agents[name] = None
+            self.memories[name] = None
+
     def _create_agents(self):
         """
         创建所有的NPC Agent 和记忆系统
         """
-        for name, role in NPC_ROLES.items():
-            try:
-                system_prompt = create_system_prompt(name, role)
-
-                if self.llm:
-                    agent = SimpleAgent(
-                        name= f"{name}-{role['title']}",
-                        llm=self.llm,
-                        system_prompt=system_prompt
-                    )
-                else:
-                    # 模拟模式
-                    agent = None
+        for name, role in self.roster.roles.items():
+            if self.owns(name):
+                self._create_agent(name, role)
 
-                self.agents[name] = agent
+    def ensure_agent(self, npc_name:str):
+        """
+        确保NPC的Agent已在本进程加载(其他分片转发来的请求, 成员视图短暂不一致时本地处理)
+        """
+        if npc_name not in self.agents and npc_name in self.roster.roles:
+            self._create_agent(npc_name, self.roster.roles[npc_name])
 
-                # 创建记忆管理器
-                memory_manager = self._create_memory_manager(name)
-                self.memories[name] = memory_manager
+    def _on_shards_changed(self):
+        """
+        分片成员变化回调: 加载新分配到本进程的NPC, 释放已分配给其他进程的NPC
+        记忆数据在共享磁盘上, 新的负责进程重新打开即可
+        """
+        for name in list(self.agents):
+            if not self.owns(name):
+                self.agents.pop(name, None)
+                self.memories.pop(name, None)
+                self.history.detach(name)
+                print(f"📤 {name} 已移交其他分片")
+
+        for name, role in self.roster.roles.items():
+            if self.owns(name) and name not in self.agents:
+                self._create_agent(name, role)
+
+    def _on_roster_changed(self, diff:Dict):
+        """
+        名册热加载回调: 只重建新增和设定变化的NPC, 移除已删除的NPC
+        """
+        for name in diff["removed"]:
+            self.agents.pop(name, None)
+            self.memories.pop(name, None)
+            self.history.detach(name)
+            print(f"🗑️  {name} 已从名册移除")
 
-                print(f"✅ {name}({role['title']}) Agent创建成功 (记忆系统已启用)")
-            except Exception as e:
-                print(f"❌ {name} Agent创建失败: {e}")
-                self.agents[name] = None
-                self.memories[name] = None
+        for name in diff["added"]:
+            if self.owns(name):
+                self._create_agent(name, self.roster.roles[name])
+
+        for name in diff["changed"]:
+            if name in self.agents:
+                self._create_agent(name, self.roster.roles[name], memory_manager=self.memories.get(name))
+
+    def _build_affinity_context(self, npc_name:str, player_id:str)->Tuple[str, float, str]:
+        """
+        构建好感度上下文
+        :return: (上下文文本, 好感度, 好感度等级)
+        """
+        affinity = self.relationship_manager.get_affinity(npc_name, player_id)
+        affinity_level = self.relationship_manager.get_affinity_level(affinity)
+        affinity_modifier = self.relationship_manager.get_affinity_modifier(affinity)
+        affinity_context = f"""
+                    【当前关系】
+                    你与玩家的关系: {affinity_level} (好感度: {affinity:.0f}/100)
+                    【对话风格】{affinity_modifier}
+                    """
+        return affinity_context, affinity, affinity_level
 
     def _build_memory_context(self, memories:List[MemoryItem])->str:
         """构建记忆上下文"""
@@ -219,7 +250,7 @@ class NPCAgentManager:
 
     def _save_conversation_to_memory(
             self,
-            memory_manager:MemoryManager,
+            memory_manager:NPCMemory,
             npc_name:str,
             player_message:str,
             npc_response:str,
@@ -227,7 +258,7 @@ class NPCAgentManager:
             affinity_info:Optional[Dict] = None
     ):
         """保存对话到记忆系统中(包含好感度消息)"""
-        current_time = datetime.now()
+        current_time = get_clock().now()
 
         # 获取好感度消息
         affinity = affinity_info.get("new_affinity", affinity_info.get("affinity", 50.0)) if affinity_info else 50.0
@@ -275,8 +306,11 @@ class NPCAgentManager:
 
         print(f"  💾 对话已保存到{npc_name}的记忆中")
 
-    def chat(self, npc_name:str, message:str, player_id:str = "player")->str:
-        """与指定的NPC对话(支持记忆功能和好感度系统)"""
+    def chat(self, npc_name:str, message:str, player_id:str = "player", request_id:Optional[str] = None)->str:
+        """
+        与指定的NPC对话(支持记忆功能和好感度系统)
+        :param request_id: 请求ID(用于追踪和日志关联), 为空时自动生成
+        """
         if npc_name not in self.agents:
             return f"错误: NPC '{npc_name}' 不存在"
 
@@ -285,139 +319,335 @@ class NPCAgentManager:
 
         if agent is None:
             # 模拟模式回复
-            role = NPC_ROLES[npc_name]
+            role = self.roster.get(npc_name) or {"title": "NPC"}
             return f"你好!我是{npc_name},一名{role['title']}。(当前为模拟模式,请配置API_KEY以启用AI对话)"
 
-        try:
-            # 记录对话开始 ⭐ 使用日志系统
-            log_dialogue_start(npc_name, message)
-
-            # 1.获取当前好感度
-            affinity_context = ""
-            if self.relationship_manager:
-                affinity = self.relationship_manager.get_affinity(npc_name, player_id)
-                affinity_level = self.relationship_manager.get_affinity_level(affinity)
-                affinity_modifier = self.relationship_manager.get_affinity_modifier(affinity)
-                affinity_context = f"""
-                【当前关系】
-                你与玩家的关系: {affinity_level} (好感度: {affinity:.0f}/100)
-                【对话风格】{affinity_modifier}
-                """
-                log_affinity(npc_name, affinity, affinity_level)
-
-            # 2.检索相关记忆
-            relevant_memories = []
-            if memory_manager:
-                relevant_memories = memory_manager.retrieve_memories(
-                    query=message,
-                    memory_types=["working", "episodic"],
-                    limit=5,
-                    min_importance=0.3 # 只检索重要性 >= 0.3 的记忆
-                )
-                log_memory_retrieval(npc_name, len(relevant_memories), relevant_memories)
-
-            # 3.构建增强的提示词(包含好感度和上下文)
-            memory_context = self._build_memory_context(relevant_memories)
-
-            enhanced_message = affinity_context
-            if memory_context:
-                enhanced_message += f"{memory_context}\n\n"
-            enhanced_message += f"【当前对话】\n玩家: {message}"
-
-            # 4.调用Agent生成回复
-            log_generating_response()
-            response = agent.run(enhanced_message)
-            log_npc_response(npc_name, response)
-
-            # 5.分析并更新好感度
-            log_analyzing_affinity()
-            if self.relationship_manager:
-                affinity_result = self.relationship_manager.analyze_and_update_affinity(
-                    npc_name=npc_name,
-                    player_message=message,
-                    npc_response=response,
-                    player_id=player_id
-                )
+        with start_trace("chat", request_id, npc_name=npc_name, player_id=player_id):
+            chat_start = time.perf_counter()
+            try:
+                # 记录对话开始 ⭐ 使用日志系统
+                log_dialogue_start(npc_name, message, player_id)
+
+                # 玩家走近时的预热结果(好感度上下文和最近记忆)
+                prewarmed = self._take_prewarmed(npc_name, player_id)
+
+                # 1.获取当前好感度
+                affinity_context = ""
+                if self.relationship_manager:
+                    with chat_stage("affinity_lookup"), span("affinity.lookup"):
+                        if prewarmed and prewarmed["affinity"]:
+                            affinity_context, affinity, affinity_level = prewarmed["affinity"]
+                        else:
+                            affinity_context, affinity, affinity_level = self._build_affinity_context(npc_name, player_id)
+                    log_affinity(npc_name, affinity, affinity_level)
+
+                # 2.检索相关记忆
+                relevant_memories = []
+                if memory_manager:
+                    with chat_stage("memory_retrieval"), span("memory.retrieve") as retrieve_span:
+                        relevant_memories = memory_manager.retrieve_memories(
+                            query=message,
+                            memory_types=["working", "episodic"],
+                            limit=5,
+                            min_importance=0.3, # 只检索重要性 >= 0.3 的记忆
+                            player_id=player_id, # 只检索与当前玩家的记忆
+                            recent=prewarmed["memories"] if prewarmed else None
+                        )
+                    retrieve_span.set("count", len(relevant_memories))
+                    log_memory_retrieval(npc_name, len(relevant_memories), relevant_memories)
+
+                # 3.构建增强的提示词(包含好感度和上下文)
+                with chat_stage("prompt_build"), span("prompt.build"):
+                    memory_context = self._build_memory_context(relevant_memories)
+
+                    enhanced_message = affinity_context
+                    if memory_context:
+                        enhanced_message += f"{memory_context}\n\n"
+                    greeting = self._take_greeting(npc_name, player_id)
+                    if greeting:
+                        enhanced_message += f"【你刚才的开场白】\n{npc_name}: {greeting}\n\n"
+                    enhanced_message += f"【当前对话】\n玩家: {message}"
+
+                # 4.调用Agent生成回复
+                log_generating_response()
+                with self._agent_locks[npc_name]:
+                    with chat_stage("agent_run"), span("llm.chat"), llm_slot("chat"):
+                        response = agent.run(enhanced_message)
+                    record_llm_call("chat", (agent.system_prompt or "") + enhanced_message, response)
+                    self.history.trim(npc_name, agent, player_message=message, player_id=player_id)
+                log_npc_response(npc_name, response)
+
+                # 5.分析并更新好感度
+                log_analyzing_affinity()
+                if self.relationship_manager:
+                    with chat_stage("affinity_analysis"), span("affinity.analyze"):
+                        affinity_result = self.relationship_manager.analyze_and_update_affinity(
+                            npc_name=npc_name,
+                            player_message=message,
+                            npc_response=response,
+                            player_id=player_id
+                        )
+
+                    # 记录好感度变化详情
+                    log_affinity_change(affinity_result)
+                else:
+                    affinity_result = {"changed": False, "affinity": 50.0}
+
+                # 6.保存对话到记忆(包含好感度消息)
+                if memory_manager:
+                    with chat_stage("memory_save"), span("memory.save"):
+                        self._save_conversation_to_memory(
+                            memory_manager=memory_manager,
+                            npc_name=npc_name,
+                            player_message=message,
+                            npc_response=response,
+                            player_id=player_id,
+                            affinity_info=affinity_result
+                        )
+                    log_memory_saved(npc_name)
+
+                # 记录对话结束 ⭐ 使用日志系统
+                log_dialogue_end()
+                CHAT_SECONDS.observe(time.perf_counter() - chat_start, "ok")
+
+                return response
+            except Exception as e:
+                print(f"❌ {npc_name}对话失败: {e}")
+                log_dialogue_failed(str(e))
+                CHAT_SECONDS.observe(time.perf_counter() - chat_start, "error")
+                import traceback
+                traceback.print_exc()
+                return f"抱歉,我现在有点忙,等会儿再聊吧。(错误: {str(e)})"
+
+    def export_histories(self)->Dict[str, List[Message]]:
+        """导出各NPC Agent的会话历史(写世界快照用)"""
+        return {name: agent.get_history() for name, agent in list(self.agents.items()) if agent is not None}
+
+    def restore_histories(self, histories:Dict[str, List[Message]])->int:
+        """
+        从世界快照恢复会话历史(已不在本进程的NPC跳过)
+        :return: 恢复的消息条数
+        """
+        restored = 0
+        for name, history in histories.items():
+            agent = self.agents.get(name)
+            if agent is None:
+                continue
+            agent.clear_history()
+            for message in history:
+                agent.add_message(message)
+            self.history.trim(name, agent)
+            restored += len(history)
+        return restored
+
+    def prewarm(self, npc_name:str, player_id:str = "player", opening_line:bool = False)->Dict:
+        """
+        玩家走近NPC时预热首轮对话: 读取好感度、检索该玩家的最近记忆、预热LLM连接,
+        可选生成NPC开场白; 有效期内的首轮对话只需生成回复
+        :param opening_line: 是否生成开场白(多一次LLM调用)
+        :return: 预热结果(好感度、记忆条数、开场白)
+        """
+        key = (npc_name, player_id)
+        entry = self._prewarmed.get(key)
+        if entry is None or entry["expires"] < time.monotonic():
+            memory_manager = self.memories.get(npc_name)
+            entry = {
+                "affinity": self._build_affinity_context(npc_name, player_id) if self.relationship_manager else None,
+                "memories": memory_manager.retrieve_memories(
+                    query="", memory_types=["working", "episodic"], limit=5, min_importance=0.3, player_id=player_id
+                ) if memory_manager else None,
+                "opening_line": None,
+                "expires": time.monotonic() + settings.PREWARM_TTL
+            }
+            self._prewarmed[key] = entry
+        PREWARMS.inc(1, "requested")
 
-                # 记录好感度变化详情
-                log_affinity_change(affinity_result)
-            else:
-                affinity_result = {"changed": False, "affinity": 50.0}
-
-            # 6.保存对话到记忆(包含好感度消息)
-            if memory_manager:
-                self._save_conversation_to_memory(
-                    memory_manager=memory_manager,
-                    npc_name=npc_name,
-                    player_message=message,
-                    npc_response=response,
-                    player_id=player_id,
-                    affinity_info=affinity_result
-                )
-                log_memory_saved(npc_name)
+        self._warm_llm_connection()
 
-            # 记录对话结束 ⭐ 使用日志系统
-            log_dialogue_end()
+        agent = self.agents.get(npc_name)
+        if opening_line and agent is not None and entry["opening_line"] is None:
+            entry["opening_line"] = self._generate_opening_line(npc_name, agent, entry)
 
-            return response
+        return {
+            "affinity": entry["affinity"][1] if entry["affinity"] else None,
+            "memories": len(entry["memories"] or []),
+            "opening_line": entry["opening_line"]
+        }
+
+    def _take_prewarmed(self, npc_name:str, player_id:str)->Optional[Dict]:
+        """取出有效的预热结果(只用于一轮对话)"""
+        entry = self._prewarmed.pop((npc_name, player_id), None)
+        if entry is None or entry["expires"] < time.monotonic():
+            return None
+        PREWARMS.inc(1, "used")
+        return entry
+
+    def _take_greeting(self, npc_name:str, player_id:str)->Optional[str]:
+        """取出等待玩家回应的问候语(过期后不再使用)"""
+        entry = self._greeted.pop((npc_name, player_id), None)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def greet(self, npc_name:str, player_id:str = "player")->Optional[Dict]:
+        """
+        玩家打开对话时NPC的问候语: 优先使用预热生成的开场白, 否则从问候语池按好感度等级取用;
+        问候语写入该玩家的记忆, 并放入该玩家下一轮对话的提示词(不写入各玩家共用的会话历史)
+        :return: {"greeting", "level", "stale", "source"}, 没有可用问候语时返回None
+        """
+        agent = self.agents.get(npc_name)
+        if agent is None or not self.relationship_manager:
+            return None
+
+        affinity = self.relationship_manager.get_affinity(npc_name, player_id)
+        entry = self._prewarmed.get((npc_name, player_id))
+        if entry and entry["opening_line"] and entry["expires"] >= time.monotonic():
+            result = {
+                "greeting": entry["opening_line"],
+                "level": self.relationship_manager.get_affinity_level(affinity),
+                "stale": False,
+                "source": "opening_line"
+            }
+            entry["opening_line"] = None
+        else:
+            result = self.greetings.get(npc_name, affinity)
+            if result is None:
+                return None
+            result["source"] = "pool"
+
+        now = time.monotonic()
+        for key in [key for key, (_, expires) in list(self._greeted.items()) if expires < now]:
+            self._greeted.pop(key, None)
+        self._greeted[(npc_name, player_id)] = (result["greeting"], now + settings.PREWARM_TTL)
+
+        memory_manager = self.memories.get(npc_name)
+        if memory_manager:
+            memory_manager.add_memory(
+                content=f"我说: {result['greeting']}",
+                memory_type="working",
+                importance=0.4,
+                metadata={
+                    "speaker": npc_name,
+                    "player_id": player_id,
+                    "session_id": player_id,
+                    "timestamp": get_clock().now().isoformat(),
+                    "affinity": affinity,
+                    "context": {
+                        "interaction_type": "greeting",
+                        "npc_name": npc_name
+                    }
+                }
+            )
+        return result
+
+    def _warm_llm_connection(self):
+        """预热LLM连接(建立或保持连接池中的长连接, 首轮对话不再等待TCP/TLS握手)"""
+        if self.llm is None or time.monotonic() - self._llm_warmed_at < settings.PREWARM_CONNECTION_INTERVAL:
+            return
+        self._llm_warmed_at = time.monotonic()
+        try:
+            with span("llm.warm_connection"):
+                self.llm._client.models.list()
+        except Exception as e:
+            print(f"⚠️  预热LLM连接失败: {e}")
+
+    def _generate_opening_line(self, npc_name:str, agent:SimpleAgent, entry:Dict)->Optional[str]:
+        """生成NPC主动打招呼的开场白(不写入会话历史)"""
+        prompt = entry["affinity"][0] if entry["affinity"] else ""
+        memory_context = self._build_memory_context(entry["memories"] or [])
+        if memory_context:
+            prompt += f"{memory_context}\n\n"
+        prompt += "【当前情景】\n玩家走到你面前,还没有开口。请主动说一句简短的开场白(20字以内)。"
+        try:
+            with span("llm.opening_line"), llm_slot("opening_line"):
+                line = self.llm.invoke([
+                    {"role": "system", "content": agent.system_prompt or ""},
+                    {"role": "user", "content": prompt}
+                ]).strip()
+            record_llm_call("opening_line", (agent.system_prompt or "") + prompt, line)
+            return line or None
         except Exception as e:
-            print(f"❌ {npc_name}对话失败: {e}")
-            import traceback
-            traceback.print_exc()
-            return f"抱歉,我现在有点忙,等会儿再聊吧。(错误: {str(e)})"
+            print(f"❌ {npc_name}开场白生成失败: {e}")
+            return None
 
     def get_npc_info(self, npc_name:str)->Dict[str, str]:
         """获取NPC信息"""
 
-        if npc_name not in NPC_ROLES:
+        role = self.roster.get(npc_name)
+        if role is None:
             return {}
 
-        role = NPC_ROLES[npc_name]
         return {
             "name": npc_name,
             "title": role["title"],
             "location": role["location"],
             "activity": role["activity"],
-            "available": self.agents.get(npc_name) is not None
+            "available": self.agents.get(npc_name) is not None or not self.owns(npc_name)
         }
 
     def get_all_npcs(self)->list:
         """获取所有的NPC信息"""
-        return [self.get_npc_info(name) for name in NPC_ROLES.keys()]
+        return [self.get_npc_info(name) for name in self.roster.names()]
 
-    def get_npc_memories(self, npc_name:str, player_id:str = "player", limit:int = 10)->List[Dict]:
-        """获取NPC的记忆列表(用于调试与展示)"""
-        if npc_name not in self.memories:
-            return []
-
-        memory_manager = self.memories[npc_name]
+    def get_npc_memories(
+            self,
+            npc_name:str,
+            limit:int = 10,
+            cursor:Optional[str] = None,
+            player_id:Optional[str] = None,
+            memory_type:Optional[str] = None,
+            since:Optional[datetime] = None,
+            until:Optional[datetime] = None,
+            min_importance:float = 0.0
+    )->Dict:
+        """
+        分页获取NPC的记忆列表(用于调试与展示, 按时间倒序的索引查询, 不做相关度检索)
+        :param cursor: 上一页返回的 next_cursor
+        :param player_id: 只返回该玩家的记忆
+        :param memory_type: 只返回该类型(working/episodic)
+        :param since: 最早时间(含)
+        :param until: 最晚时间(不含)
+        :param min_importance: 最低重要性
+        :return: {"memories": [...], "next_cursor": 下一页游标或None}
+        :raises ValueError: 游标无效
+        """
+        memory_manager = self.memories.get(npc_name)
         if not memory_manager:
-            return []
-
-        try:
-            # 检索所有的记忆
-            memories = memory_manager.retrieve_memories(
-                query="", # 空查询返回所有的记忆
-                memory_types=["working", "episodic"],
-                limit=limit
-            )
+            return {"memories": [], "next_cursor": None}
+
+        memories, next_cursor = memory_manager.store.page(
+            npc_name,
+            limit,
+            cursor=cursor,
+            player_id=player_id,
+            memory_type=memory_type,
+            since=since.timestamp() if since else None,
+            until=until.timestamp() if until else None,
+            min_importance=min_importance
+        )
 
-            # 转化为字典格式
-            memory_list = []
-            for memory in memories:
-                memory_list.append({
-                    "id": memory.id,
-                    "content": memory.content,
-                    "type": memory.memory_type,
-                    "importance": memory.importance,
-                    "timestamp": memory.timestamp.isoformat(),
-                    "metadata": memory.metadata
-                })
-
-            return memory_list
-        except Exception as e:
-            print(f"❌ 获取{npc_name}记忆失败: {e}")
-            return []
+        # 转化为字典格式
+        memory_list = []
+        for memory in memories:
+            memory_list.append({
+                "id": memory.id,
+                "content": memory.content,
+                "type": memory.memory_type,
+                "importance": memory.importance,
+                "timestamp": memory.timestamp.isoformat(),
+                "metadata": memory.metadata
+            })
+
+        return {"memories": memory_list, "next_cursor": next_cursor}
+
+    def clear_player_memories(self, player_id:str)->int:
+        """
+        删除玩家在所有NPC中的记忆
+        :return: 删除条数
+        """
+        deleted = get_memory_store().delete_player(player_id)
+        print(f"✅ 已删除玩家{player_id}的记忆: {deleted}条")
+        return deleted
 
     def clear_npc_memory(self, npc_name:str, memory_type:Optional[str] = None):
         """清空NPC的记忆(用于调试)"""
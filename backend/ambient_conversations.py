@@ -0,0 +1,293 @@
+"""NPC之间的环境对话 - 同一地点的NPC进行简短的多轮对话, 一次LLM调用批量生成多组, 逐句播放
+
+- 按 location 分组(每组2-AMBIENT_CONVERSATION_MAX_PARTICIPANTS人); 独自一人的NPC可由其他NPC过来搭话(AMBIENT_CONVERSATION_VISITS)
+- 一次调用为所有空闲的对话组各生成一段对话(参照 NPCBatchGenerator 的批量提示词)
+- 每隔 AMBIENT_CONVERSATION_TURN_INTERVAL 每段对话播放一句, 通过状态快照发布给客户端; 一次生成可播放数分钟
+- 附近没有玩家时暂停播放, 超过 AMBIENT_CONVERSATION_TTL 未播放完的对话丢弃
+- 统计生成和实际播放(可见)的句数, 结合LLM token计算每句可见台词的成本
+"""
+
+import asyncio
+import itertools
+import random
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from batch_generator import NPCBatchGenerator
+from clock import get_clock
+from config import settings
+from json_extractor import extract_json_object
+from llm_limiter import llm_slot
+from metrics import AMBIENT_LINES, record_llm_call
+from roster import get_roster
+from tracing import span
+
+
+class AmbientConversationEngine:
+    """
+    NPC环境对话引擎
+
+    功能:
+    1. 按地点规划对话组, 批量生成多组多轮对话
+    2. 逐句播放(每段对话每次一句), 附近没有玩家时暂停; 生成在后台任务中进行, 不影响播放节奏
+    3. 记录对话中的NPC(不再为其生成独白)
+    """
+
+    def __init__(
+            self,
+            batch_generator:NPCBatchGenerator,
+            publish:Callable[[Dict[str, str]], None],
+            active_npcs:Callable[[], Optional[List[str]]]
+    ):
+        """
+        :param batch_generator: 批量生成器(LLM、场景上下文和NPC描述)
+        :param publish: 发布台词 {npc_name: line}
+        :param active_npcs: 当前附近有玩家的NPC, None表示全部
+        """
+        self.batch_generator = batch_generator
+        self.publish = publish
+        self.active_npcs = active_npcs
+        self.roster = get_roster()
+        self.clock = get_clock()
+        self.enabled = settings.AMBIENT_CONVERSATIONS_ENABLED and batch_generator.enabled
+
+        # 进行中的对话: {"id", "location", "participants", "turns": [(speaker, line)], "next", "created"}
+        self._conversations:List[Dict] = []
+        self._ids = itertools.count(1)
+        self._retry_at = 0.0
+        self._task:Optional[asyncio.Task] = None
+        # 进行中的批量生成(同一时间最多一个)及其参与的NPC
+        self._generating:Optional[asyncio.Task] = None
+        self._generating_npcs:Set[str] = set()
+
+        self._stats_lock = threading.Lock()
+        self.stats:Dict[str, int] = {"batches": 0, "failures": 0, "conversations": 0, "expired": 0}
+
+        self.roster.subscribe(self._on_roster_changed)
+
+    @property
+    def active(self)->int:
+        """进行中的对话数"""
+        return len(self._conversations)
+
+    def busy_npcs(self)->Set[str]:
+        """正在对话(含暂停和生成中)的NPC"""
+        busy = {name for conversation in self._conversations for name in conversation["participants"]}
+        return busy | self._generating_npcs
+
+    def _count(self, key:str, amount:int = 1):
+        """累加生成统计(线程安全)"""
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _location(self, npc_name:str)->Optional[str]:
+        role = self.roster.get(npc_name)
+        return role["location"] if role else None
+
+    def plan_groups(self, npc_names:List[str])->List[Dict]:
+        """
+        规划对话组: 同一地点的空闲NPC为一组; 独自一人的NPC与其他空闲NPC(优先附近没有玩家的)组成来访对话
+        :param npc_names: 附近有玩家的NPC
+        :return: [{"location", "participants", "visitor"}]
+        """
+        busy = self.busy_npcs()
+        by_location:Dict[str, List[str]] = {}
+        for name in npc_names:
+            if name not in busy and self._location(name):
+                by_location.setdefault(self._location(name), []).append(name)
+
+        groups, hosts = [], []
+        size = settings.AMBIENT_CONVERSATION_MAX_PARTICIPANTS
+        for location, names in by_location.items():
+            for index in range(0, len(names), size):
+                chunk = names[index:index + size]
+                if len(chunk) >= 2:
+                    groups.append({"location": location, "participants": chunk, "visitor": None})
+                else:
+                    hosts.extend(chunk)
+
+        if settings.AMBIENT_CONVERSATION_VISITS and hosts:
+            taken = busy | {name for group in groups for name in group["participants"]}
+            others = [name for name in self.roster.names() if name not in taken and name not in hosts]
+            random.shuffle(others)
+            candidates = others + random.sample(hosts, len(hosts))
+            used:Set[str] = set()
+            for host in hosts:
+                if host in used:
+                    continue
+                visitor = next((name for name in candidates if name != host and name not in used), None)
+                if visitor is None:
+                    break
+                used.update((host, visitor))
+                groups.append({"location": self._location(host), "participants": [host, visitor], "visitor": visitor})
+
+        return groups[:settings.AMBIENT_CONVERSATION_MAX_GROUPS]
+
+    def _build_prompt(self, groups:List[Dict], context:str)->str:
+        """批量生成提示词"""
+        group_lines = []
+        for index, group in enumerate(groups, start=1):
+            visit = f"({group['visitor']}刚走过来找{group['participants'][0]})" if group["visitor"] else ""
+            group_lines.append(f"{index}. 地点: {group['location']}, 参与者: {'、'.join(group['participants'])}{visit}")
+            group_lines.extend(f"   {self.batch_generator._describe_npc(name)}" for name in group["participants"])
+        group_text = "\n".join(group_lines)
+
+        return f"""
+        请为Datawhale办公室里的{len(groups)}组同事各写一段简短的对话。
+
+        【场景】{context}
+
+        【对话组】
+{group_text}
+
+        【生成要求】
+        1. 每组{settings.AMBIENT_CONVERSATION_TURNS}句左右, 参与者轮流发言, 每句10-30字
+        2. 话题符合各自的角色设定、当前活动和场景氛围, 像真实的同事闲聊或讨论工作
+        3. 说话人必须是该组的参与者
+        4. **必须严格按照JSON格式返回**
+
+        【输出格式】(键为对话组编号, 每句为[说话人, 台词])
+        {{"1": [["说话人", "台词"], ["说话人", "台词"]], "2": [...]}}
+
+        请生成(只返回JSON,不要其他内容):
+        """
+
+    def _parse_response(self, response:str, groups:List[Dict])->List[Dict]:
+        """解析批量响应, 只保留说话人属于该组、至少两句的对话"""
+        parsed = extract_json_object(response or "")
+        if not isinstance(parsed, dict):
+            print(f"⚠️  无法解析环境对话响应: {(response or '')[:100]}...")
+            return []
+
+        conversations = []
+        for index, group in enumerate(groups, start=1):
+            turns = [
+                (turn[0], turn[1].strip())
+                for turn in parsed.get(str(index)) or []
+                if isinstance(turn, list) and len(turn) == 2 and turn[0] in group["participants"]
+                and isinstance(turn[1], str) and turn[1].strip()
+            ]
+            if len(turns) >= 2:
+                conversations.append({
+                    "id": next(self._ids),
+                    "location": group["location"],
+                    "participants": group["participants"],
+                    "turns": turns,
+                    "next": 0,
+                    "created": self.clock.monotonic()
+                })
+        return conversations
+
+    def generate(self, groups:List[Dict])->List[Dict]:
+        """
+        一次LLM调用生成多组对话(在线程池中调用)
+        :return: 生成的对话, 失败时为空
+        """
+        context = self.batch_generator._get_current_contexts()
+        prompt = self._build_prompt(groups, context)
+        messages = [
+            {"role": "system", "content": "你是一个游戏NPC对话生成器,擅长创作自然真实的办公室对话。"},
+            {"role": "user", "content": prompt}
+        ]
+
+        self._count("batches")
+        try:
+            # 输出上限按每句一个NPC台词的预估token计算(批量生成器的LLM默认上限按独白分片设置)
+            max_tokens = len(groups) * settings.AMBIENT_CONVERSATION_TURNS * settings.BATCH_COMPLETION_TOKENS_PER_NPC
+            with span("llm.ambient_conversations", groups=len(groups)), llm_slot("conversation"):
+                response = self.batch_generator.llm.invoke(messages, max_tokens=max_tokens)
+            record_llm_call("conversation", messages[0]["content"] + prompt, response or "")
+            conversations = self._parse_response(response, groups)
+        except Exception as e:
+            print(f"❌ 环境对话生成失败: {e}")
+            conversations = []
+
+        if not conversations:
+            self._count("failures")
+        lines = sum(len(conversation["turns"]) for conversation in conversations)
+        AMBIENT_LINES.inc(lines, "conversation", "generated")
+        self._count("conversations", len(conversations))
+        print(f"💬 环境对话生成: {len(conversations)}/{len(groups)}组, 共{lines}句")
+        return conversations
+
+    async def tick(self)->Optional[asyncio.Task]:
+        """
+        播放一轮(每段对话一句), 有空闲的对话组且没有进行中的生成时, 在后台任务中批量生成新对话
+        :return: 本轮启动的生成任务(没有时为None)
+        """
+        now = self.clock.monotonic()
+        active = self.active_npcs()
+        active_set = set(self.roster.names() if active is None else active)
+
+        updates:Dict[str, str] = {}
+        remaining = []
+        for conversation in self._conversations:
+            left = len(conversation["turns"]) - conversation["next"]
+            if now - conversation["created"] > settings.AMBIENT_CONVERSATION_TTL:
+                # 长时间没有玩家经过, 未播放的台词作废
+                self._count("expired")
+                AMBIENT_LINES.inc(left, "conversation", "expired")
+                continue
+            if active_set.intersection(conversation["participants"]):
+                speaker, line = conversation["turns"][conversation["next"]]
+                updates[speaker] = line
+                conversation["next"] += 1
+                left -= 1
+            if left > 0:
+                remaining.append(conversation)
+        self._conversations = remaining
+
+        if updates:
+            self.publish(updates)
+
+        if now < self._retry_at or self._generating is not None:
+            return None
+        groups = self.plan_groups([name for name in self.roster.names() if name in active_set])
+        if not groups:
+            return None
+        self._generating_npcs = {name for group in groups for name in group["participants"]}
+        self._generating = asyncio.create_task(self._generate_in_background(groups))
+        return self._generating
+
+    async def _generate_in_background(self, groups:List[Dict]):
+        """在线程中批量生成, 完成后加入播放队列(播放循环照常按间隔推进)"""
+        try:
+            conversations = await asyncio.to_thread(self.generate, groups)
+        finally:
+            self._generating = None
+            self._generating_npcs = set()
+        if conversations:
+            self._conversations.extend(conversations)
+        else:
+            self._retry_at = self.clock.monotonic() + settings.AMBIENT_CONVERSATION_RETRY_INTERVAL
+
+    def _on_roster_changed(self, diff:Dict):
+        """名册热加载回调: 丢弃有NPC被移除或设定变化的对话"""
+        changed = set(diff["removed"]) | set(diff["changed"])
+        self._conversations = [c for c in self._conversations if not changed.intersection(c["participants"])]
+
+    def start(self):
+        """启动逐句播放"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._play_loop())
+
+    async def stop(self):
+        for task in (self._task, self._generating):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+
+    async def _play_loop(self):
+        while True:
+            try:
+                await self.tick()
+                await self.clock.sleep(settings.AMBIENT_CONVERSATION_TURN_INTERVAL)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"❌ 环境对话播放失败: {e}")
+                await self.clock.sleep(settings.AMBIENT_CONVERSATION_TURN_INTERVAL)
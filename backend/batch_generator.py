@@ -1,8 +1,10 @@
 """批量NPC对话生成器"""
 
-import sys, os, json
-from datetime import datetime
-from typing import Dict, Optional
+import sys, os, json, time
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 
 from urllib3 import Retry
 
@@ -10,7 +12,14 @@ from urllib3 import Retry
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'HelloAgents'))
 
 from hello_agents import HelloAgentsLLM
-from agents import NPC_ROLES
+from roster import get_roster
+from clock import get_clock
+from config import settings
+from json_extractor import IncrementalJSONExtractor, extract_json_object
+from llm_limiter import llm_slot
+from metrics import BATCH_SECONDS, BATCH_SHARD_SECONDS, estimate_tokens, record_llm_call
+from tracing import span
+
 
 class NPCBatchGenerator:
     """
@@ -23,7 +32,8 @@ class NPCBatchGenerator:
         print("🎨 正在初始化批量对话生成器...")
 
         try:
-            self.llm = HelloAgentsLLM()
+            # 输出上限即单个分片的输出token预算(分片规划保证预估输出不超过此值)
+            self.llm = HelloAgentsLLM(max_tokens=settings.BATCH_COMPLETION_TOKEN_BUDGET)
             self.enabled = True
             print("✅ 批量生成器初始化成功")
         except Exception as e:
@@ -32,35 +42,50 @@ class NPCBatchGenerator:
             self.llm = None
             self.enabled = False
 
-        self.npc_configs = NPC_ROLES
-
-        # 预设对话库(当LLM不可用时使用)
-        self.preset_dialogues = {
-            "morning": {
-                "张三": "早上好!今天要继续优化那个多智能体系统的性能。",
-                "李四": "新的一天开始了,先整理一下今天的会议安排。",
-                "王五": "早!先来杯咖啡提提神,然后开始设计新界面。"
-            },
-            "noon": {
-                "张三": "写了一上午代码,终于把那个bug修复了!",
-                "李四": "上午的需求评审会很顺利,下午继续推进。",
-                "王五": "这个配色方案看起来不错,再调整一下细节。"
-            },
-            "afternoon": {
-                "张三": "下午继续写代码,这个算法还需要优化一下。",
-                "李四": "正在准备下周的产品规划会,需求文档快完成了。",
-                "王五": "设计稿基本完成了,等会儿发给大家看看。"
-            },
-            "evening": {
-                "张三": "今天的代码提交完成,明天继续!",
-                "李四": "今天的工作差不多了,整理一下明天的待办事项。",
-                "王五": "设计工作告一段落,明天再继续优化。"
-            }
+        # NPC名册(角色设定和预设对话均来自数据文件)
+        self.roster = get_roster()
+        self.roster.subscribe(self._on_roster_changed)
+
+        # 最近一次成功生成的对话(用于补全缺失NPC)
+        self.last_dialogues:Dict[str, str] = {}
+
+        # 生成统计(分片在线程池中并行生成, 更新时加锁)
+        self._stats_lock = threading.Lock()
+        self.stats:Dict[str, int] = {
+            "batches": 0,  # 批量生成次数
+            "repaired_batches": 0,  # 存在缺失NPC并被修复的批次
+            "regenerated_npcs": 0,  # 通过补充调用重新生成的NPC数
+            "cache_filled_npcs": 0,  # 使用缓存/预设兜底的NPC数
+            "shards": 0,  # 分片调用次数
+            "failed_shards": 0  # 失败的分片数
         }
 
+        # 最近一次批量生成的分片报告
+        self.last_shard_report:List[Dict] = []
+
+    def _count(self, key:str, amount:int = 1):
+        """累加生成统计(线程安全)"""
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    @property
+    def npc_configs(self)->Dict[str, Dict[str, str]]:
+        """当前名册中的NPC设定(热加载后自动更新)"""
+        return self.roster.roles
+
+    @property
+    def preset_dialogues(self)->Dict[str, Dict[str, str]]:
+        """预设对话库(当LLM不可用时使用)"""
+        return self.roster.presets
+
+    def _on_roster_changed(self, diff:Dict):
+        """名册热加载回调: 清理已移除或设定变化的NPC的缓存对话"""
+        for name in diff["removed"] + diff["changed"]:
+            self.last_dialogues.pop(name, None)
+
     def _get_preset_dialogues(self)->Dict[str, str]:
         """获取预设的对话"""
-        hour = datetime.now().hour
+        hour = get_clock().now().hour
 
         if 6 <= hour < 12:
             period = "morning"
@@ -75,7 +100,7 @@ class NPCBatchGenerator:
 
     def _get_current_contexts(self)->str:
         """根据当前时间推断上下文"""
-        hour = datetime.now().hour
+        hour = get_clock().now().hour
 
         if 6 <= hour < 9:
             return "清晨时分,大家陆续到达办公室,准备开始新的一天"
@@ -90,22 +115,71 @@ class NPCBatchGenerator:
         else:
             return "夜晚时分,办公室安静下来,偶尔还有人在加班"
 
-    def _build_batch_prompt(self, context:Optional[str] = None)->str:
-        """构建批量生成提示词"""
+    def _describe_npc(self, name:str)->str:
+        """提示词中的单个NPC描述"""
+        cfg = self.npc_configs[name]
+        return f"- {name}({cfg['title']}): 在{cfg['location']}{cfg['activity']},性格{cfg['personality']}"
+
+    @staticmethod
+    def _format_entry(name:str)->str:
+        """输出格式中的单个NPC条目"""
+        return f'"{name}": "..."'
+
+    def _plan_shards(self, npc_names:List[str], context:str)->List[List[str]]:
+        """
+        按token预算将NPC划分为多个分片
+        每个分片的提示词和预估输出都不超过预算, 每个分片至少包含1个NPC
+        :param npc_names: 全部NPC名称
+        :param context: 场景上下文
+        :return: 分片列表
+        """
+        base_tokens = estimate_tokens(self._build_batch_prompt(context, []))
+        prompt_budget = settings.BATCH_PROMPT_TOKEN_BUDGET
+        completion_budget = settings.BATCH_COMPLETION_TOKEN_BUDGET
+        completion_per_npc = settings.BATCH_COMPLETION_TOKENS_PER_NPC
+
+        shards:List[List[str]] = []
+        current:List[str] = []
+        prompt_tokens = base_tokens
+        completion_tokens = 0
+
+        for name in npc_names:
+            npc_tokens = estimate_tokens(self._describe_npc(name)) + estimate_tokens(self._format_entry(name))
+
+            if current and (prompt_tokens + npc_tokens > prompt_budget or
+                            completion_tokens + completion_per_npc > completion_budget):
+                shards.append(current)
+                current = []
+                prompt_tokens = base_tokens
+                completion_tokens = 0
+
+            current.append(name)
+            prompt_tokens += npc_tokens
+            completion_tokens += completion_per_npc
+
+        if current:
+            shards.append(current)
+        return shards
+
+    def _build_batch_prompt(self, context:Optional[str] = None, npc_names:Optional[List[str]] = None)->str:
+        """
+        构建批量生成提示词
+        :param context: 场景上下文
+        :param npc_names: 需要生成的NPC(默认全部)
+        """
         # 根据时间自动推断场景
         if context is None:
             context = self._get_current_contexts()
 
-        # 构建NPC描述
-        npc_descriptions = []
-        for name, cfg in self.npc_configs.items():
-            desc = f"- {name}({cfg['title']}): 在{cfg['location']}{cfg['activity']},性格{cfg['personality']}"
-            npc_descriptions.append(desc)
+        if npc_names is None:
+            npc_names = list(self.npc_configs.keys())
 
-        npc_desc_text = "\n".join(npc_descriptions)
+        # 构建NPC描述
+        npc_desc_text = "\n".join(self._describe_npc(name) for name in npc_names)
+        output_format = ", ".join(self._format_entry(name) for name in npc_names)
 
         prompt = f"""
-        请为Datawhale办公室的6个NPC生成当前的对话或行为描述。
+        请为Datawhale办公室的{len(npc_names)}个NPC生成当前的对话或行为描述。
 
         【场景】{context}
 
@@ -120,8 +194,8 @@ class NPCBatchGenerator:
         5. 可以体现一些个性化特点和情绪
         6. **必须严格按照JSON格式返回**
 
-        【输出格式】(严格遵守)
-        {{"张三": "...", "李四": "...", "王五": "..."}}
+        【输出格式】(严格遵守,必须包含以上每一个NPC)
+        {{{output_format}}}
 
         【示例输出】
         {{"张三": "这个bug真是见鬼了,已经调试两小时了...", "李四": "嗯,这个功能的优先级需要重新评估一下。", "王五": "这杯咖啡的拉花真不错,灵感来了!"}}
@@ -131,68 +205,263 @@ class NPCBatchGenerator:
         return prompt
 
     def _parse_response(self, response:str)->Optional[Dict[str, str]]:
-        """解析LLM响应"""
+        """
+        解析LLM响应
+        只保留有效的NPC对话(名称存在且内容为非空字符串), 缺失的NPC由调用方补充
+        """
+        response = response or ""
         try:
             # 尝试直接解析json
-            dialogues = json.loads(response)
+            parsed = json.loads(response)
+        except json.JSONDecodeError:
+            # 尝试从多余文字中提取json部分(支持嵌套括号,跳过损坏的键值对)
+            parsed = extract_json_object(response)
+
+        if not isinstance(parsed, dict):
+            print(f"⚠️  无法解析响应: {response[:100]}...")
+            return None
 
-            # 验证格式
-            if isinstance(dialogues, dict) and all (name in dialogues for name in self.npc_configs.keys()):
-                return dialogues
+        # 验证格式
+        dialogues = {
+            name: line.strip()
+            for name, line in parsed.items()
+            if name in self.npc_configs and isinstance(line, str) and line.strip()
+        }
+        if not dialogues:
+            print(f"⚠️  JSON格式不正确: {parsed}")
+            return None
+
+        return dialogues
+
+    def _stream_generate(
+            self,
+            messages:List[Dict[str, str]],
+            on_dialogue:Callable[[str, str], None]
+    )->str:
+        """
+        流式调用LLM, 每个NPC的对话闭合后立即回调
+        :param messages: 对话消息
+        :param on_dialogue: 回调函数(npc_name, dialogue)
+        :return: 完整的LLM输出
+        """
+        extractor = IncrementalJSONExtractor()
+        chunks = []
+
+        for chunk in self.llm.stream_invoke(messages):
+            if not chunk:
+                continue
+            chunks.append(chunk)
+
+            # 与 _parse_response 相同的规范化: 去掉首尾空白, 跳过空对话
+            for npc_name, dialogue in extractor.feed(chunk):
+                if npc_name in self.npc_configs and isinstance(dialogue, str) and dialogue.strip():
+                    on_dialogue(npc_name, dialogue.strip())
+
+        return "".join(chunks)
+
+    def _invoke(
+            self,
+            npc_names:List[str],
+            context:Optional[str] = None,
+            on_dialogue:Optional[Callable[[str, str], None]] = None
+    )->Optional[Dict[str, str]]:
+        """
+        调用LLM为指定NPC生成对话
+        :param npc_names: NPC名称列表
+        :param context: 场景上下文
+        :param on_dialogue: 流式回调
+        :return: 解析后的有效对话, 解析失败返回None
+        """
+        # 构建批量提示词
+        prompt = self._build_batch_prompt(context, npc_names)
+
+        messages = [
+            {"role": "system", "content": "你是一个游戏NPC对话生成器,擅长创作自然真实的办公室对话。"},
+            {"role": "user", "content": prompt}
+        ]
+
+        # 一次调用LLM生成所有对话(有回调时使用流式输出,边生成边发布)
+        with span("llm.batch", npcs=len(npc_names), stream=on_dialogue is not None), llm_slot("batch"):
+            if on_dialogue is not None and hasattr(self.llm, "stream_invoke"):
+                response = self._stream_generate(messages, on_dialogue)
             else:
-                print(f"⚠️  JSON格式不正确: {dialogues}")
-                return None
-        except json.JSONDecodeError:
-            # 尝试提取json部分
-            try:
-                start = response.find('{')
-                end = response.rfind('}') + 1
+                response = self.llm.invoke(messages)
+        record_llm_call("batch", messages[0]["content"] + prompt, response or "")
+
+        # 解析json响应
+        return self._parse_response(response)
+
+    def _fallback_dialogue(self, npc_name:str)->str:
+        """获取单个NPC的兜底对话: 上次生成的对话 > 预设对话 > 根据角色活动拼接"""
+        if npc_name in self.last_dialogues:
+            return self.last_dialogues[npc_name]
+
+        preset = self._get_preset_dialogues()
+        if npc_name in preset:
+            return preset[npc_name]
+
+        cfg = self.npc_configs.get(npc_name)
+        if cfg is None:
+            return ""
+        return f"在{cfg['location']}{cfg['activity']}中..."
+
+    def _repair_missing(
+            self,
+            dialogues:Dict[str, str],
+            missing:List[str],
+            context:Optional[str] = None,
+            on_dialogue:Optional[Callable[[str, str], None]] = None
+    )->Dict[str, str]:
+        """
+        补全批量结果中缺失的NPC: 先用一次小规模调用重新生成, 仍缺失的使用缓存兜底
+        :param dialogues: 已有的有效对话
+        :param missing: 缺失的NPC名称
+        :return: 补全后的对话
+        """
+        self._count("repaired_batches")
+        print(f"🔧 批量结果缺少{len(missing)}个NPC({', '.join(missing)}),尝试补充生成...")
 
-                if start != -1 and end > start:
-                    json_str = response[start:end]
-                    dialogues = json.loads(json_str)
+        try:
+            regenerated = self._invoke(missing, context, on_dialogue) or {}
+        except Exception as e:
+            print(f"❌ 补充生成失败: {e}")
+            regenerated = {}
+
+        repaired = dict(dialogues)
+        for npc_name in missing:
+            if npc_name in regenerated:
+                repaired[npc_name] = regenerated[npc_name]
+                self._count("regenerated_npcs")
+            else:
+                dialogue = self._fallback_dialogue(npc_name)
+                repaired[npc_name] = dialogue
+                self._count("cache_filled_npcs")
+                if on_dialogue is not None:
+                    on_dialogue(npc_name, dialogue)
+
+        return repaired
+
+    def _generate_shard(
+            self,
+            index:int,
+            npc_names:List[str],
+            context:str,
+            on_dialogue:Optional[Callable[[str, str], None]] = None
+    )->Dict:
+        """
+        生成单个分片的对话, 失败时只降级本分片的NPC
+        :return: {"dialogues", "report"}
+        """
+        start = time.perf_counter()
+        status = "ok"
 
-                    if isinstance(dialogues, dict):
-                        return dialogues
-            except:
-                pass
+        with span("batch.shard", shard=index, npcs=len(npc_names)) as shard_span:
+            try:
+                dialogues = self._invoke(npc_names, context, on_dialogue)
+            except Exception as e:
+                print(f"❌ 分片{index}生成失败: {e}")
+                dialogues = None
 
-            print(f"⚠️  无法解析响应: {response[:100]}...")
-            return None
+            if dialogues:
+                # 部分NPC缺失时保留有效结果,只补全缺失的NPC
+                missing = [name for name in npc_names if name not in dialogues]
+                if missing:
+                    with span("batch.repair", missing=len(missing)):
+                        dialogues = self._repair_missing(dialogues, missing, context, on_dialogue)
+                    status = "repaired"
+            else:
+                # 整个分片失败,本分片NPC使用兜底对话
+                status = "failed"
+                self._count("failed_shards")
+                dialogues = {}
+                for name in npc_names:
+                    dialogues[name] = self._fallback_dialogue(name)
+                    self._count("cache_filled_npcs")
+                    if on_dialogue is not None:
+                        on_dialogue(name, dialogues[name])
+            shard_span.set("status", status)
+
+        latency = time.perf_counter() - start
+        BATCH_SHARD_SECONDS.observe(latency, status)
+        latency_ms = latency * 1000
+        return {
+            "dialogues": dialogues,
+            "report": {
+                "shard": index,
+                "npcs": len(npc_names),
+                "status": status,
+                "latency_ms": round(latency_ms, 1)
+            }
+        }
 
-    def generate_batch_dialogue(self, context:Optional[str] = None)->Dict[str, str]:
+    def generate_batch_dialogue(
+            self,
+            context:Optional[str] = None,
+            on_dialogue:Optional[Callable[[str, str], None]] = None,
+            npc_names:Optional[List[str]] = None
+    )->Dict[str, str]:
         """
-        批量生成所有NPC的对话
+        批量生成NPC的对话
+        NPC较多时按token预算自动分片, 在LLM并发上限内并行生成后合并
         :param context: 场景上下文
+        :param on_dialogue: 流式回调(npc_name, dialogue), 每个NPC的对话生成完毕后立即调用
+        :param npc_names: 只生成这些NPC的对话(默认全部)
         :return: Dict[str, str]: NPC名称到对话内容的映射
         """
+        if npc_names is None:
+            npc_names = list(self.npc_configs.keys())
+        else:
+            npc_names = [name for name in npc_names if name in self.npc_configs]
+
+        if not npc_names:
+            return {}
 
         if not self.enabled or self.llm is None:
             # 使用预设对话
-            return self._get_preset_dialogues()
+            preset = self._get_preset_dialogues()
+            return {name: preset[name] for name in npc_names if name in preset}
 
-        try:
-            # 构建批量提示词
-            prompt = self._build_batch_prompt(context)
+        self._count("batches")
+        start = time.perf_counter()
 
-            # 一次调用LLM生成提示词
-            response = self.llm.invoke([
-                {"role": "system", "content": "你是一个游戏NPC对话生成器,擅长创作自然真实的办公室对话。"},
-                {"role": "user", "content": prompt}
-            ])
+        # 所有分片共享同一场景
+        if context is None:
+            context = self._get_current_contexts()
 
-            # 解析json响应
-            dialogues = self._parse_response(response)
+        shards = self._plan_shards(npc_names, context)
+        self._count("shards", len(shards))
 
-            if dialogues:
-                print(f"✅ 批量生成成功: {len(dialogues)}个NPC对话")
-                return dialogues
-            else:
-                print("⚠️  解析失败,使用预设对话")
-                return self._get_preset_dialogues()
-        except Exception as e:
-            print(f"❌ 批量生成失败: {e}")
-            return self._get_preset_dialogues()
+        if len(shards) == 1:
+            results = [self._generate_shard(0, shards[0], context, on_dialogue)]
+        else:
+            workers = max(1, min(settings.LLM_MAX_CONCURRENCY, len(shards)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-shard") as pool:
+                # 每个分片在当前上下文的副本中运行(追踪片段挂在同一请求下)
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self._generate_shard, index, names, context, on_dialogue)
+                    for index, names in enumerate(shards)
+                ]
+                results = [future.result() for future in futures]
+
+        # 合并各分片结果
+        dialogues:Dict[str, str] = {}
+        for result in results:
+            dialogues.update(result["dialogues"])
+        self.last_shard_report = [result["report"] for result in results]
+        BATCH_SECONDS.observe(time.perf_counter() - start)
+
+        if all(report["status"] == "failed" for report in self.last_shard_report):
+            print("⚠️  所有分片生成失败,使用兜底对话")
+        else:
+            self.last_dialogues.update(dialogues)
+            print(f"✅ 批量生成成功: {len(dialogues)}个NPC对话")
+
+        if len(shards) > 1:
+            for report in self.last_shard_report:
+                print(f"   🧩 分片{report['shard']}: {report['npcs']}个NPC, "
+                      f"{report['latency_ms']:.0f}ms ({report['status']})")
+
+        return dialogues
 
 
 # 全局单例
@@ -0,0 +1,121 @@
+"""世界时钟 - 游戏内时间的统一来源, 可替换为虚拟时钟加速运行或单步推进模拟
+
+默认使用系统时钟; 配置 CLOCK_SPEED / CLOCK_START 时使用从指定时刻起按倍速流逝的虚拟时钟(服务整体加速运行),
+无头模拟(simulation.py)使用手动推进的虚拟时钟, 不等待真实时间即可跑完游戏内的数天
+
+只用于游戏内时间: 时段上下文、定时更新、记忆时间戳、好感度历史、问候语过期、玩家位置上报有效期等;
+日志文件、请求追踪、共享状态租约、连接保活等运维相关的计时仍使用真实时间
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from config import settings
+
+
+class SystemClock:
+    """系统时钟(真实时间)"""
+
+    def now(self)->datetime:
+        return datetime.now()
+
+    def time(self)->float:
+        return time.time()
+
+    def monotonic(self)->float:
+        return time.monotonic()
+
+    async def sleep(self, seconds:float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    虚拟时钟
+
+    speed > 0: 从 start 起按 speed 倍速随真实时间流逝, sleep 按倍速缩短
+    speed = 0: 时间只由 advance() 推进(单步模拟), sleep 等到时间被推进到目标时刻为止
+    两种模式都可以用 advance() 向前跳
+    """
+
+    def __init__(self, start:Optional[datetime] = None, speed:float = 1.0):
+        """
+        :param start: 游戏内起始时刻, 默认当前时间
+        :param speed: 时间流逝倍速, 0表示只手动推进
+        """
+        self.start = start or datetime.now()
+        self.speed = speed
+        self._origin = time.monotonic()
+        self._offset = 0.0  # advance() 推进的秒数
+
+        # 单步模式下等待中的sleep: (唤醒时刻, 序号, 事件循环, future)
+        self._waiters:List[Tuple[float, int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def elapsed(self)->float:
+        """自起始时刻经过的游戏内秒数"""
+        return (time.monotonic() - self._origin) * self.speed + self._offset
+
+    def now(self)->datetime:
+        return self.start + timedelta(seconds=self.elapsed())
+
+    def time(self)->float:
+        return self.start.timestamp() + self.elapsed()
+
+    def monotonic(self)->float:
+        return self._origin + self.elapsed()
+
+    async def sleep(self, seconds:float):
+        if self.speed > 0:
+            await asyncio.sleep(max(seconds, 0) / self.speed)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            heapq.heappush(self._waiters, (self.elapsed() + seconds, next(self._sequence), loop, future))
+        await future
+
+    def advance(self, seconds:float):
+        """向前推进游戏内时间, 唤醒到期的sleep"""
+        with self._lock:
+            self._offset += max(seconds, 0)
+            elapsed = self.elapsed()
+            due = []
+            while self._waiters and self._waiters[0][0] <= elapsed:
+                due.append(heapq.heappop(self._waiters))
+
+        for _, _, loop, future in due:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def advance_to(self, moment:datetime):
+        """推进到指定时刻(已过去时不动)"""
+        self.advance((moment - self.now()).total_seconds())
+
+
+# 全局单例
+_clock = None
+
+def get_clock():
+    """获取世界时钟(配置了倍速或起始时刻时为虚拟时钟)"""
+    global _clock
+    if _clock is None:
+        if settings.CLOCK_SPEED != 1 or settings.CLOCK_START:
+            start = datetime.fromisoformat(settings.CLOCK_START) if settings.CLOCK_START else None
+            _clock = VirtualClock(start, settings.CLOCK_SPEED)
+            print(f"⏱️  使用虚拟时钟 (起始 {_clock.start.isoformat(timespec='seconds')}, {settings.CLOCK_SPEED}倍速)")
+        else:
+            _clock = SystemClock()
+    return _clock
+
+
+def set_clock(clock):
+    """替换世界时钟(模拟和测试用, 应在创建各管理器之前调用)"""
+    global _clock
+    _clock = clock
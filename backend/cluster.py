@@ -0,0 +1,81 @@
+"""NPC分片集群启动器 - 在本机启动多个后端进程, 按一致性哈希分配NPC
+
+每个进程监听独立端口(第一个进程使用API_PORT, 客户端配置不变), 共享同一个状态数据库:
+- 只有一个进程(leader)批量生成环境对话, 所有进程提供同一份状态快照和好感度
+- 每个NPC的Agent和记忆只在一个进程中加载, 其他进程收到的对话请求转发给它
+- 进程退出后其NPC在心跳过期后由其余进程接管
+
+使用方法:
+  python cluster.py                 # 按CPU核数启动
+  python cluster.py --shards 4      # 启动4个进程(端口8000-8003)
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from config import settings
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def start_shards(count:int, host:str, base_port:int)->List[subprocess.Popen]:
+    """
+    启动分片进程
+    :param count: 进程数
+    :param host: 监听地址
+    :param base_port: 第一个进程的端口, 其余依次递增
+    """
+    advertise_host = "127.0.0.1" if host in ("0.0.0.0", "::") else host
+    processes = []
+    for index in range(count):
+        port = base_port + index
+        env = dict(os.environ)
+        env.update({
+            "SHARED_STATE_ENABLED": "true",
+            "SHARDING_ENABLED": "true",
+            "SHARD_URL": f"http://{advertise_host}:{port}"
+        })
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port)],
+            cwd=BACKEND_DIR, env=env
+        ))
+        print(f"🧩 分片{index}: http://{advertise_host}:{port} (pid {processes[-1].pid})")
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NPC分片集群启动器")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2, help="进程数(默认CPU核数)")
+    parser.add_argument("--host", default=settings.API_HOST)
+    parser.add_argument("--port", type=int, default=settings.API_PORT, help="第一个进程的端口")
+    args = parser.parse_args()
+
+    processes = start_shards(args.shards, args.host, args.port)
+
+    def shutdown(*_):
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        # 任一进程退出时其余进程继续服务(其NPC在心跳过期后被接管)
+        while any(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown()
+        for process in processes:
+            process.wait()
+        print("🛑 集群已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,108 @@ class Settings:
 
     # NPC 配置
     NPC_UPDATE_INTERVAL = 30  # NPC状态更新间隔(秒)
+    NPC_ROSTER_FILE: str = os.getenv(
+        "NPC_ROSTER_FILE", os.path.join(os.path.dirname(__file__), "data", "npc_roster.json")
+    )  # NPC名册文件(角色设定+预设对话)
+    NPC_ROSTER_RELOAD_INTERVAL = 5  # 名册热加载检查间隔(秒)
+    INTEREST_MANAGEMENT_ENABLED = True  # 只为玩家附近的NPC生成环境对话
+    PLAYER_PRESENCE_TTL = 90  # 玩家位置上报有效期(秒),超时视为离开
+    STATUS_CHANGELOG_SIZE = 1000  # 状态增量变化日志长度,客户端落后更多时全量同步
+    EVENT_LOOP_LAG_INTERVAL = 0.5  # 事件循环延迟采样间隔(秒)
+    RESPONSE_CACHE_MAX_ENTRIES = 2048  # 预序列化响应缓存的最大条目数(按LRU淘汰)
+
+    # NPC之间的环境对话配置 (同一地点的NPC多轮对话, 批量生成后通过状态快照逐句播放)
+    AMBIENT_CONVERSATIONS_ENABLED: bool = os.getenv("AMBIENT_CONVERSATIONS_ENABLED", "true").lower() == "true"
+    AMBIENT_CONVERSATION_TURNS = 8  # 每段对话的句数
+    AMBIENT_CONVERSATION_TURN_INTERVAL = 15  # 逐句播放间隔(秒), 不应短于客户端轮询状态的间隔
+    AMBIENT_CONVERSATION_MAX_PARTICIPANTS = 3  # 每段对话的最多参与人数
+    AMBIENT_CONVERSATION_MAX_GROUPS = 6  # 一次批量生成的最多对话组数
+    AMBIENT_CONVERSATION_VISITS = True  # 独自一人的NPC可由其他NPC过来搭话(否则只有同一地点的NPC对话)
+    AMBIENT_CONVERSATION_TTL = 600  # 对话超过该时长(秒)仍未播放完则丢弃(附近没有玩家时暂停播放)
+    AMBIENT_CONVERSATION_RETRY_INTERVAL = 60  # 生成失败后的重试间隔(秒)
+
+    # 世界时钟配置 (游戏内时间, 见 clock.py)
+    CLOCK_SPEED: float = float(os.getenv("CLOCK_SPEED", "1"))  # 游戏时间流逝倍速(100表示真实1秒=游戏内100秒)
+    CLOCK_START = os.getenv("CLOCK_START")  # 游戏内起始时刻(ISO格式), 为空时从当前时间开始
+
+    # 多进程共享状态配置 (uvicorn --workers N 时启用)
+    API_WORKERS: int = int(os.getenv("API_WORKERS", "1"))  # 直接运行main.py时的worker进程数
+    SHARED_STATE_ENABLED: bool = os.getenv("SHARED_STATE_ENABLED", "false").lower() == "true"  # 对话快照/好感度/位置存入共享SQLite
+    SHARED_STATE_DB: str = os.getenv(
+        "SHARED_STATE_DB", os.path.join(os.path.dirname(__file__), "memory_data", "shared_state.db")
+    )  # 共享状态数据库文件
+    SHARED_STATE_POLL_INTERVAL = 1.0  # 从共享存储同步对话快照和好感度变化的间隔(秒)
+    SHARED_STATE_LEASE_TTL = 15.0  # leader租约有效期(秒),leader退出或卡住超过此时间后由其他worker接管
+
+    # NPC分片配置 (每个进程只加载一部分NPC的Agent和记忆, /chat转发到拥有该NPC的进程)
+    SHARDING_ENABLED: bool = os.getenv("SHARDING_ENABLED", "false").lower() == "true"  # 需同时启用SHARED_STATE_ENABLED
+    SHARD_URL: str = os.getenv("SHARD_URL", "")  # 本进程对外地址, 如 http://127.0.0.1:8001
+    SHARD_HEARTBEAT_TTL = 10.0  # 分片心跳有效期(秒),超时未续期的进程视为下线, 其NPC重新分配
+    SHARD_VIRTUAL_NODES = 64  # 一致性哈希每个进程的虚拟节点数
+    SHARD_FORWARD_TIMEOUT = 120.0  # 转发请求到其他分片的超时(秒)
+
+    # 记忆配置
+    MEMORY_DB_FILE: str = os.getenv(
+        "MEMORY_DB_FILE", os.path.join(os.path.dirname(__file__), "memory_data", "memories.db")
+    )  # 所有NPC的记忆数据库(SQLite+FTS5全文索引)
+    WORKING_MEMORY_TTL_MINUTES = 120  # 工作记忆有效期(分钟),超过后只检索情景记忆
+    WORKING_MEMORY_CAPACITY: int = int(os.getenv("WORKING_MEMORY_CAPACITY", "10"))  # 每个(NPC, 玩家)保留的工作记忆条数
+    EPISODIC_MEMORY_CAPACITY: int = int(os.getenv("EPISODIC_MEMORY_CAPACITY", "100"))  # 每个(NPC, 玩家)保留的情景记忆条数
+    MEMORY_FORGETTING_THRESHOLD = 0.3  # 超出容量时先遗忘重要性低于此值的记忆,其次遗忘最早的
+
+    # Agent会话历史配置 (每个NPC的Agent被所有玩家共用, 历史需要限制大小)
+    AGENT_HISTORY_MAX_TURNS: int = int(os.getenv("AGENT_HISTORY_MAX_TURNS", "6"))  # 保留原文的最近轮数
+    AGENT_HISTORY_TOKEN_BUDGET: int = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "800"))  # 保留原文的历史token上限
+    AGENT_HISTORY_SUMMARY_CHARS = 200  # 更早对话的滚动摘要字数上限
+
+    # 对话预热配置 (玩家走近NPC时客户端调用 /npcs/{npc_name}/prewarm)
+    PREWARM_TTL = 60  # 预热结果(好感度上下文、最近记忆)的有效期(秒), 期间的首轮对话直接使用
+    PREWARM_CONNECTION_INTERVAL = 30  # 预热LLM连接的最小间隔(秒), 连接池保持长连接
+    PREWARM_OPENING_LINE: bool = os.getenv("PREWARM_OPENING_LINE", "false").lower() == "true"  # 预热时生成NPC开场白(每次多一次LLM调用)
+
+    # 问候语池配置 (打开对话时NPC按好感度等级打招呼, 后台预先生成)
+    GREETING_POOL_SIZE = 4  # 每个好感度等级生成的问候语句数(轮换使用)
+    GREETING_MAX_AGE: int = int(os.getenv("GREETING_MAX_AGE", "21600"))  # 问候语超过该时长(秒)视为过期, 重新生成
+    GREETING_REFRESH_INTERVAL = 300  # 检查过期问候语的间隔(秒)
+
+    # 世界状态快照配置 (重启时恢复好感度、当前对话和Agent会话历史)
+    WORLD_SNAPSHOT_ENABLED: bool = os.getenv("WORLD_SNAPSHOT_ENABLED", "true").lower() == "true"  # 共享状态模式下不使用
+    WORLD_SNAPSHOT_FILE: str = os.getenv(
+        "WORLD_SNAPSHOT_FILE", os.path.join(os.path.dirname(__file__), "memory_data", "world_snapshot.bin")
+    )  # 快照文件(二进制, 内存映射加载)
+    WORLD_SNAPSHOT_INTERVAL = 300  # 定时快照间隔(秒), 关闭服务时也会写入
 
     # LLM配置 (从环境变量读取)
     LLM_MODEL_ID: str = os.getenv("LLM_MODEL_ID", "Qwen/Qwen2.5-72B-Instruct")
     LLM_API_KEY: Optional[str] = os.getenv("LLM_API_KEY")
     LLM_BASE_URL: str = os.getenv("LLM_BASE_URL", "https://api-inference.modelscope.cn/v1/")
 
+    # 批量生成配置
+    BATCH_PROMPT_TOKEN_BUDGET: int = int(os.getenv("BATCH_PROMPT_TOKEN_BUDGET", "3000"))  # 单个分片提示词token上限
+    BATCH_COMPLETION_TOKEN_BUDGET: int = int(os.getenv("BATCH_COMPLETION_TOKEN_BUDGET", "1500"))  # 单个分片输出token上限
+    BATCH_COMPLETION_TOKENS_PER_NPC = 60  # 每个NPC一句话(20-40字)的预估输出token
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # 进程内全部LLM调用(对话/分析/批量/问候语/摘要等)的最大并发数
+    LLM_INTERACTIVE_RESERVED: int = int(os.getenv("LLM_INTERACTIVE_RESERVED", "1"))  # 其中为玩家对话路径(对话/好感度分析/开场白)保留的名额, 后台生成不可占用
+
+    # 好感度分析配置
+    AFFINITY_RULE_ENABLED: bool = os.getenv("AFFINITY_RULE_ENABLED", "true").lower() == "true"  # 启用本地规则快速判定
+    AFFINITY_RULE_THRESHOLD: float = float(os.getenv("AFFINITY_RULE_THRESHOLD", "0.8"))  # 规则置信度阈值,低于此值调用LLM
+    AFFINITY_VERDICT_RECORDING: bool = os.getenv("AFFINITY_VERDICT_RECORDING", "false").lower() == "true"  # 记录LLM判定(离线评估用)
+    AFFINITY_VERDICT_SHADOW_RATE: float = float(os.getenv("AFFINITY_VERDICT_SHADOW_RATE", "0.2"))  # 记录时规则命中的消息按此比例同时调用LLM对照
+    AFFINITY_VERDICT_MAX_BYTES: int = int(os.getenv("AFFINITY_VERDICT_MAX_BYTES", str(50 * 1024 * 1024)))  # 判定记录文件上限,超过后不再追加
+
+    # 日志配置
+    LOGS_DIR: str = os.getenv(
+        "LOGS_DIR", os.path.join(os.path.dirname(__file__), "logs")
+    )  # 对话日志、好感度判定记录和追踪文件(traces/)所在目录
+    LOG_QUEUE_SIZE = 10000  # 日志队列长度,写入跟不上时丢弃并计数
+    LOG_CONSOLE: bool = os.getenv("LOG_CONSOLE", "true").lower() == "true"  # 后台线程同时输出到控制台
+
+    # 追踪配置
+    TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "true").lower() == "true"  # 记录请求追踪(LOGS_DIR/traces)
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # 随机采样比例
+    TRACE_SLOW_MS: float = float(os.getenv("TRACE_SLOW_MS", "5000"))  # 超过此耗时的请求总是保留
+
     # CORS配置
     CORS_ORIGINS = ["*"]  # 生产环境应限制具体域名
 
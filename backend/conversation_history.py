@@ -0,0 +1,201 @@
+"""NPC Agent会话历史管理 - 保留最近几轮原文, 更早的对话压缩为滚动摘要
+
+每个NPC的Agent在进程内常驻且被所有玩家共用, SimpleAgent.run 每轮都会追加历史,
+不加限制时提示词和内存随运行时间无限增长:
+- 每轮对话后只保留最近 AGENT_HISTORY_MAX_TURNS 轮, 且总token不超过 AGENT_HISTORY_TOKEN_BUDGET
+- 保存的玩家消息只保留原话(好感度和记忆上下文每轮都会重新检索, 无需留在历史中)
+- 移出的旧对话在后台线程中由LLM合并进该NPC的滚动摘要(不在请求路径上), 摘要附加在系统提示词末尾
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from hello_agents import HelloAgentsLLM, SimpleAgent
+from hello_agents.core.message import Message
+
+from config import settings
+from llm_limiter import llm_slot
+from metrics import estimate_tokens, record_llm_call
+
+# 系统提示词中摘要段的标题
+SUMMARY_HEADER = "【之前的对话摘要】"
+
+
+def _turns(history:List[Message])->List[List[Message]]:
+    """按轮切分历史(每轮从一条玩家消息开始)"""
+    turns:List[List[Message]] = []
+    for message in history:
+        if message.role == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def _tokens(messages:List[Message])->int:
+    return sum(estimate_tokens(message.content) for message in messages)
+
+
+class ConversationHistoryManager:
+    """
+    会话历史管理器
+
+    功能:
+    1. 每轮对话后裁剪Agent历史(轮数和token预算)
+    2. 后台线程把移出的对话合并进滚动摘要
+    3. 提供各NPC历史大小统计(运行指标)
+    """
+
+    def __init__(self, llm:Optional[HelloAgentsLLM]):
+        """
+        :param llm: 生成摘要的LLM(为空时移出的对话直接丢弃)
+        """
+        self.llm = llm
+        self.max_turns = settings.AGENT_HISTORY_MAX_TURNS
+        self.token_budget = settings.AGENT_HISTORY_TOKEN_BUDGET
+
+        self.summaries:Dict[str, str] = {}
+        self._agents:Dict[str, SimpleAgent] = {}
+        self._base_prompts:Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        # 单线程执行摘要任务: 同一NPC的摘要按顺序合并
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._pending = 0
+        self.stats:Dict[str, int] = {"summaries": 0, "failures": 0, "evicted_turns": 0}
+
+    def attach(self, npc_name:str, agent:SimpleAgent):
+        """登记NPC的Agent(创建或重建后调用), 已有摘要时附加到系统提示词"""
+        with self._lock:
+            self._agents[npc_name] = agent
+            self._base_prompts[npc_name] = agent.system_prompt or ""
+            self._apply_summary(npc_name)
+
+    def detach(self, npc_name:str):
+        """NPC移出本进程时释放(摘要保留, 重新加载时继续使用)"""
+        with self._lock:
+            self._agents.pop(npc_name, None)
+            self._base_prompts.pop(npc_name, None)
+
+    def trim(self, npc_name:str, agent:SimpleAgent, player_message:Optional[str] = None, player_id:str = "player"):
+        """
+        裁剪Agent历史(每轮对话后调用)
+        :param player_message: 本轮玩家原话, 替换历史中带上下文的完整提示
+        :param player_id: 玩家ID(Agent被所有玩家共用, 历史中标注说话的玩家)
+        """
+        history = agent.get_history()
+        if player_message is not None:
+            for index in range(len(history) - 1, -1, -1):
+                if history[index].role == "user":
+                    history[index] = Message(
+                        f"玩家{player_id}: {player_message}", "user", timestamp=history[index].timestamp
+                    )
+                    break
+
+        turns = _turns(history)
+        kept:List[List[Message]] = []
+        tokens = 0
+        for turn in reversed(turns):
+            turn_tokens = _tokens(turn)
+            if kept and (len(kept) >= self.max_turns or tokens + turn_tokens > self.token_budget):
+                break
+            kept.append(turn)
+            tokens += turn_tokens
+        kept.reverse()
+
+        evicted = [message for turn in turns[:len(turns) - len(kept)] for message in turn]
+        agent.clear_history()
+        for turn in kept:
+            for message in turn:
+                agent.add_message(message)
+
+        if evicted:
+            self.stats["evicted_turns"] += len(turns) - len(kept)
+            if self.llm:
+                with self._lock:
+                    self._pending += 1
+                try:
+                    future = self._executor.submit(self._summarize, npc_name, evicted)
+                except RuntimeError:
+                    # 已停止: 移出的对话直接丢弃
+                    self._task_done(None)
+                    return
+                # 执行完成或停止时被取消都会回调, 等待数始终归零
+                future.add_done_callback(self._task_done)
+
+    def _task_done(self, future:Optional[Future]):
+        """摘要任务结束(完成、失败或被取消)"""
+        with self._lock:
+            self._pending -= 1
+
+    def _summarize(self, npc_name:str, evicted:List[Message]):
+        """把移出的对话合并进滚动摘要(后台线程)"""
+        try:
+            previous = self.summaries.get(npc_name, "")
+            transcript = "\n".join(
+                message.content if message.role == "user" else f"{npc_name}: {message.content}"
+                for message in evicted
+            )
+            prompt = f"""你是{npc_name}, 请把下面的对话记录合并进已有的对话摘要, 供之后的对话参考。
+
+【已有摘要】
+{previous or "无"}
+
+【新的对话记录】
+{transcript}
+
+【要求】
+- 用第一人称, 保留与各玩家聊过的话题、约定和对方的偏好, 注明是哪位玩家
+- 不超过{settings.AGENT_HISTORY_SUMMARY_CHARS}字, 只输出摘要本身"""
+            with llm_slot("history_summary"):
+                summary = self.llm.invoke([{"role": "user", "content": prompt}]).strip()
+            record_llm_call("history_summary", prompt, summary)
+            if not summary:
+                raise ValueError("摘要为空")
+
+            with self._lock:
+                self.summaries[npc_name] = summary[:settings.AGENT_HISTORY_SUMMARY_CHARS * 2]
+                self._apply_summary(npc_name)
+            self.stats["summaries"] += 1
+        except Exception as e:
+            # 摘要失败时保留旧摘要, 移出的对话不再进入提示词(仍保存在记忆库中)
+            self.stats["failures"] += 1
+            print(f"❌ {npc_name}会话摘要失败: {e}")
+
+    def _apply_summary(self, npc_name:str):
+        """把摘要附加到系统提示词(调用方持有 _lock)"""
+        agent = self._agents.get(npc_name)
+        summary = self.summaries.get(npc_name)
+        if agent is None or not summary:
+            return
+        agent.system_prompt = f"{self._base_prompts[npc_name]}\n    {SUMMARY_HEADER}\n    {summary}\n"
+
+    def restore_summaries(self, summaries:Dict[str, str]):
+        """从世界快照恢复摘要"""
+        with self._lock:
+            self.summaries.update(summaries)
+            for npc_name in summaries:
+                self._apply_summary(npc_name)
+
+    def history_sizes(self)->Dict[str, Dict[str, int]]:
+        """各NPC的历史大小 {npc_name: {"messages", "tokens", "summary_tokens"}}"""
+        with self._lock:
+            agents = list(self._agents.items())
+        return {
+            npc_name: {
+                "messages": len(agent.get_history()),
+                "tokens": _tokens(agent.get_history()),
+                "summary_tokens": estimate_tokens(self.summaries.get(npc_name, ""))
+            }
+            for npc_name, agent in agents
+        }
+
+    @property
+    def pending(self)->int:
+        """等待合并的摘要任务数"""
+        return self._pending
+
+    def stop(self):
+        """停止摘要线程(未执行的任务取消, 取消的任务同样从等待数中扣除)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,274 @@
+"""NPC问候语池 - 后台为每个NPC的5个好感度等级预先生成问候语, 打开对话时直接取用
+
+大多数对话的第一句是NPC按好感度等级打招呼, 内容可预测:
+- 每个NPC一次LLM调用生成全部5个等级的问候语(陌生/熟悉/友好/亲密/挚友), 每个等级若干句轮换使用
+- 定时检查, 超过 GREETING_MAX_AGE 或角色设定已变化的问候语视为过期, 后台重新生成
+- 过期的问候语在重新生成前仍可使用(计入过期取用次数)
+- 共享状态模式(多worker)下只有批量生成leader调用LLM, 生成后发布到共享存储, 其余worker轮询读取
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from hello_agents import HelloAgentsLLM
+
+from clock import get_clock
+from config import settings
+from json_extractor import extract_json_object
+from llm_limiter import llm_slot
+from metrics import record_llm_call
+from roster import get_roster
+from shared_state import get_shared_state
+from state_manager import LEADER_LEASE
+
+# 共享状态模式下问候语池在共享存储中的键
+SHARED_POOL_KEY = "greeting_pool"
+
+# 各好感度等级的代表值(陌生/熟悉/友好/亲密/挚友), 等级名称和对话风格取自好感度管理器
+LEVEL_AFFINITIES = (10.0, 30.0, 50.0, 70.0, 90.0)
+
+
+class GreetingPool:
+    """
+    问候语池
+
+    功能:
+    1. 后台按NPC批量生成各好感度等级的问候语
+    2. 按好感度等级轮换取用
+    3. 跟踪过期情况(生成时间、角色设定变化), 定时重新生成
+    4. 共享状态模式下由leader生成并发布, 其余worker同步
+    """
+
+    def __init__(self, llm:Optional[HelloAgentsLLM], relationship_manager, owns:Callable[[str], bool]):
+        """
+        :param llm: 生成问候语的LLM(为空时问候语池为空)
+        :param relationship_manager: 好感度管理器(等级名称和对话风格)
+        :param owns: NPC是否由本进程负责(未启用共享状态时只生成本进程的NPC)
+        """
+        self.llm = llm
+        self.relationship = relationship_manager
+        self.owns = owns
+        self.roster = get_roster()
+        self.clock = get_clock()
+        self.shared_state = get_shared_state()
+
+        # {npc_name: {"levels": {level: [greeting]}, "generated_at": 时间戳, "signature": 角色设定摘要}}
+        self._pool:Dict[str, Dict] = {}
+        self._cursor:Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._task:Optional[asyncio.Task] = None
+        # 上次从共享存储读取的问候语池(内容未变化时不重新解析)
+        self._shared_raw:Optional[str] = None
+
+        self._stats_lock = threading.Lock()
+        self.stats:Dict[str, int] = {"served": 0, "served_stale": 0, "missing": 0, "generated": 0, "failures": 0}
+
+    def _count(self, key:str):
+        """累加取用和生成统计(线程安全)"""
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def is_generator(self)->bool:
+        """本进程是否负责生成问候语(共享状态模式下只有持有leader租约的worker生成)"""
+        store = self.shared_state
+        return store is None or store.lease_owner(LEADER_LEASE) == store.worker_id
+
+    def levels(self)->List[Tuple[str, str]]:
+        """全部好感度等级 [(等级名称, 对话风格)]"""
+        return [
+            (self.relationship.get_affinity_level(affinity), self.relationship.get_affinity_modifier(affinity))
+            for affinity in LEVEL_AFFINITIES
+        ]
+
+    def _signature(self, npc_name:str)->str:
+        """角色设定摘要(设定变化后旧问候语视为过期)"""
+        role = self.roster.get(npc_name) or {}
+        return hashlib.md5(json.dumps(role, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_stale(self, npc_name:str)->bool:
+        """NPC的问候语是否缺失或过期"""
+        entry = self._pool.get(npc_name)
+        return (
+            entry is None
+            or self.clock.time() - entry["generated_at"] > settings.GREETING_MAX_AGE
+            or entry["signature"] != self._signature(npc_name)
+        )
+
+    def get(self, npc_name:str, affinity:float)->Optional[Dict]:
+        """
+        按好感度取一句问候语(同一等级的问候语轮换使用)
+        :return: {"greeting", "level", "stale"}, 没有可用问候语时返回None
+        """
+        level = self.relationship.get_affinity_level(affinity)
+        entry = self._pool.get(npc_name)
+        greetings = entry["levels"].get(level) if entry else None
+        if not greetings:
+            self._count("missing")
+            return None
+
+        with self._lock:
+            index = self._cursor.get((npc_name, level), 0)
+            self._cursor[(npc_name, level)] = index + 1
+        stale = self.is_stale(npc_name)
+        self._count("served")
+        if stale:
+            self._count("served_stale")
+        return {"greeting": greetings[index % len(greetings)], "level": level, "stale": stale}
+
+    def generate(self, npc_name:str)->bool:
+        """
+        生成NPC全部等级的问候语(一次LLM调用)
+        :return: 是否成功
+        """
+        role = self.roster.get(npc_name)
+        if role is None or self.llm is None:
+            return False
+
+        levels = self.levels()
+        level_lines = "\n".join(f"- {level}: {modifier}" for level, modifier in levels)
+        prompt = f"""你是Datawhale办公室的{role['title']}{npc_name}。
+性格: {role['personality']}
+说话风格: {role['style']}
+爱好: {role['hobbies']}
+
+玩家走到你面前时, 你会按与玩家的关系主动打招呼。请为下面每个关系等级各写{settings.GREETING_POOL_SIZE}句不同的开场白,
+每句15-30字, 符合你的角色和该等级的对话风格:
+{level_lines}
+
+只输出JSON, 格式: {{"等级名称": ["开场白1", "开场白2"]}}"""
+
+        try:
+            with llm_slot("greeting_pool"):
+                response = self.llm.invoke([{"role": "user", "content": prompt}])
+            record_llm_call("greeting_pool", prompt, response)
+            parsed = extract_json_object(response) or {}
+            pool = {
+                level: [str(line).strip() for line in parsed.get(level, []) if str(line).strip()]
+                for level, _ in levels
+            }
+            if not any(pool.values()):
+                raise ValueError("没有解析到问候语")
+        except Exception as e:
+            self._count("failures")
+            print(f"❌ {npc_name}问候语生成失败: {e}")
+            return False
+
+        with self._lock:
+            # 解析失败的等级沿用旧问候语
+            previous = self._pool.get(npc_name, {}).get("levels", {})
+            self._pool[npc_name] = {
+                "levels": {level: lines or previous.get(level, []) for level, lines in pool.items()},
+                "generated_at": self.clock.time(),
+                "signature": self._signature(npc_name)
+            }
+        self._count("generated")
+        return True
+
+    def refresh(self)->int:
+        """
+        重新生成缺失或过期的问候语
+        共享状态模式下非leader只同步共享存储中的问候语池; leader先同步(接管后不重复生成未过期的问候语),
+        为全部NPC生成(分片时问候语请求转发到NPC所在分片, 各分片都从共享存储读取)并发布
+        :return: 成功生成的NPC数
+        """
+        if self.shared_state:
+            self.sync_from_shared()
+            if not self.is_generator():
+                return 0
+
+        for npc_name in list(self._pool):
+            if npc_name not in self.roster.roles:
+                self._pool.pop(npc_name, None)
+
+        targets = [
+            name for name in self.roster.names()
+            if (self.shared_state or self.owns(name)) and self.is_stale(name)
+        ]
+        generated = sum(1 for name in targets if self.generate(name))
+        if targets:
+            print(f"👋 问候语池已刷新: {generated}/{len(targets)}个NPC")
+        if self.shared_state and generated:
+            self.publish()
+        return generated
+
+    def publish(self):
+        """把问候语池发布到共享存储(leader生成后调用)"""
+        raw = json.dumps(self.export(), ensure_ascii=False)
+        self.shared_state.set_meta(SHARED_POOL_KEY, raw)
+        self._shared_raw = raw
+
+    def sync_from_shared(self)->bool:
+        """
+        读取leader发布的问候语池, 合并到本地(同一NPC保留较新生成的问候语)
+        :return: 是否有更新
+        """
+        raw = self.shared_state.get_meta(SHARED_POOL_KEY)
+        if raw is None or raw == self._shared_raw:
+            return False
+        pool = json.loads(raw)
+        with self._lock:
+            for npc_name, entry in pool.items():
+                current = self._pool.get(npc_name)
+                if current is None or entry["generated_at"] >= current["generated_at"]:
+                    self._pool[npc_name] = entry
+        self._shared_raw = raw
+        return True
+
+    def pool_stats(self)->Dict:
+        """问候语池状态(本进程负责的NPC): 新鲜/过期/缺失数, 最旧问候语的时长"""
+        names = [name for name in self.roster.names() if self.owns(name)]
+        missing = sum(1 for name in names if name not in self._pool)
+        stale = sum(1 for name in names if name in self._pool and self.is_stale(name))
+        ages = [self.clock.time() - self._pool[name]["generated_at"] for name in names if name in self._pool]
+        return {
+            "fresh": len(names) - missing - stale,
+            "stale": stale,
+            "missing": missing,
+            "oldest_age_seconds": max(ages) if ages else 0.0
+        }
+
+    def export(self)->Dict[str, Dict]:
+        """导出问候语池(写世界快照用)"""
+        with self._lock:
+            return dict(self._pool)
+
+    def restore(self, pool:Dict[str, Dict]):
+        """从世界快照恢复(保留生成时间, 过期的问候语下次检查时重新生成)"""
+        with self._lock:
+            self._pool.update(pool)
+
+    def start(self):
+        """启动后台刷新(立即补齐缺失的问候语)"""
+        if self.llm is not None and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        # 共享状态模式下按同步间隔轮询: 非leader读取共享的问候语池, leader仍按刷新间隔生成(当选后立即检查)
+        interval = settings.SHARED_STATE_POLL_INTERVAL if self.shared_state else settings.GREETING_REFRESH_INTERVAL
+        next_refresh = 0.0
+        while True:
+            try:
+                if not self.is_generator():
+                    await asyncio.to_thread(self.sync_from_shared)
+                    next_refresh = 0.0
+                elif self.clock.time() >= next_refresh:
+                    next_refresh = self.clock.time() + settings.GREETING_REFRESH_INTERVAL
+                    await asyncio.to_thread(self.refresh)
+                await self.clock.sleep(interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"❌ 问候语池刷新失败: {e}")
+                await self.clock.sleep(interval)
@@ -0,0 +1,97 @@
+"""兴趣区域管理 - 只为活跃玩家附近的NPC生成环境对话"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from clock import get_clock
+from roster import NPCRoster
+
+
+class InterestManager:
+    """
+    兴趣区域管理器
+
+    功能:
+    1. 记录玩家上报的所在区域和附近NPC(超过TTL未上报的玩家视为离开)
+    2. 维护 区域 -> 玩家 的位置索引
+    3. 计算当前需要生成对话的NPC集合
+    """
+
+    def __init__(self, ttl:float = 90):
+        """
+        初始化兴趣区域管理器
+        :param ttl: 玩家上报有效期(游戏内秒数)
+        """
+        self.ttl = ttl
+        self.clock = get_clock()
+
+        # 玩家状态: {player_id: {"location", "nearby_npcs", "last_seen"}}
+        self._players:Dict[str, Dict] = {}
+        # 位置索引: {location: {player_id}}
+        self._players_by_location:Dict[str, Set[str]] = {}
+        # 是否收到过上报(从未上报时退回全量生成,兼容旧客户端)
+        self.has_reports = False
+
+        self._lock = threading.Lock()
+
+    def _remove_player(self, player_id:str):
+        """从索引中移除玩家(调用方持有锁)"""
+        state = self._players.pop(player_id, None)
+        if state and state["location"]:
+            players = self._players_by_location.get(state["location"])
+            if players is not None:
+                players.discard(player_id)
+                if not players:
+                    del self._players_by_location[state["location"]]
+
+    def _expire(self, now:float):
+        """移除超时未上报的玩家(调用方持有锁)"""
+        expired = [pid for pid, state in self._players.items() if now - state["last_seen"] > self.ttl]
+        for player_id in expired:
+            self._remove_player(player_id)
+
+    def report(self, player_id:str, location:Optional[str] = None, nearby_npcs:Optional[Iterable[str]] = None):
+        """
+        玩家上报位置
+        :param player_id: 玩家ID
+        :param location: 玩家所在区域(与NPC的location一致)
+        :param nearby_npcs: 玩家附近/视野内的NPC名称
+        """
+        with self._lock:
+            self._remove_player(player_id)
+            self._players[player_id] = {
+                "location": location,
+                "nearby_npcs": set(nearby_npcs or []),
+                "last_seen": self.clock.monotonic()
+            }
+            if location:
+                self._players_by_location.setdefault(location, set()).add(player_id)
+            self.has_reports = True
+
+    def leave(self, player_id:str):
+        """玩家离线"""
+        with self._lock:
+            self._remove_player(player_id)
+
+    def active_player_count(self)->int:
+        """当前活跃玩家数"""
+        with self._lock:
+            self._expire(self.clock.monotonic())
+            return len(self._players)
+
+    def active_npcs(self, roster:NPCRoster)->List[str]:
+        """
+        计算活跃玩家附近的NPC
+        :param roster: NPC名册(提供按位置的索引)
+        :return: NPC名称列表(按名册顺序)
+        """
+        with self._lock:
+            self._expire(self.clock.monotonic())
+
+            active:Set[str] = set()
+            for location in self._players_by_location:
+                active.update(roster.find_by_location(location))
+            for state in self._players.values():
+                active.update(state["nearby_npcs"])
+
+        return [name for name in roster.roles if name in active]
@@ -0,0 +1,130 @@
+"""增量JSON提取器 - 从(流式)LLM输出中提取JSON对象的键值对"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalJSONExtractor:
+    """
+    增量JSON对象提取器
+
+    功能:
+    1. 逐块喂入LLM输出, 每个顶层键值对闭合时立即返回
+    2. 跳过JSON前后的说明文字、代码块标记等多余内容
+    3. 正确处理嵌套的 {} / [] 和字符串中的括号、转义字符
+    4. 单个键值对格式错误时只丢弃该键值对, 不影响其他键值对
+    """
+
+    def __init__(self):
+        self._buffer = ""  # 当前未闭合键值对的文本(对象外时为待扫描文本)
+        self._scan_pos = 0  # buffer中已扫描的位置
+        self._depth = 0  # 括号嵌套深度(0表示在对象外)
+        self._in_string = False
+        self._escape = False
+        self._object_pairs = 0  # 当前对象已解析的键值对数量
+
+        self.result:Dict[str, Any] = {}
+        self.done = False  # 是否已提取到完整对象
+
+    @staticmethod
+    def _parse_pair(segment:str)->Optional[Tuple[str, Any]]:
+        """解析单个 "key": value 片段"""
+        if not segment.strip():
+            return None
+        try:
+            parsed = json.loads("{" + segment + "}")
+        except ValueError:
+            return None
+        if len(parsed) != 1:
+            return None
+        return next(iter(parsed.items()))
+
+    def feed(self, chunk:str)->List[Tuple[str, Any]]:
+        """
+        喂入一段文本
+        :param chunk: LLM输出片段
+        :return: 本次新闭合的键值对列表
+        """
+        if self.done or not chunk:
+            return []
+
+        pairs = []
+        buf = self._buffer + chunk
+        i = self._scan_pos
+
+        while i < len(buf):
+            ch = buf[i]
+
+            # 对象外: 跳过说明文字,直到遇到 {
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._object_pairs = 0
+                    buf = buf[i + 1:]
+                    i = 0
+                    continue
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    # 顶层对象闭合
+                    pair = self._parse_pair(buf[:i])
+                    if pair:
+                        pairs.append(pair)
+                        self._object_pairs += 1
+                    buf = buf[i + 1:]
+                    i = 0
+                    if self._object_pairs:
+                        self.done = True
+                        break
+                    # 空对象或说明文字中的 {},继续寻找下一个对象
+                    continue
+            elif ch == ',' and self._depth == 1:
+                pair = self._parse_pair(buf[:i])
+                if pair:
+                    pairs.append(pair)
+                    self._object_pairs += 1
+                buf = buf[i + 1:]
+                i = 0
+                continue
+
+            i += 1
+
+        # 对象外已扫描的文字无需保留
+        if self._depth == 0:
+            buf = ""
+            i = 0
+
+        self._buffer = buf
+        self._scan_pos = i
+
+        for key, value in pairs:
+            self.result[key] = value
+        return pairs
+
+
+def extract_json_object(text:str)->Optional[Dict[str, Any]]:
+    """
+    从文本中提取第一个JSON对象(容忍前后多余文字和部分损坏的键值对)
+    :param text: LLM完整输出
+    :return: 提取到的字典, 没有任何有效键值对时返回None
+    """
+    if not text:
+        return None
+
+    extractor = IncrementalJSONExtractor()
+    extractor.feed(text)
+    return extractor.result or None
@@ -0,0 +1,89 @@
+"""LLM并发限制 - 进程内所有LLM调用共用一个信号量, 同时进行的调用不超过 LLM_MAX_CONCURRENCY
+
+对话、好感度分析、批量生成(含分片和补充调用)、问候语池、环境对话、会话摘要、开场白预热都经过这里,
+超出上限的调用在线程中排队等待, 避免突发请求同时打到LLM服务触发限流;
+其中 LLM_INTERACTIVE_RESERVED 个名额只给玩家对话路径使用, 后台生成占满其余名额时玩家对话仍可立即调用
+(排队会阻塞调用线程, 只能在工作线程中使用, 不能在事件循环中调用)
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable
+
+from config import settings
+from metrics import LLM_WAIT_SECONDS
+
+# 玩家对话路径上的调用方(可使用保留名额), 其余调用方均为后台生成
+INTERACTIVE_CALLERS = frozenset({"chat", "affinity", "opening_line"})
+
+
+class LLMLimiter:
+    """
+    LLM并发限制器
+
+    功能:
+    1. 限制同时进行的LLM调用数(流式调用在读完输出前一直占用名额)
+    2. 为玩家对话路径保留名额: 后台调用方先占用后台名额, 同时进行的后台调用不超过 上限-保留数
+    3. 统计进行中和排队中的调用数、排队耗时
+    """
+
+    def __init__(self, limit:int, reserved:int = 0, interactive:Iterable[str] = INTERACTIVE_CALLERS):
+        """
+        :param limit: 最大并发调用数
+        :param reserved: 只给对话路径使用的名额数(后台调用至少保留1个名额)
+        :param interactive: 对话路径上的调用方
+        """
+        self.limit = max(1, limit)
+        self.background_limit = max(1, self.limit - max(0, reserved))
+        self.interactive = frozenset(interactive)
+        self._semaphore = threading.BoundedSemaphore(self.limit)
+        self._background = threading.BoundedSemaphore(self.background_limit)
+        self._lock = threading.Lock()
+        self.stats:Dict[str, int] = {"in_flight": 0, "waiting": 0, "calls": 0}
+
+    @contextmanager
+    def slot(self, caller:str):
+        """
+        占用一个调用名额(with语句使用)
+        :param caller: 调用方(与 record_llm_call 一致)
+        """
+        background = caller not in self.interactive
+        with self._lock:
+            self.stats["waiting"] += 1
+        start = time.perf_counter()
+        if background:
+            self._background.acquire()
+        self._semaphore.acquire()
+        LLM_WAIT_SECONDS.observe(time.perf_counter() - start, caller)
+        with self._lock:
+            self.stats["waiting"] -= 1
+            self.stats["in_flight"] += 1
+            self.stats["calls"] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stats["in_flight"] -= 1
+            self._semaphore.release()
+            if background:
+                self._background.release()
+
+
+# 全局单例(多个线程可能同时首次调用, 创建时加锁保证只有一个信号量)
+_llm_limiter = None
+_llm_limiter_lock = threading.Lock()
+
+def get_llm_limiter()->LLMLimiter:
+    """获取LLM并发限制器单例"""
+    global _llm_limiter
+    if _llm_limiter is None:
+        with _llm_limiter_lock:
+            if _llm_limiter is None:
+                _llm_limiter = LLMLimiter(settings.LLM_MAX_CONCURRENCY, settings.LLM_INTERACTIVE_RESERVED)
+    return _llm_limiter
+
+
+def llm_slot(caller:str):
+    """占用一个LLM调用名额: with llm_slot("chat"): ..."""
+    return get_llm_limiter().slot(caller)
@@ -0,0 +1,375 @@
+"""后端压测工具
+
+模拟大量玩家并发访问 /chat、/npcs/status、/npcs/status/refresh,
+统计吞吐量、各接口p50/p95/p99延迟, 以及服务端(/metrics)和压测端的事件循环延迟
+
+默认自动启动本地模拟LLM服务(mock_llm_server.py)和后端进程, 全程无需联网
+(NPC记忆系统的情景记忆依赖Qdrant, 需在本机启动: docker run -p 6333:6333 qdrant/qdrant,
+ 未启动时NPC Agent创建失败, /chat 退回模拟模式回复, 压测会给出提示)
+
+使用方法:
+  python load_test.py                                      # 1000名玩家, 60秒
+  python load_test.py --players 3000 --duration 120
+  python load_test.py --mock-latency uniform:200:2000 --mock-failure-rate 0.05
+  python load_test.py --target http://127.0.0.1:8000      # 压测已启动的后端(不启动模拟服务)
+  python load_test.py --json report.json                  # 同时保存JSON报告
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from mock_llm_server import MockLLMConfig, create_server
+
+BACKEND_DIR = Path(__file__).parent
+
+# 默认请求比例(权重): 客户端以轮询状态为主, 偶尔对话, 很少强制刷新
+DEFAULT_MIX = "status:20,chat:2,refresh:0.1"
+
+
+def _free_port()->int:
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values:List[float], q:float)->float:
+    """计算分位数(输入已排序)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Stats:
+    """单个接口的统计"""
+
+    def __init__(self):
+        self.latencies:List[float] = []
+        self.errors:Dict[str, int] = {}
+
+    def record(self, latency:float, error:Optional[str] = None):
+        if error is None:
+            self.latencies.append(latency)
+        else:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, duration:float)->Dict:
+        values = sorted(self.latencies)
+        errors = sum(self.errors.values())
+        return {
+            "requests": len(values) + errors,
+            "errors": errors,
+            "error_types": self.errors,
+            "rps": round((len(values) + errors) / duration, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round((values[-1] if values else 0) * 1000, 1)
+        }
+
+
+# ==================== 事件循环延迟 ====================
+
+_LAG_BUCKET_PATTERN = re.compile(r'^aitown_event_loop_lag_seconds_bucket\{le="([^"]+)"\} (\S+)$', re.MULTILINE)
+
+
+def parse_lag_buckets(metrics_text:str)->List[Tuple[float, float]]:
+    """从/metrics中解析事件循环延迟的累计分桶 [(上界, 累计次数), ...]"""
+    buckets = []
+    for le, count in _LAG_BUCKET_PATTERN.findall(metrics_text):
+        buckets.append((float("inf") if le == "+Inf" else float(le), float(count)))
+    return sorted(buckets)
+
+
+def histogram_quantile(q:float, before:List[Tuple[float, float]], after:List[Tuple[float, float]])->Optional[float]:
+    """
+    根据压测前后的累计分桶估算分位数(桶内线性插值, 同Prometheus的histogram_quantile)
+    :return: 秒, 没有样本时返回None
+    """
+    start = dict(before)
+    buckets = [(bound, count - start.get(bound, 0)) for bound, count in after]
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+async def monitor_client_lag(stop:asyncio.Event, samples:List[float], interval:float = 0.1):
+    """测量压测进程自身的事件循环延迟(过高说明压测端成为瓶颈)"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+# ==================== 模拟玩家 ====================
+
+class LoadTest:
+    """压测执行器"""
+
+    def __init__(self, base_url:str, players:int, duration:float, ramp_up:float, think_time:float, mix:Dict[str, float]):
+        self.base_url = base_url.rstrip("/")
+        self.players = players
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.actions = list(mix.keys())
+        self.weights = list(mix.values())
+        self.stats:Dict[str, Stats] = {action: Stats() for action in self.actions}
+        self.npc_names:List[str] = []
+
+    async def _request(self, client:httpx.AsyncClient, action:str, method:str, path:str, **kwargs)->Optional[Dict]:
+        """发送请求并记录延迟"""
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats[action].record(0, type(e).__name__)
+            return None
+
+        latency = time.perf_counter() - start
+        if response.status_code >= 400:
+            self.stats[action].record(latency, f"HTTP {response.status_code}")
+            return None
+
+        self.stats[action].record(latency)
+        return response.json()
+
+    async def _player(self, client:httpx.AsyncClient, index:int, deadline:float):
+        """单个模拟玩家: 按比例随机选择操作, 操作间隔服从指数分布"""
+        # 错开启动时间
+        await asyncio.sleep(self.ramp_up * index / max(self.players, 1))
+
+        player_id = f"load-{index}"
+        version = None
+
+        while time.perf_counter() < deadline:
+            action = random.choices(self.actions, self.weights)[0]
+
+            if action == "status":
+                params = {"since": version} if version is not None else None
+                state = await self._request(client, action, "GET", "/npcs/status", params=params)
+                if state:
+                    version = state.get("version", version)
+            elif action == "chat":
+                await self._request(client, action, "POST", "/chat", json={
+                    "npc_name": random.choice(self.npc_names),
+                    "message": random.choice(["你好!", "最近在忙什么?", "能教教我吗?", "今天天气不错"]),
+                    "player_id": player_id
+                }, headers={"X-Request-ID": f"{player_id}-{time.monotonic_ns()}"})
+            elif action == "refresh":
+                await self._request(client, action, "GET", "/npcs/status/refresh")
+
+            think = random.expovariate(1 / self.think_time) if self.think_time > 0 else 0
+            await asyncio.sleep(min(think, max(0.0, deadline - time.perf_counter())))
+
+    async def run(self, max_connections:int, timeout:float)->Dict:
+        """执行压测并返回报告"""
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            npcs = (await client.get("/npcs")).json()
+            self.npc_names = [npc["name"] for npc in npcs["npcs"]]
+
+            probe = (await client.post("/chat", json={"npc_name": self.npc_names[0], "message": "你好", "player_id": "load-probe"})).json()
+            if "模拟模式" in probe.get("message", ""):
+                print("⚠️  后端NPC Agent处于模拟模式(检查LLM配置和Qdrant服务), /chat 结果不包含LLM调用")
+            metrics_before = (await client.get("/metrics")).text
+
+            print(f"🚀 开始压测: {self.players}名玩家, {self.duration:.0f}秒 (启动间隔{self.ramp_up:.0f}秒)")
+            stop = asyncio.Event()
+            client_lag:List[float] = []
+            lag_task = asyncio.create_task(monitor_client_lag(stop, client_lag))
+
+            start = time.perf_counter()
+            deadline = start + self.ramp_up + self.duration
+            await asyncio.gather(*(self._player(client, i, deadline) for i in range(self.players)))
+            elapsed = time.perf_counter() - start
+
+            stop.set()
+            await lag_task
+            metrics_after = (await client.get("/metrics")).text
+
+        before, after = parse_lag_buckets(metrics_before), parse_lag_buckets(metrics_after)
+        server_lag = {
+            f"p{int(q * 100)}_ms": (round(value * 1000, 1) if value is not None else None)
+            for q in (0.5, 0.95, 0.99)
+            for value in [histogram_quantile(q, before, after)]
+        }
+        client_lag.sort()
+
+        endpoints = {action: stats.summary(elapsed) for action, stats in self.stats.items()}
+        total = sum(summary["requests"] for summary in endpoints.values())
+        return {
+            "players": self.players,
+            "duration_s": round(elapsed, 1),
+            "total_requests": total,
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+            "server_event_loop_lag": server_lag,
+            "client_event_loop_lag": {
+                "p50_ms": round(percentile(client_lag, 0.5) * 1000, 1),
+                "p99_ms": round(percentile(client_lag, 0.99) * 1000, 1),
+                "max_ms": round((client_lag[-1] if client_lag else 0) * 1000, 1)
+            }
+        }
+
+
+# ==================== 进程管理 ====================
+
+def start_mock_llm(args)->Tuple[object, str]:
+    """在后台线程中启动模拟LLM服务"""
+    config = MockLLMConfig(args.mock_latency, args.mock_token_ms, args.mock_failure_rate)
+    server = create_server("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"🧪 模拟LLM服务: {url} (延迟: {args.mock_latency}, 失败率: {args.mock_failure_rate:.0%})")
+    return server, url
+
+
+def start_backend(llm_url:str, port:int, startup_timeout:float = 60)->subprocess.Popen:
+    """启动后端进程(连接模拟LLM服务)并等待就绪"""
+    env = dict(os.environ)
+    env.update({
+        "LLM_BASE_URL": llm_url,
+        "LLM_API_KEY": "mock",
+        "LLM_MODEL_ID": "mock-model",
+        "LOG_CONSOLE": "false"
+    })
+    # 嵌入模型默认使用本地TF-IDF(DashScope需要联网)
+    env.setdefault("EMBED_MODEL_TYPE", "tfidf")
+    env.setdefault("EMBED_MODEL_NAME", "")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"后端进程启动失败(退出码 {process.returncode})")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                print(f"🖥️  后端已启动: {base_url}")
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError("等待后端启动超时")
+
+
+# ==================== 报告 ====================
+
+def print_report(report:Dict, mock_stats:Optional[Dict] = None):
+    """打印压测报告"""
+    print("\n" + "=" * 78)
+    print(f"📊 压测结果: {report['players']}名玩家, {report['duration_s']}秒, "
+          f"共{report['total_requests']}个请求, 吞吐 {report['throughput_rps']} req/s")
+    print("=" * 78)
+    print(f"{'接口':<10}{'请求数':>8}{'错误':>7}{'req/s':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for action, summary in report["endpoints"].items():
+        print(f"{action:<10}{summary['requests']:>8}{summary['errors']:>7}{summary['rps']:>9}"
+              f"{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}{summary['max_ms']:>10}")
+        if summary["error_types"]:
+            print(f"{'':<10}错误类型: {summary['error_types']}")
+
+    server_lag = report["server_event_loop_lag"]
+    print(f"\n⏱️  服务端事件循环延迟: p50={server_lag['p50_ms']}ms p95={server_lag['p95_ms']}ms p99={server_lag['p99_ms']}ms")
+    client_lag = report["client_event_loop_lag"]
+    print(f"⏱️  压测端事件循环延迟: p50={client_lag['p50_ms']}ms p99={client_lag['p99_ms']}ms max={client_lag['max_ms']}ms")
+    if client_lag["p99_ms"] > 50:
+        print("⚠️  压测端事件循环延迟过高, 结果可能受压测端限制, 请减少玩家数或分多个进程压测")
+    if mock_stats:
+        print(f"🧪 模拟LLM: {mock_stats['requests']}次调用, {mock_stats['streams']}次流式, {mock_stats['failures']}次失败")
+
+
+def parse_mix(spec:str)->Dict[str, float]:
+    """解析请求比例, 例如 status:20,chat:2,refresh:0.1"""
+    mix = {}
+    for part in spec.split(","):
+        action, weight = part.split(":")
+        if action not in ("status", "chat", "refresh"):
+            raise ValueError(f"未知的操作: {action}")
+        mix[action] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="赛博小镇后端压测")
+    parser.add_argument("--target", help="压测已启动的后端地址(不启动模拟LLM和后端)")
+    parser.add_argument("--port", type=int, default=0, help="自动启动后端的端口(默认随机)")
+    parser.add_argument("--players", type=int, default=1000, help="模拟玩家数")
+    parser.add_argument("--duration", type=float, default=60, help="压测时长(秒, 不含启动阶段)")
+    parser.add_argument("--ramp-up", type=float, default=10, help="玩家逐步加入的时间(秒)")
+    parser.add_argument("--think-time", type=float, default=2.0, help="玩家操作间隔均值(秒)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"请求比例(默认 {DEFAULT_MIX})")
+    parser.add_argument("--max-connections", type=int, default=500, help="最大并发连接数")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求超时(秒)")
+    parser.add_argument("--mock-latency", default="lognormal:400:0.5", help="模拟LLM延迟分布")
+    parser.add_argument("--mock-token-ms", type=float, default=10, help="模拟LLM流式分块间隔(毫秒)")
+    parser.add_argument("--mock-failure-rate", type=float, default=0.0, help="模拟LLM失败率")
+    parser.add_argument("--json", help="JSON报告输出路径")
+    args = parser.parse_args()
+
+    mock_server, backend = None, None
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            mock_server, llm_url = start_mock_llm(args)
+            port = args.port or _free_port()
+            backend = start_backend(llm_url, port)
+            base_url = f"http://127.0.0.1:{port}"
+
+        test = LoadTest(base_url, args.players, args.duration, args.ramp_up, args.think_time, parse_mix(args.mix))
+        report = asyncio.run(test.run(args.max_connections, args.timeout))
+
+        mock_stats = mock_server.RequestHandlerClass.config.stats() if mock_server else None
+        if mock_stats:
+            report["mock_llm"] = mock_stats
+        print_report(report, mock_stats)
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"💾 报告已保存: {args.json}")
+    finally:
+        if backend:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        if mock_server:
+            mock_server.shutdown()
+            mock_server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,307 @@
-"""对话日志系统"""
+"""对话日志系统
 
-import logging
-import os
+每轮对话汇总为一条JSON Lines记录, 放入队列由后台线程异步写入,
+请求路径上只做内存操作; 日志文件按日期滚动(dialogue_YYYY-MM-DD.jsonl)
+"""
+
+import atexit
+import contextvars
+import json
+import queue
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import settings
+from tracing import current_request_id
+
+# 创建日志目录(默认 backend/logs, 可用 LOGS_DIR 环境变量指定)
+LOGS_DIR = Path(settings.LOGS_DIR)
+LOGS_DIR.mkdir(parents=True, exist_ok=True)
+
+def log_file_for(date_str:str)->Path:
+    """指定日期的日志文件"""
+    return LOGS_DIR / f"dialogue_{date_str}.jsonl"
+
+# 当前日期的日志文件(运行中跨天会自动切换到新文件)
+LOG_FILE = log_file_for(datetime.now().strftime("%Y-%m-%d"))
+
+
+class DialogueLogWriter:
+    """
+    异步日志写入器
+
+    功能:
+    1. 有界队列接收日志记录, 队列满时丢弃并计数(不阻塞请求)
+    2. 后台线程批量写入, 按记录日期滚动文件
+    3. 其他JSON Lines文件(如好感度判定记录)也经同一队列写入, 可设大小上限
+    4. 统计写入量、丢弃量和吞吐
+    """
+
+    def __init__(self, logs_dir:Path, queue_size:int = 10000, console:bool = True):
+        self.logs_dir = logs_dir
+        self.console = console
+        self._queue:queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread:Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+        # 当前打开的文件
+        self._current_date:Optional[str] = None
+        self._file = None
+
+        # 统计
+        self.written = 0
+        self.dropped = 0
+        self.capped = 0
+        self.bytes_written = 0
+        self.rotations = 0
+        self._started_at = time.monotonic()
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="dialogue-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout:float = 5.0):
+        """停止写入线程(先写完队列中的记录)"""
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._current_date = None
+
+    def submit(self, record:Dict)->bool:
+        """
+        提交一条记录
+        :return: 是否成功入队(队列满时丢弃)
+        """
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
 
-# 创建logs目录
-LOGS_DIR = Path(__file__).parent / "logs"
-LOGS_DIR.mkdir(exist_ok=True)
+    def append(self, filename:str, record:Dict, max_bytes:int = 0)->bool:
+        """
+        提交一条写入日志目录下其他文件的记录
+        :param filename: 文件名(相对日志目录)
+        :param max_bytes: 文件大小上限, 超过后丢弃新记录(0表示不限)
+        :return: 是否成功入队
+        """
+        return self.submit({"type": "file", "file": filename, "max_bytes": max_bytes, "record": record})
 
-# 创建日志文件名(按照日期)
-today = datetime.now().strftime("%Y-%m-%d")
-LOG_FILE =  LOGS_DIR / f"dialogue_{today}.log"
+    def _run(self):
+        """后台写入循环"""
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            try:
+                record = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
 
-# 配置日志格式
-LOG_FORMAT = "%(asctime)s - %(message)s"
-DATE_FORMAT = "%H:%M:%S"
+            # 一次取出队列中已有的记录批量写入
+            batch = [record]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
 
-# 创建logger
-dialogue_logger = logging.getLogger("dialogue")
-dialogue_logger.setLevel(logging.INFO)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"❌ 写入对话日志失败: {e}")
 
-# 移除已有的handlers
-dialogue_logger.handlers.clear()
+    def _open_for(self, date_str:str):
+        """按日期打开日志文件(跨天时滚动)"""
+        if date_str == self._current_date and self._file:
+            return
+        if self._file:
+            self._file.close()
+            self.rotations += 1
+        self._file = open(self.logs_dir / f"dialogue_{date_str}.jsonl", "a", encoding="utf-8")
+        self._current_date = date_str
 
-# 创建文件handler
-file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    def _write_batch(self, batch:List[Dict]):
+        """写入一批记录"""
+        for record in batch:
+            if record.get("type") == "file":
+                self._append_file(record)
+                continue
+            self._open_for(record["timestamp"][:10])
+            line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            self._file.write(line)
+            self.written += 1
+            self.bytes_written += len(line.encode("utf-8"))
 
-# 添加控制台handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.INFO)
-console_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+            if self.console:
+                print(_format_console(record))
 
-# 添加handler
-dialogue_logger.addHandler(file_handler)
-dialogue_logger.addHandler(console_handler)
+        if self._file:
+            self._file.flush()
 
-# 防止日志传播到 root logger
-dialogue_logger.propagate = False
+    def _append_file(self, item:Dict):
+        """追加一条记录到指定文件(达到大小上限时丢弃)"""
+        path = self.logs_dir / item["file"]
+        line = json.dumps(item["record"], ensure_ascii=False, default=str) + "\n"
+        size = path.stat().st_size if path.exists() else 0
+        if item["max_bytes"] and size + len(line.encode("utf-8")) > item["max_bytes"]:
+            self.capped += 1
+            return
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+        self.written += 1
+        self.bytes_written += len(line.encode("utf-8"))
 
-def log_dialogue_start(npc_name:str, player_message:str):
+    def stats(self)->Dict:
+        """写入统计"""
+        elapsed = max(time.monotonic() - self._started_at, 1e-6)
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "capped": self.capped,
+            "queued": self._queue.qsize(),
+            "bytes_written": self.bytes_written,
+            "rotations": self.rotations,
+            "records_per_sec": round(self.written / elapsed, 2),
+            "current_file": str(self.logs_dir / f"dialogue_{self._current_date}.jsonl") if self._current_date else None
+        }
+
+
+def _format_console(record:Dict)->str:
+    """控制台单行摘要"""
+    time_str = record["timestamp"][11:19]
+    if record.get("type") != "dialogue":
+        return f"{time_str} - [{record.get('level', 'info')}] {record.get('message', '')}"
+
+    summary = f"{time_str} - 💬 {record.get('npc_name')} <- 玩家: {record.get('player_message')} | 回复: {record.get('npc_response')}"
+    affinity = record.get("affinity_result") or {}
+    if affinity.get("changed"):
+        summary += f" | 好感度 {affinity['old_affinity']:.1f}->{affinity['new_affinity']:.1f}"
+    return summary
+
+
+# 全局写入器
+_writer = DialogueLogWriter(LOGS_DIR, queue_size=settings.LOG_QUEUE_SIZE, console=settings.LOG_CONSOLE)
+_writer.start()
+atexit.register(_writer.stop)
+
+# 当前对话轮次的记录(每个请求独立)
+_current_turn:contextvars.ContextVar = contextvars.ContextVar("dialogue_turn", default=None)
+
+def _now()->str:
+    """当前时间(毫秒精度)"""
+    return datetime.now().isoformat(timespec="milliseconds")
+
+def _turn()->Dict:
+    """获取当前对话记录(没有时创建一个空记录)"""
+    record = _current_turn.get()
+    if record is None:
+        record = {"type": "dialogue", "timestamp": _now(), "request_id": current_request_id()}
+        _current_turn.set(record)
+    return record
+
+def log_dialogue_start(npc_name:str, player_message:str, player_id:str = "player"):
     """记录对话开始"""
-    dialogue_logger.info("=" * 60)
-    dialogue_logger.info(f"💬 对话开始: {npc_name} <-> 玩家")
-    dialogue_logger.info("=" * 60)
-    dialogue_logger.info(f"📝 玩家消息: {player_message}")
+    _current_turn.set({
+        "type": "dialogue",
+        "timestamp": _now(),
+        "request_id": current_request_id(),
+        "npc_name": npc_name,
+        "player_id": player_id,
+        "player_message": player_message,
+        "_start": time.perf_counter()
+    })
 
 def log_affinity(npc_name:str, affinity:float, level:str):
     """记录当前好感度"""
-    dialogue_logger.info(f"💖 当前好感度: {affinity:.1f}/100 ({level})")
+    record = _turn()
+    record["affinity"] = round(affinity, 1)
+    record["affinity_level"] = level
 
 def log_memory_retrieval(npc_name:str, count:int, memories:list = None):
     """记录记忆检索"""
-    dialogue_logger.info(f"🧠 检索到{count}条相关记忆")
+    record = _turn()
+    record["memory_count"] = count
 
     if memories:
-        dialogue_logger.info("  📚 相关记忆:")
-        for i, mem in enumerate(memories[:3], 1):
-            content = mem.content[:50] + "..." if len(mem.content) > 50 else mem.content
-            dialogue_logger.info(f"    {i}. {content}")
+        record["memories"] = [
+            mem.content[:50] + "..." if len(mem.content) > 50 else mem.content
+            for mem in memories[:3]
+        ]
 
 def log_generating_response():
     """记录正在生成回复"""
-    dialogue_logger.info("🤖 正在生成回复...")
+    _turn()["generate_started"] = _now()
 
 def log_npc_response(npc_name:str, response:str):
     """记录NPC回复"""
-    dialogue_logger.info(f"💬 {npc_name}回复: {response}")
+    _turn()["npc_response"] = response
 
 def log_analyzing_affinity():
     """记录正在分析好感度"""
-    dialogue_logger.info("🤖 正在生成回复...")
+    _turn()["analyze_started"] = _now()
 
 def log_affinity_change(affinity_result:dict):
     """记录好感度变化"""
-    if affinity_result.get("changed"):
-        change_symbol = "📈" if affinity_result["change_amount"] > 0 else "📉"
-        dialogue_logger.info(
-            f"{change_symbol} 好感度变化: {affinity_result['old_affinity']:.1f} -> "
-            f"{affinity_result['new_affinity']:.1f} ({affinity_result['change_amount']:+.1f})"
-        )
-        dialogue_logger.info(f"  原因: {affinity_result['reason']}")
-        dialogue_logger.info(f"  情感: {affinity_result['sentiment']}")
-
-        if affinity_result['old_level'] != affinity_result['new_level']:
-            dialogue_logger.info(
-                f"  🎉 关系等级变化: {affinity_result['old_level']} -> {affinity_result['new_level']}"
-            )
-        else:
-            dialogue_logger.info(f"  ➡️ 好感度未变化 (当前: {affinity_result.get('affinity', 50.0):.1f})")
-            dialogue_logger.info(f"  原因: {affinity_result.get('reason', '无')}")
+    _turn()["affinity_result"] = affinity_result
 
 def log_memory_saved(npc_name:str):
     """记录记忆保存"""
-    dialogue_logger.info(f"  💾 对话已保存到{npc_name}的记忆中")
+    _turn()["memory_saved"] = True
 
 def log_dialogue_end():
-    """记录对话结束"""
-    dialogue_logger.info("=" * 60)
-    dialogue_logger.info("✅ 对话完成\n")
+    """记录对话结束(整轮对话作为一条记录写入)"""
+    record = _current_turn.get()
+    if record is None:
+        return
+    _current_turn.set(None)
+
+    start = record.pop("_start", None)
+    if start is not None:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _writer.submit(record)
+
+def log_dialogue_failed(error:str):
+    """记录对话失败(失败的轮次同样写入一条记录)"""
+    _turn()["error"] = error
+    log_dialogue_end()
 
 def log_info(message: str):
     """记录普通信息"""
-    dialogue_logger.info(message)
+    _writer.submit({"type": "event", "level": "info", "timestamp": _now(), "request_id": current_request_id(), "message": message})
 
 def log_error(message: str):
     """记录错误信息"""
-    dialogue_logger.error(message)
+    _writer.submit({"type": "event", "level": "error", "timestamp": _now(), "request_id": current_request_id(), "message": message})
+
+def log_record(filename:str, record:Dict, max_bytes:int = 0)->bool:
+    """
+    异步追加一条记录到日志目录下的JSON Lines文件(请求路径上不做文件IO)
+    :param filename: 文件名(相对日志目录)
+    :param record: 记录
+    :param max_bytes: 文件大小上限(0表示不限)
+    """
+    return _writer.append(filename, record, max_bytes)
+
+def get_log_stats()->Dict:
+    """获取日志写入统计"""
+    return _writer.stats()
+
+def stop_log_writer():
+    """停止日志写入(写完队列中的记录)"""
+    _writer.stop()
 
 # 启动时记录日志文件位置
-print(f"\n📝 对话日志文件: {LOG_FILE}")
-print(f"📂 日志目录: {LOGS_DIR}\n")
\ No newline at end of file
+print(f"\n📝 对话日志文件: {LOG_FILE} (JSON Lines, 按日期滚动)")
+print(f"📂 日志目录: {LOGS_DIR}\n")
@@ -1,21 +1,42 @@
 """赛博小镇 FastAPI 后端主程序"""
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+import asyncio
+import time
+import httpx
 import uvicorn
 
 from config import settings
 from models import (
     ChatRequest, ChatResponse,
-    NPCStatusResponse, NPCListResponse, NPCInfo
+    NPCStatusResponse, NPCListResponse, NPCInfo,
+    PlayerPresenceRequest
 )
 from agents import get_npc_manager
 from state_manager import get_state_manager
+from roster import get_roster
+from response_cache import FastJSONResponse, get_response_cache, dumps
+from llm_limiter import get_llm_limiter
+from logger import get_log_stats, stop_log_writer
+from snapshot import WorldSnapshotManager
+from metrics import EVENT_LOOP_LAG_SECONDS, SHARD_FORWARDS, ambient_tokens_per_line, registry as metrics_registry, render_metrics
+from sharding import FORWARDED_HEADER, get_shard_router
+from tracing import get_trace_stats, new_request_id, stop_tracing
 
 # 全局管理器实例
 npc_manager = None
 state_manager = None
 
+# 读多写少接口的预序列化响应缓存
+response_cache = get_response_cache()
+
+# NPC分片: 转发请求到其他进程的HTTP客户端(首次转发时创建)
+forward_client: Optional[httpx.AsyncClient] = None
+
 def get_managers():
     """获取管理器实例"""
     global npc_manager, state_manager
@@ -25,6 +46,170 @@ def get_managers():
         state_manager = get_state_manager()
     return npc_manager, state_manager
 
+def _setup_cache_invalidation(npc_mgr):
+    """订阅名册和好感度变化, 使预序列化响应失效"""
+    # 名册变化影响NPC列表、NPC详情以及好感度(NPC可能被移除)
+    get_roster().subscribe(lambda diff: response_cache.invalidate())
+
+    if npc_mgr.relationship_manager:
+        def on_affinity_changed(npc_name: str, player_id: str):
+            response_cache.invalidate("affinity", npc_name, player_id)
+            response_cache.invalidate("affinities", player_id)
+
+        npc_mgr.relationship_manager.subscribe(on_affinity_changed)
+
+    # 分片归属变化影响NPC列表和详情中的 available
+    if npc_mgr.shard_router:
+        def on_shards_changed():
+            response_cache.invalidate("npcs")
+            response_cache.invalidate("npc")
+
+        npc_mgr.shard_router.subscribe(on_shards_changed)
+
+def _setup_metrics(npc_mgr, state_mgr):
+    """注册指标采集函数: 抓取时读取各模块已有的统计"""
+    def collect():
+        batch_stats = state_mgr.batch_generator.stats
+        yield ("aitown_batch_events_total", "counter", "批量生成事件计数(批次、分片、修复、兜底)",
+               [({"event": key}, value) for key, value in batch_stats.items()])
+        yield ("aitown_batch_fallback_npcs_total", "counter", "使用缓存/预设兜底对话的NPC数",
+               [({}, batch_stats["cache_filled_npcs"])])
+
+        if npc_mgr.relationship_manager:
+            yield ("aitown_affinity_analysis_total", "counter", "好感度分析次数(rule=本地规则, llm=LLM判定)",
+                   [({"path": path}, count) for path, count in npc_mgr.relationship_manager.analysis_stats.items()])
+
+        cache_stats = response_cache.stats()
+        yield ("aitown_response_cache_requests_total", "counter", "预序列化响应缓存查询次数",
+               [({"result": "hit"}, cache_stats["hits"]), ({"result": "miss"}, cache_stats["misses"])])
+        yield ("aitown_response_cache_hit_ratio", "gauge", "预序列化响应缓存命中率",
+               [({}, cache_stats["hit_rate"])])
+        yield ("aitown_response_cache_entries", "gauge", "预序列化响应缓存条目数",
+               [({}, cache_stats["entries"])])
+        yield ("aitown_response_cache_evictions_total", "counter", "预序列化响应缓存按LRU淘汰的条目数",
+               [({}, cache_stats["evictions"])])
+
+        log_stats = get_log_stats()
+        yield ("aitown_log_records_total", "counter", "对话日志记录数(written=已写入, dropped=队列满丢弃)",
+               [({"result": "written"}, log_stats["written"]), ({"result": "dropped"}, log_stats["dropped"])])
+        yield ("aitown_log_queue_size", "gauge", "对话日志待写入队列长度",
+               [({}, log_stats["queued"])])
+
+        trace_stats = get_trace_stats()
+        yield ("aitown_traces_total", "counter", "追踪次数(finished=已结束, written=采样写入)",
+               [({"result": "finished"}, trace_stats["traces"]), ({"result": "written"}, trace_stats["written"])])
+
+        yield ("aitown_active_npcs", "gauge", "最近一轮需要生成对话的NPC数",
+               [({}, len(state_mgr.last_active_npcs))])
+
+        if state_mgr.shared_state:
+            yield ("aitown_shared_state_leader", "gauge", "本worker是否为批量生成leader(1=是)",
+                   [({}, int(state_mgr.is_leader))])
+
+        history_sizes = npc_mgr.history.history_sizes()
+        yield ("aitown_agent_history_messages", "gauge", "各NPC Agent会话历史的消息数",
+               [({"npc": name}, size["messages"]) for name, size in history_sizes.items()])
+        yield ("aitown_agent_history_tokens", "gauge", "各NPC Agent会话历史的token数(kind=history原文, summary摘要)",
+               [({"npc": name, "kind": kind}, size[key]) for name, size in history_sizes.items()
+                for kind, key in (("history", "tokens"), ("summary", "summary_tokens"))])
+        yield ("aitown_agent_history_summaries_total", "counter", "会话历史摘要次数(result=ok/error)",
+               [({"result": "ok"}, npc_mgr.history.stats["summaries"]),
+                ({"result": "error"}, npc_mgr.history.stats["failures"])])
+        yield ("aitown_agent_history_evicted_turns_total", "counter", "移出会话历史(合并进摘要)的对话轮数",
+               [({}, npc_mgr.history.stats["evicted_turns"])])
+        yield ("aitown_agent_history_pending_summaries", "gauge", "等待合并的会话摘要任务数",
+               [({}, npc_mgr.history.pending)])
+
+        greeting_pool = npc_mgr.greetings.pool_stats()
+        yield ("aitown_greeting_pool_npcs", "gauge", "问候语池中的NPC数(state=fresh新鲜/stale过期/missing缺失)",
+               [({"state": state}, greeting_pool[state]) for state in ("fresh", "stale", "missing")])
+        yield ("aitown_greeting_pool_oldest_age_seconds", "gauge", "问候语池中最旧问候语的生成时长(秒)",
+               [({}, greeting_pool["oldest_age_seconds"])])
+        yield ("aitown_greetings_served_total", "counter", "取用问候语次数(result=fresh/stale/missing)",
+               [({"result": "fresh"}, npc_mgr.greetings.stats["served"] - npc_mgr.greetings.stats["served_stale"]),
+                ({"result": "stale"}, npc_mgr.greetings.stats["served_stale"]),
+                ({"result": "missing"}, npc_mgr.greetings.stats["missing"])])
+        yield ("aitown_greeting_generations_total", "counter", "问候语生成次数(按NPC, result=ok/error)",
+               [({"result": "ok"}, npc_mgr.greetings.stats["generated"]),
+                ({"result": "error"}, npc_mgr.greetings.stats["failures"])])
+
+        limiter = get_llm_limiter()
+        yield ("aitown_llm_in_flight", "gauge", "进行中的LLM调用数", [({}, limiter.stats["in_flight"])])
+        yield ("aitown_llm_waiting", "gauge", f"等待并发名额的LLM调用数(上限 {limiter.limit})", [({}, limiter.stats["waiting"])])
+
+        conversations = state_mgr.conversations
+        yield ("aitown_ambient_conversations", "gauge", "进行中的NPC环境对话数",
+               [({}, conversations.active)])
+        yield ("aitown_ambient_conversation_batches_total", "counter", "环境对话批量生成次数(result=ok/error)",
+               [({"result": "ok"}, conversations.stats["batches"] - conversations.stats["failures"]),
+                ({"result": "error"}, conversations.stats["failures"])])
+        yield ("aitown_ambient_tokens_per_visible_line", "gauge", "每句已播放环境台词的平均LLM token数(source=monologue/conversation)",
+               [({"source": source}, cost) for source, cost in ambient_tokens_per_line().items()])
+
+        if npc_mgr.shard_router:
+            yield ("aitown_shard_owned_npcs", "gauge", "本进程负责的NPC数",
+                   [({}, sum(1 for name in npc_mgr.roster.roles if npc_mgr.owns(name)))])
+            yield ("aitown_shard_members", "gauge", "在线的NPC分片进程数",
+                   [({}, len(npc_mgr.shard_router.ring.nodes))])
+
+    metrics_registry.register_collector(collect)
+
+async def _monitor_event_loop_lag(interval:float):
+    """定时测量事件循环延迟(同步阻塞调用会推迟定时任务的唤醒)"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - start - interval))
+
+async def _forward_to_owner(http_request: Request, npc_name: str, json_body=None, request_id: Optional[str] = None):
+    """
+    NPC分片: 把请求转发到负责该NPC的进程
+    :return: 转发得到的响应; 本进程负责、请求已被转发过或转发失败时返回None(本地处理)
+    """
+    global forward_client
+    router = get_shard_router()
+    if router is None or http_request.headers.get(FORWARDED_HEADER) or router.is_local(npc_name):
+        return None
+
+    if forward_client is None:
+        forward_client = httpx.AsyncClient(timeout=settings.SHARD_FORWARD_TIMEOUT)
+
+    owner = router.owner(npc_name)
+    headers = {FORWARDED_HEADER: "1"}
+    if request_id:
+        headers["X-Request-ID"] = request_id
+    try:
+        upstream = await forward_client.request(
+            http_request.method,
+            owner + http_request.url.path,
+            params=http_request.query_params,
+            json=json_body,
+            headers=headers
+        )
+    except httpx.HTTPError as e:
+        # 负责进程不可用(心跳尚未过期), 本地加载该NPC处理
+        SHARD_FORWARDS.inc(1, "error")
+        print(f"⚠️  转发到分片 {owner} 失败, 本地处理: {e}")
+        return None
+
+    SHARD_FORWARDS.inc(1, "ok")
+    response_headers = {"X-Request-ID": request_id} if request_id else None
+    return Response(
+        content=upstream.content,
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type"),
+        headers=response_headers
+    )
+
+async def _sync_shared_affinities(relationship_mgr, interval:float):
+    """共享状态模式: 定时拉取其他worker写入的好感度变化, 使本进程的缓存失效"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            relationship_mgr.sync_shared_changes()
+        except Exception as e:
+            print(f"❌ 同步好感度变化失败: {e}")
+
 # 生命周期管理
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -42,8 +227,37 @@ async def lifespan(app: FastAPI):
     npc_manager = get_npc_manager()
     state_manager = get_state_manager()
 
+    # 从世界快照恢复好感度、当前对话和会话历史(需在状态管理器启动前, 快照未过期时跳过首轮生成)
+    snapshot_manager = WorldSnapshotManager(npc_manager, state_manager)
+    snapshot_manager.restore()
+
     # 启动状态管理器
     await state_manager.start()
+    snapshot_manager.start()
+
+    # 问候语池后台生成(快照中恢复的问候语未过期时不重新生成)
+    npc_manager.greetings.start()
+
+    # NPC分片心跳(成员变化时重新分配NPC)
+    if npc_manager.shard_router:
+        npc_manager.shard_router.start()
+
+    # 启动NPC名册热加载
+    get_roster().start_watching()
+
+    # 名册或好感度变化时使对应的缓存响应失效
+    _setup_cache_invalidation(npc_manager)
+
+    # 注册运行指标采集
+    _setup_metrics(npc_manager, state_manager)
+    lag_monitor = asyncio.create_task(_monitor_event_loop_lag(settings.EVENT_LOOP_LAG_INTERVAL))
+    background_tasks = [lag_monitor]
+
+    relationship_mgr = npc_manager.relationship_manager
+    if relationship_mgr and relationship_mgr.shared_state:
+        background_tasks.append(asyncio.create_task(
+            _sync_shared_affinities(relationship_mgr, settings.SHARED_STATE_POLL_INTERVAL)
+        ))
 
     print("\n✅ 所有服务已启动!")
     print(f"📡 API地址: http://{settings.API_HOST}:{settings.API_PORT}")
@@ -54,7 +268,19 @@ async def lifespan(app: FastAPI):
 
     # 关闭时
     print("\n🛑 正在关闭服务...")
+    for task in background_tasks:
+        task.cancel()
+    await get_roster().stop_watching()
     await state_manager.stop()
+    await npc_manager.greetings.stop()
+    await snapshot_manager.stop()
+    npc_manager.history.stop()
+    if npc_manager.shard_router:
+        await npc_manager.shard_router.stop()
+    if forward_client is not None:
+        await forward_client.aclose()
+    stop_log_writer()
+    stop_tracing()
     print("✅ 服务已关闭\n")
 
 # 创建FastAPI应用
@@ -86,11 +312,16 @@ async def root():
         "endpoints": {
             "docs": "/docs",
             "chat": "/chat",
+            "npc_prewarm": "/npcs/{npc_name}/prewarm",
+            "npc_greeting": "/npcs/{npc_name}/greeting",
             "npcs": "/npcs",
             "npcs_status": "/npcs/status",
+            "player_presence": "/players/presence",
             "npc_memories": "/npcs/{npc_name}/memories",
             "npc_affinity": "/npcs/{npc_name}/affinity",
-            "all_affinities": "/affinities"
+            "all_affinities": "/affinities",
+            "log_stats": "/logs/stats",
+            "metrics": "/metrics"
         }
     }
 
@@ -99,8 +330,23 @@ async def health_check():
     """健康检查"""
     return {"status": "healthy", "timestamp": "now"}
 
+@app.get("/logs/stats")
+async def log_stats():
+    """对话日志写入统计(吞吐、丢弃数、队列长度)"""
+    return get_log_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """运行指标(Prometheus文本格式)"""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_npc(request: ChatRequest):
+async def chat_with_npc(
+        request: ChatRequest,
+        response: Response,
+        http_request: Request,
+        x_request_id: Optional[str] = Header(None)
+):
     print(f"前端发出chat请求，内容为{request}")
 
     """与NPC对话接口"""
@@ -114,15 +360,29 @@ async def chat_with_npc(request: ChatRequest):
             detail=f"NPC '{request.npc_name}' 不存在"
         )
 
+    # 请求ID: 沿用客户端传入的X-Request-ID, 同时写入追踪和对话日志
+    request_id = x_request_id or new_request_id()
+    response.headers["X-Request-ID"] = request_id
+
+    # NPC分片: 由负责该NPC的进程处理(记忆和会话留在同一进程)
+    forwarded = await _forward_to_owner(http_request, request.npc_name, request.model_dump(), request_id)
+    if forwarded is not None:
+        return forwarded
+    npc_mgr.ensure_agent(request.npc_name)
+
     try:
         # 调用NPC Agent 处理对话
-        response_text = npc_mgr.chat(request.npc_name, request.message)
+        # 在工作线程中执行(LLM调用可能排队等待并发名额, 不能阻塞事件循环)
+        response_text = await asyncio.to_thread(
+            npc_mgr.chat, request.npc_name, request.message, player_id=request.player_id, request_id=request_id
+        )
 
         result =  ChatResponse(
             npc_name=request.npc_name,
             npc_title=npc_info.get('title', 'NPC'),  # 修正字典访问
             message=response_text,
-            success=True
+            success=True,
+            request_id=request_id
         )
         print(result)
         return result
@@ -133,34 +393,117 @@ async def chat_with_npc(request: ChatRequest):
             detail=f"对话处理失败: {str(e)}"
         )
 
-@app.get("/npcs", response_model=NPCListResponse)
+@app.post("/npcs/{npc_name}/prewarm")
+async def prewarm_npc(npc_name: str, http_request: Request, player_id: str = "player", opening_line: Optional[bool] = None):
+    print(f"前端发来{npc_name}prewarm请求")
+
+    """玩家走近NPC时预热首轮对话(好感度、记忆检索、LLM连接, 可选生成开场白)"""
+    npc_mgr, _ = get_managers()
+
+    # 验证NPC是否存在
+    npc_info = npc_mgr.get_npc_info(npc_name)
+    if not npc_info:
+        raise HTTPException(
+            status_code=404,
+            detail=f"NPC '{npc_name}' 不存在"
+        )
+
+    # NPC分片: 预热结果留在负责该NPC的进程
+    forwarded = await _forward_to_owner(http_request, npc_name)
+    if forwarded is not None:
+        return forwarded
+    npc_mgr.ensure_agent(npc_name)
+
+    if opening_line is None:
+        opening_line = settings.PREWARM_OPENING_LINE
+
+    try:
+        start = time.perf_counter()
+        result = await asyncio.to_thread(npc_mgr.prewarm, npc_name, player_id, opening_line)
+
+        return {
+            "npc_name": npc_name,
+            "player_id": player_id,
+            **result,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"预热失败: {str(e)}"
+        )
+
+@app.post("/npcs/{npc_name}/greeting")
+async def greet_player(npc_name: str, http_request: Request, player_id: str = "player"):
+    print(f"前端发来{npc_name}greeting请求")
+
+    """玩家打开对话时NPC的问候语(预先生成, 按好感度等级取用, 写入记忆)"""
+    npc_mgr, _ = get_managers()
+
+    # 验证NPC是否存在
+    npc_info = npc_mgr.get_npc_info(npc_name)
+    if not npc_info:
+        raise HTTPException(
+            status_code=404,
+            detail=f"NPC '{npc_name}' 不存在"
+        )
+
+    # NPC分片: 问候语池和会话历史在负责该NPC的进程
+    forwarded = await _forward_to_owner(http_request, npc_name)
+    if forwarded is not None:
+        return forwarded
+    npc_mgr.ensure_agent(npc_name)
+
+    try:
+        result = await asyncio.to_thread(npc_mgr.greet, npc_name, player_id)
+
+        return {
+            "npc_name": npc_name,
+            "player_id": player_id,
+            "greeting": result["greeting"] if result else None,
+            "level": result["level"] if result else None,
+            "stale": result["stale"] if result else None,
+            "source": result["source"] if result else None
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取问候语失败: {str(e)}"
+        )
+
+@app.get("/npcs", response_model=NPCListResponse, response_class=FastJSONResponse)
 async def list_npcs():
     print("前端发来npcs请求")
 
     """获取所有的NPC列表"""
     npc_mgr, _ = get_managers()
 
-    npcs_data = npc_mgr.get_all_npcs()
-    npcs = [NPCInfo(**npc) for npc in npcs_data]
+    def build():
+        npcs_data = npc_mgr.get_all_npcs()
+        npcs = [NPCInfo(**npc) for npc in npcs_data]
+        return NPCListResponse(
+            npcs=npcs,
+            total=len(npcs)
+        ).model_dump(mode="json")
 
-    return NPCListResponse(
-        npcs=npcs,
-        total=len(npcs)
-    )
+    return FastJSONResponse(response_cache.get_or_build(("npcs",), build))
 
-@app.get("/npcs/status", response_model=NPCStatusResponse)
-async def get_npcs_status():
+@app.get("/npcs/status", response_model=NPCStatusResponse, response_class=FastJSONResponse)
+async def get_npcs_status(since: Optional[int] = None):
     print("前端发来npcs_status请求")
 
-    """获取所有NPC当前状态"""
+    """获取所有NPC当前状态 (传入since版本号时只返回之后变化的NPC)"""
     _, state_mgr = get_managers()  # 修正变量名
-    state = state_mgr.get_current_state()
+    state = state_mgr.get_current_state(since=since)
 
-    return NPCStatusResponse(
-        dialogues=state["dialogues"],
-        last_update=state["last_update"],
-        next_update_in=state["next_update_in"]
-    )
+    # 全量对话按版本缓存序列化结果,只有倒计时等小字段每次序列化
+    if state["full"]:
+        dialogues_body = response_cache.get_versioned(("status",), state["version"], lambda: state["dialogues"])
+    else:
+        dialogues_body = dumps(state["dialogues"])
+
+    rest = dumps({key: value for key, value in state.items() if key != "dialogues"})
+    return FastJSONResponse(b'{"dialogues":' + dialogues_body + b"," + rest[1:])
 
 @app.get("/npcs/status/refresh")
 async def refresh_npcs_status():
@@ -174,10 +517,22 @@ async def refresh_npcs_status():
 
     return {
         "message": "NPC状态已刷新",
-        "dialogues": state["dialogues"]
+        "dialogues": state["dialogues"],
+        "version": state["version"]
     }
 
-@app.get("/npcs/{npc_name}")  # 修正：添加缺失的斜杠
+@app.post("/players/presence")
+async def report_player_presence(request: PlayerPresenceRequest):
+    """玩家位置上报 - 只为玩家附近的NPC生成环境对话"""
+    _, state_mgr = get_managers()
+
+    return state_mgr.report_presence(
+        player_id=request.player_id,
+        location=request.location,
+        nearby_npcs=request.nearby_npcs
+    )
+
+@app.get("/npcs/{npc_name}", response_class=FastJSONResponse)  # 修正：添加缺失的斜杠
 async def get_npc_info(npc_name: str):
     print("前端发来npc_info请求")
 
@@ -191,16 +546,32 @@ async def get_npc_info(npc_name: str):
             detail=f"NPC '{npc_name}' 不存在"
         )
 
-    return {
-        "npc_info": npc_info,
-        "status": "active"
-    }
+    return FastJSONResponse(response_cache.get_or_build(
+        ("npc", npc_name),
+        lambda: {
+            "npc_info": npc_info,
+            "status": "active"
+        }
+    ))
 
 @app.get("/npcs/{npc_name}/memories")
-async def get_npc_memories(npc_name: str, limit: int = 10):
+async def get_npc_memories(
+        npc_name: str,
+        http_request: Request,
+        limit: int = Query(10, ge=1, le=200),
+        cursor: Optional[str] = None,
+        player_id: Optional[str] = None,
+        memory_type: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        min_importance: float = Query(0.0, ge=0.0, le=1.0)
+):
     print(f"前端发来{npc_name}memories请求")
 
-    """获取NPC的记忆列表"""
+    """
+    分页获取NPC的记忆列表(按时间倒序)
+    传入上一页返回的 next_cursor 获取下一页, 可按玩家、记忆类型、时间范围和最低重要性过滤
+    """
     npc_mgr, _ = get_managers()
 
     # 验证NPC是否存在
@@ -211,13 +582,30 @@ async def get_npc_memories(npc_name: str, limit: int = 10):
             detail=f"NPC '{npc_name}' 不存在"
         )
 
+    forwarded = await _forward_to_owner(http_request, npc_name)
+    if forwarded is not None:
+        return forwarded
+    npc_mgr.ensure_agent(npc_name)
+
     try:
-        memories = npc_mgr.get_npc_memories(npc_name, limit=limit)
+        result = npc_mgr.get_npc_memories(
+            npc_name,
+            limit=limit,
+            cursor=cursor,
+            player_id=player_id,
+            memory_type=memory_type,
+            since=since,
+            until=until,
+            min_importance=min_importance
+        )
         return {
             "npc_name": npc_name,
-            "memories": memories,
-            "total": len(memories)
+            "memories": result["memories"],
+            "total": len(result["memories"]),
+            "next_cursor": result["next_cursor"]
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -225,7 +613,7 @@ async def get_npc_memories(npc_name: str, limit: int = 10):
         )
 
 @app.delete("/npcs/{npc_name}/memories")
-async def clear_npc_memories(npc_name: str, memory_type: str = None):
+async def clear_npc_memories(npc_name: str, http_request: Request, memory_type: str = None):
     print("前端发来memories请求")
 
     """清空NPC的记忆 (用于测试)"""
@@ -239,6 +627,11 @@ async def clear_npc_memories(npc_name: str, memory_type: str = None):
             detail=f"NPC '{npc_name}' 不存在"
         )
 
+    forwarded = await _forward_to_owner(http_request, npc_name)
+    if forwarded is not None:
+        return forwarded
+    npc_mgr.ensure_agent(npc_name)
+
     try:
         npc_mgr.clear_npc_memory(npc_name, memory_type)
 
@@ -253,7 +646,28 @@ async def clear_npc_memories(npc_name: str, memory_type: str = None):
             detail=f"清空记忆失败: {str(e)}"
         )
 
-@app.get("/npcs/{npc_name}/affinity")
+@app.delete("/players/{player_id}/memories")
+async def clear_player_memories(player_id: str):
+    print(f"前端发来{player_id}memories删除请求")
+
+    """删除玩家在所有NPC中的记忆 (记忆库为所有进程共享, 无需转发)"""
+    npc_mgr, _ = get_managers()
+
+    try:
+        deleted = await asyncio.to_thread(npc_mgr.clear_player_memories, player_id)
+
+        return {
+            "message": f"已删除玩家{player_id}的记忆",
+            "player_id": player_id,
+            "deleted": deleted
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"删除记忆失败: {str(e)}"
+        )
+
+@app.get("/npcs/{npc_name}/affinity", response_class=FastJSONResponse)
 async def get_npc_affinity(npc_name: str, player_id: str = "player"):
     print(f"前端发来{npc_name}affinity请求")
 
@@ -269,12 +683,15 @@ async def get_npc_affinity(npc_name: str, player_id: str = "player"):
         )
 
     try:
-        affinity_info = npc_mgr.get_npc_affinity(npc_name, player_id)
-        return {
-            "npc_name": npc_name,
-            "player_id": player_id,
-            **affinity_info
-        }
+        def build():
+            affinity_info = npc_mgr.get_npc_affinity(npc_name, player_id)
+            return {
+                "npc_name": npc_name,
+                "player_id": player_id,
+                **affinity_info
+            }
+
+        return FastJSONResponse(response_cache.get_or_build(("affinity", npc_name, player_id), build))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -319,7 +736,7 @@ async def set_npc_affinity(npc_name: str, affinity: float, player_id: str = "pla
             detail=f"设置好感度失败: {str(e)}"
         )
 
-@app.get("/affinities")
+@app.get("/affinities", response_class=FastJSONResponse)
 async def get_all_affinities(player_id: str = "player"):
     print("前端发来get_allaffinity请求")
 
@@ -327,11 +744,14 @@ async def get_all_affinities(player_id: str = "player"):
     npc_mgr, _ = get_managers()
 
     try:
-        affinities = npc_mgr.get_all_affinities(player_id)
-        return {
-            "player_id": player_id,
-            "affinities": affinities
-        }
+        def build():
+            affinities = npc_mgr.get_all_affinities(player_id)
+            return {
+                "player_id": player_id,
+                "affinities": affinities
+            }
+
+        return FastJSONResponse(response_cache.get_or_build(("affinities", player_id), build))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -344,10 +764,22 @@ if __name__ == '__main__':
     print(f"📍 监听地址: {settings.API_HOST}:{settings.API_PORT}")
     print(f"📖 访问文档: http://localhost:{settings.API_PORT}/docs\n")
 
-    uvicorn.run(
-        "main:app",
-        host=settings.API_HOST,
-        port=settings.API_PORT,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    if settings.API_WORKERS > 1:
+        # 多进程: 每个worker独立运行本模块, 对话快照和好感度通过共享状态同步
+        if not settings.SHARED_STATE_ENABLED:
+            print("⚠️  多worker运行时请设置 SHARED_STATE_ENABLED=true, 否则各worker的状态互不相通")
+        uvicorn.run(
+            "main:app",
+            host=settings.API_HOST,
+            port=settings.API_PORT,
+            workers=settings.API_WORKERS,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host=settings.API_HOST,
+            port=settings.API_PORT,
+            reload=True,
+            log_level="info"
+        )
\ No newline at end of file
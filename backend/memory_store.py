@@ -0,0 +1,552 @@
+"""NPC记忆存储 - 所有NPC的工作记忆和情景记忆存放在同一个SQLite数据库中
+
+- memories 表按 NPC/玩家/类型/重要性/时间 建立索引, 列表查询和清空都是索引查询
+- memories_fts 为FTS5全文索引(trigram分词, 支持中文子串匹配), 检索按BM25相关度排序
+- 记忆按 (NPC, 玩家) 分区: 检索只扫描当前玩家的记忆, 删除某个玩家的全部记忆只涉及该玩家的行
+- 每个分区的工作记忆和情景记忆有容量上限, 超出时先遗忘重要性低的, 再遗忘最早的
+- 打开数据库只需建立连接(不加载历史记忆), 启动耗时与记忆数量无关
+
+NPCMemory 提供与 hello_agents MemoryManager 相同的 add_memory / retrieve_memories 接口
+首次打开时自动导入旧版 memory_data/<npc_name>/memory.db 中的记忆
+"""
+
+import base64
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from hello_agents.memory import MemoryItem
+
+from clock import get_clock
+from config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    npc_name TEXT NOT NULL,
+    player_id TEXT,
+    memory_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    importance REAL NOT NULL,
+    timestamp REAL NOT NULL,
+    metadata TEXT NOT NULL,
+    part TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_npc_time ON memories(npc_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_memories_npc_player_time ON memories(npc_name, player_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_memories_npc_type_time ON memories(npc_name, memory_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_memories_npc_importance ON memories(npc_name, importance);
+CREATE INDEX IF NOT EXISTS idx_memories_player ON memories(player_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+    content, part, content='memories', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_fts(rowid, content, part) VALUES (new.seq, new.content, new.part);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_fts(memories_fts, rowid, content, part) VALUES ('delete', old.seq, old.content, old.part);
+END;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_COLUMNS = "seq, id, npc_name, player_id, memory_type, content, importance, timestamp, metadata"
+
+# 情景记忆关键词(与 hello_agents MemoryManager 的自动分类一致)
+_EPISODIC_KEYWORDS = ("昨天", "今天", "明天", "上次", "记得", "发生", "经历")
+
+# 查询文本中的连续文字(中文、字母、数字)
+_WORD_RUN_PATTERN = re.compile(r"[0-9A-Za-z\u4e00-\u9fff]+")
+
+# 单次检索最多使用的trigram数
+_MAX_QUERY_TRIGRAMS = 24
+
+# 分区键使用的汉字范围(U+4E00起)
+_PARTITION_ALPHABET_SIZE = 20902
+
+
+def _partition_key(*parts:str)->str:
+    """
+    全文索引的分区键: 由摘要映射成的3个汉字, 在trigram分词下恰好是一个词,
+    检索时与查询词的倒排列表直接取交集, 只匹配该分区的记忆(偶发的键冲突由SQL条件过滤)
+    """
+    value = int.from_bytes(hashlib.md5("\x1f".join(parts).encode("utf-8")).digest()[:8], "big")
+    chars = []
+    for _ in range(3):
+        value, index = divmod(value, _PARTITION_ALPHABET_SIZE)
+        chars.append(chr(0x4E00 + index))
+    return "".join(chars)
+
+
+def _part_column(npc_name:str, player_id:Optional[str])->str:
+    """
+    记忆的分区列: NPC分区键 + (NPC, 玩家)分区键, 可按NPC或按NPC+玩家检索
+    """
+    return f"{_partition_key(npc_name)} {_partition_key(npc_name, player_id or '')}"
+
+
+def build_fts_query(text:str)->Optional[str]:
+    """
+    把查询文本转换为FTS5查询(trigram分词: 每段连续文字拆成3字片段, 任一片段命中即可)
+    :return: 查询表达式, 文本太短(不足3字)时返回None
+    """
+    trigrams = []
+    seen = set()
+    for run in _WORD_RUN_PATTERN.findall(text.lower()):
+        for i in range(len(run) - 2):
+            trigram = run[i:i + 3]
+            if trigram not in seen:
+                seen.add(trigram)
+                trigrams.append(trigram)
+            if len(trigrams) >= _MAX_QUERY_TRIGRAMS:
+                break
+        if len(trigrams) >= _MAX_QUERY_TRIGRAMS:
+            break
+
+    if not trigrams:
+        return None
+    return " OR ".join(f'"{trigram}"' for trigram in trigrams)
+
+
+def encode_cursor(timestamp:float, seq:int)->str:
+    """分页游标(最后一条记忆的时间和序号)"""
+    return base64.urlsafe_b64encode(f"{timestamp!r}:{seq}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor:str)->Tuple[float, int]:
+    """
+    解析分页游标
+    :raises ValueError: 游标无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, seq = raw.split(":")
+        return float(timestamp), int(seq)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def _row_to_item(row:Sequence)->MemoryItem:
+    """数据库行 -> MemoryItem"""
+    _, memory_id, npc_name, _, memory_type, content, importance, timestamp, metadata = row
+    return MemoryItem(
+        id=memory_id,
+        content=content,
+        memory_type=memory_type,
+        user_id=npc_name,
+        timestamp=datetime.fromtimestamp(timestamp),
+        importance=importance,
+        metadata=json.loads(metadata)
+    )
+
+
+class MemoryStore:
+    """
+    记忆数据库
+
+    功能:
+    1. 每个线程独立的SQLite连接(WAL模式, 多进程分片时可同时读写)
+    2. 写入记忆并同步全文索引(触发器)
+    3. 全文检索 + 按时间的索引查询
+    4. 导入旧版按NPC分目录的记忆
+    5. 按 (NPC, 玩家) 分区检索和删除
+    6. 按 (NPC, 玩家, 类型) 限制记忆条数
+    """
+
+    def __init__(self, db_path:str):
+        """
+        :param db_path: 数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+        self._migrate_partitions()
+
+    def _migrate_partitions(self):
+        """旧数据库只按NPC分区: 重新计算分区列并重建全文索引(只执行一次)"""
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'partition_scheme'").fetchone():
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("SELECT seq, npc_name, player_id FROM memories").fetchall()
+        conn.executemany(
+            "UPDATE memories SET part = ? WHERE seq = ?",
+            [(_part_column(npc_name, player_id), seq) for seq, npc_name, player_id in rows]
+        )
+        if rows:
+            conn.execute("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')")
+            print(f"📦 记忆已按(NPC, 玩家)重新分区: {len(rows)}条")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('partition_scheme', 'npc_player')")
+        conn.execute("COMMIT")
+
+    def _connection(self)->sqlite3.Connection:
+        """当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, npc_name:str, item:MemoryItem):
+        """写入一条记忆"""
+        metadata = item.metadata or {}
+        self._connection().execute(
+            "INSERT OR REPLACE INTO memories "
+            "(id, npc_name, player_id, memory_type, content, importance, timestamp, metadata, part) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                item.id, npc_name, metadata.get("player_id"), item.memory_type, item.content,
+                item.importance, item.timestamp.timestamp(),
+                json.dumps(metadata, ensure_ascii=False, default=str),
+                _part_column(npc_name, metadata.get("player_id"))
+            )
+        )
+
+    @staticmethod
+    def _filters(
+            npc_name:str,
+            player_id:Optional[str],
+            memory_types:Sequence[str],
+            min_importance:float,
+            working_since:Optional[float]
+    ):
+        """
+        公共过滤条件(列名带 m. 前缀)
+        类型和重要性条件加一元+号, 只作为过滤, 查询计划始终按 npc_name(+player_id)+timestamp 索引倒序扫描
+        """
+        clauses = ["m.npc_name = ?"]
+        params:List[Any] = [npc_name]
+        if player_id is not None:
+            clauses.append("m.player_id = ?")
+            params.append(player_id)
+        clauses += [f"+m.memory_type IN ({','.join('?' * len(memory_types))})", "+m.importance >= ?"]
+        params += [*memory_types, min_importance]
+        if working_since is not None:
+            # 工作记忆只保留有效期内的
+            clauses.append("(m.memory_type != 'working' OR +m.timestamp >= ?)")
+            params.append(working_since)
+        return " AND ".join(clauses), params
+
+    def search(
+            self,
+            npc_name:str,
+            query:str,
+            memory_types:Sequence[str],
+            limit:int,
+            min_importance:float = 0.0,
+            working_since:Optional[float] = None,
+            player_id:Optional[str] = None
+    )->List[MemoryItem]:
+        """
+        全文检索(按BM25相关度排序)
+        :param working_since: 工作记忆的最早时间(时间戳), 为空时不限制
+        :param player_id: 只检索该玩家的分区, 为空时检索NPC的全部记忆
+        """
+        fts_query = build_fts_query(query)
+        if fts_query is None or not memory_types:
+            return []
+
+        where, params = self._filters(npc_name, player_id, memory_types, min_importance, working_since)
+        partition = _partition_key(npc_name) if player_id is None else _partition_key(npc_name, player_id)
+        match = f'part:"{partition}" AND content:({fts_query})'
+        rows = self._connection().execute(
+            f"SELECT {', '.join('m.' + c for c in _COLUMNS.split(', '))} "
+            f"FROM memories_fts JOIN memories m ON m.seq = memories_fts.rowid "
+            f"WHERE memories_fts MATCH ? AND {where} ORDER BY rank LIMIT ?",
+            (match, *params, limit)
+        ).fetchall()
+        return [_row_to_item(row) for row in rows]
+
+    def recent(
+            self,
+            npc_name:str,
+            memory_types:Sequence[str],
+            limit:int,
+            min_importance:float = 0.0,
+            working_since:Optional[float] = None,
+            player_id:Optional[str] = None
+    )->List[MemoryItem]:
+        """最近的记忆(按时间倒序, 走 npc_name(+player_id)+timestamp 索引)"""
+        if not memory_types:
+            return []
+        where, params = self._filters(npc_name, player_id, memory_types, min_importance, working_since)
+        rows = self._connection().execute(
+            f"SELECT {_COLUMNS} FROM memories m WHERE {where} ORDER BY m.timestamp DESC LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return [_row_to_item(row) for row in rows]
+
+    def page(
+            self,
+            npc_name:str,
+            limit:int,
+            cursor:Optional[str] = None,
+            player_id:Optional[str] = None,
+            memory_type:Optional[str] = None,
+            since:Optional[float] = None,
+            until:Optional[float] = None,
+            min_importance:float = 0.0
+    )->Tuple[List[MemoryItem], Optional[str]]:
+        """
+        按时间倒序分页列出记忆(游标分页, 不做相关度检索)
+        玩家/类型条件走对应的 (npc_name, 字段, timestamp) 索引, 翻页从上一页最后一条继续扫描
+        :param cursor: 上一页返回的游标, 为空时从最新的记忆开始
+        :param since: 最早时间(时间戳, 含)
+        :param until: 最晚时间(时间戳, 不含)
+        :return: (记忆列表, 下一页游标), 没有更多时游标为None
+        """
+        clauses = ["npc_name = ?"]
+        params:List[Any] = [npc_name]
+        if player_id is not None:
+            clauses.append("player_id = ?")
+            params.append(player_id)
+        if memory_type is not None:
+            clauses.append("memory_type = ?")
+            params.append(memory_type)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if min_importance > 0:
+            clauses.append("+importance >= ?")
+            params.append(min_importance)
+        if cursor:
+            clauses.append("(timestamp, seq) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        rows = self._connection().execute(
+            f"SELECT {_COLUMNS} FROM memories WHERE {' AND '.join(clauses)} "
+            f"ORDER BY timestamp DESC, seq DESC LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[7], last[0])
+        return [_row_to_item(row) for row in rows], next_cursor
+
+    def prune(
+            self,
+            npc_name:str,
+            player_id:Optional[str],
+            memory_type:str,
+            capacity:int,
+            forgetting_threshold:float
+    )->int:
+        """
+        分区内超出容量的记忆: 重要性不低于阈值的优先保留, 同一档内保留最新的(全文索引由触发器同步删除)
+        :param capacity: 保留条数
+        :param forgetting_threshold: 重要性低于此值的记忆先被遗忘
+        :return: 删除条数
+        """
+        return self._connection().execute(
+            "DELETE FROM memories WHERE seq IN ("
+            "SELECT seq FROM memories WHERE npc_name = ? AND player_id IS ? AND +memory_type = ? "
+            "ORDER BY importance >= ? DESC, timestamp DESC, seq DESC LIMIT -1 OFFSET ?)",
+            (npc_name, player_id, memory_type, forgetting_threshold, max(0, capacity))
+        ).rowcount
+
+    def delete(self, npc_name:str, memory_type:Optional[str] = None)->int:
+        """
+        删除NPC的记忆
+        :param memory_type: 只删除该类型, 为空时删除全部
+        :return: 删除条数
+        """
+        conn = self._connection()
+        if memory_type:
+            cursor = conn.execute(
+                "DELETE FROM memories WHERE npc_name = ? AND memory_type = ?", (npc_name, memory_type)
+            )
+        else:
+            cursor = conn.execute("DELETE FROM memories WHERE npc_name = ?", (npc_name,))
+        return cursor.rowcount
+
+    def delete_player(self, player_id:str)->int:
+        """
+        删除玩家在所有NPC中的记忆(走 player_id 索引, 耗时只与该玩家的记忆数有关)
+        :return: 删除条数
+        """
+        return self._connection().execute("DELETE FROM memories WHERE player_id = ?", (player_id,)).rowcount
+
+    def checkpoint(self):
+        """把WAL合并回主数据库文件(写世界快照时调用, 重启时无需回放日志)"""
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def count(self, npc_name:Optional[str] = None)->int:
+        """记忆条数"""
+        if npc_name is None:
+            return self._connection().execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM memories WHERE npc_name = ?", (npc_name,)
+        ).fetchone()[0]
+
+    def import_legacy(self, memory_dir:Path)->int:
+        """
+        导入旧版记忆(memory_data/<npc_name>/memory.db, 只执行一次)
+        :return: 导入条数
+        """
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return 0
+
+        imported = 0
+        for legacy_db in sorted(memory_dir.glob("*/memory.db")):
+            npc_name = legacy_db.parent.name
+            try:
+                legacy = sqlite3.connect(legacy_db)
+                rows = legacy.execute(
+                    "SELECT id, content, memory_type, timestamp, importance, properties FROM memories"
+                ).fetchall()
+                legacy.close()
+            except sqlite3.Error as e:
+                print(f"⚠️  跳过旧版记忆 {legacy_db}: {e}")
+                continue
+
+            conn.execute("BEGIN")
+            for memory_id, content, memory_type, timestamp, importance, properties in rows:
+                metadata = json.loads(properties) if properties else {}
+                metadata.setdefault("player_id", metadata.get("session_id"))
+                conn.execute(
+                    "INSERT OR IGNORE INTO memories "
+                    "(id, npc_name, player_id, memory_type, content, importance, timestamp, metadata, part) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        memory_id, npc_name, metadata.get("player_id"), memory_type, content, importance,
+                        float(timestamp), json.dumps(metadata, ensure_ascii=False),
+                        _part_column(npc_name, metadata.get("player_id"))
+                    )
+                )
+            conn.execute("COMMIT")
+            imported += len(rows)
+
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)", (datetime.now().isoformat(),))
+        if imported:
+            print(f"📦 已导入旧版记忆 {imported} 条")
+        return imported
+
+    def for_npc(self, npc_name:str)->"NPCMemory":
+        """NPC的记忆视图"""
+        return NPCMemory(self, npc_name)
+
+
+class NPCMemory:
+    """
+    单个NPC的记忆(接口与 hello_agents MemoryManager 一致)
+    """
+
+    def __init__(self, store:MemoryStore, npc_name:str):
+        self.store = store
+        self.npc_name = npc_name
+        self.user_id = npc_name
+        self.working_ttl = timedelta(minutes=settings.WORKING_MEMORY_TTL_MINUTES)
+        self.capacities = {
+            "working": settings.WORKING_MEMORY_CAPACITY,
+            "episodic": settings.EPISODIC_MEMORY_CAPACITY
+        }
+
+    def add_memory(
+            self,
+            content:str,
+            memory_type:str = "working",
+            importance:Optional[float] = None,
+            metadata:Optional[Dict[str, Any]] = None,
+            auto_classify:bool = True
+    )->str:
+        """
+        添加记忆(该玩家的同类记忆超出容量时遗忘多余的)
+        :param auto_classify: 包含情景关键词的内容归为情景记忆
+        :return: 记忆ID
+        """
+        if auto_classify:
+            if metadata and metadata.get("type"):
+                memory_type = metadata["type"]
+            elif any(keyword in content for keyword in _EPISODIC_KEYWORDS):
+                memory_type = "episodic"
+
+        item = MemoryItem(
+            id=str(uuid.uuid4()),
+            content=content,
+            memory_type=memory_type,
+            user_id=self.npc_name,
+            timestamp=get_clock().now(),
+            importance=0.5 if importance is None else importance,
+            metadata=metadata or {}
+        )
+        self.store.add(self.npc_name, item)
+        capacity = self.capacities.get(memory_type)
+        if capacity is not None:
+            self.store.prune(
+                self.npc_name, item.metadata.get("player_id"), memory_type,
+                capacity, settings.MEMORY_FORGETTING_THRESHOLD
+            )
+        return item.id
+
+    def retrieve_memories(
+            self,
+            query:str,
+            memory_types:Optional[List[str]] = None,
+            limit:int = 10,
+            min_importance:float = 0.0,
+            player_id:Optional[str] = None,
+            recent:Optional[List[MemoryItem]] = None
+    )->List[MemoryItem]:
+        """
+        检索记忆: 先取全文相关的记忆, 不足时用最近的记忆补足
+        :param query: 查询内容(为空时只返回最近的记忆)
+        :param memory_types: 记忆类型, 默认工作记忆和情景记忆
+        :param player_id: 只检索与该玩家的记忆(其他玩家的对话不会进入提示词)
+        :param recent: 预热时已取好的最近记忆, 提供时不再查询
+        """
+        memory_types = memory_types or ["working", "episodic"]
+        working_since = get_clock().time() - self.working_ttl.total_seconds()
+
+        results = self.store.search(
+            self.npc_name, query, memory_types, limit, min_importance, working_since, player_id
+        )
+        if len(results) < limit:
+            seen = {item.id for item in results}
+            if recent is None:
+                recent = self.store.recent(
+                    self.npc_name, memory_types, limit, min_importance, working_since, player_id
+                )
+            results.extend(item for item in recent if item.id not in seen)
+        return results[:limit]
+
+    def clear_memory_type(self, memory_type:str):
+        """清空指定类型的记忆"""
+        self.store.delete(self.npc_name, memory_type)
+
+    def clear_all_memories(self):
+        """清空全部记忆"""
+        self.store.delete(self.npc_name)
+
+
+# 全局单例
+_memory_store = None
+
+def get_memory_store()->MemoryStore:
+    """获取记忆数据库(首次打开时导入旧版记忆)"""
+    global _memory_store
+    if _memory_store is None:
+        _memory_store = MemoryStore(settings.MEMORY_DB_FILE)
+        _memory_store.import_legacy(Path(settings.MEMORY_DB_FILE).parent)
+    return _memory_store
@@ -0,0 +1,291 @@
+"""运行指标 - 对话各阶段耗时、批量生成耗时、LLM token数, 以Prometheus文本格式导出
+
+记录路径上只做一次二分查找和几次整数加法, 不做格式化;
+缓存命中率、兜底次数等已有统计在抓取时通过采集函数读取, 不重复计数
+"""
+
+import bisect
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 默认耗时分桶(秒): 覆盖本地操作(毫秒级)到LLM调用(数十秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 中日韩字符(约1个token/字), 其他字符约4个字符/token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text:str)->int:
+    """粗略估算文本的token数(无需加载分词器)"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _format_labels(labelnames:Sequence[str], values:Sequence[str], extra:str = "")->str:
+    """格式化标签 {a="x",b="y"}"""
+    parts = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value:float)->str:
+    """格式化数值(整数不带小数点)"""
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """计数器(只增不减)"""
+
+    type = "counter"
+
+    def __init__(self, name:str, documentation:str, labelnames:Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values:Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount:float = 1, *labelvalues:str):
+        """
+        增加计数
+        :param amount: 增量
+        :param labelvalues: 标签值(按labelnames顺序)
+        """
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def values(self)->Dict[Tuple[str, ...], float]:
+        """当前各标签组合的计数 {标签值元组: 计数}"""
+        with self._lock:
+            return dict(self._values)
+
+    def collect(self)->List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+
+class Histogram:
+    """直方图(累计分桶 + 总和 + 计数)"""
+
+    type = "histogram"
+
+    def __init__(
+            self,
+            name:str,
+            documentation:str,
+            labelnames:Sequence[str] = (),
+            buckets:Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [各分桶计数..., +Inf计数, 总和]}, 分桶计数不累计, 导出时再累加
+        self._values:Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value:float, *labelvalues:str):
+        """
+        记录一次观测值
+        :param value: 观测值(耗时为秒)
+        :param labelvalues: 标签值(按labelnames顺序)
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labelvalues:str)->"_Timer":
+        """计时上下文(异常时同样记录)"""
+        return _Timer(self, labelvalues)
+
+    def collect(self)->List[str]:
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+
+        lines = []
+        for labels, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    """直方图计时上下文(类实现, 比生成器式上下文管理器开销小)"""
+
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram:Histogram, labelvalues:Tuple[str, ...]):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+# 采集函数返回的样本: (指标名, 类型, 说明, [(标签字典, 值), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+
+    1. 直接记录的指标(Counter/Histogram)
+    2. 抓取时调用的采集函数, 把其他模块已有的统计转换为指标
+    """
+
+    def __init__(self):
+        self._metrics:Dict[str, object] = {}
+        self._collectors:List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name:str, documentation:str, labelnames:Sequence[str] = ())->Counter:
+        """注册(或获取已注册的)计数器"""
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, documentation, labelnames)
+        return self._metrics[name]
+
+    def histogram(
+            self,
+            name:str,
+            documentation:str,
+            labelnames:Sequence[str] = (),
+            buckets:Sequence[float] = DEFAULT_BUCKETS
+    )->Histogram:
+        """注册(或获取已注册的)直方图"""
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+        return self._metrics[name]
+
+    def register_collector(self, collector:Callable[[], Iterable[Sample]]):
+        """注册采集函数(抓取时调用)"""
+        self._collectors.append(collector)
+
+    def render(self)->str:
+        """导出Prometheus文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"❌ 指标采集失败: {e}")
+                continue
+
+            for name, metric_type, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values:
+                    label_str = _format_labels(list(labels.keys()), list(labels.values()))
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表
+registry = MetricsRegistry()
+
+# ==================== 指标定义 ====================
+
+CHAT_STAGE_SECONDS = registry.histogram(
+    "aitown_chat_stage_seconds",
+    "对话各阶段耗时(affinity_lookup/memory_retrieval/prompt_build/agent_run/affinity_analysis/memory_save)",
+    ["stage"]
+)
+CHAT_SECONDS = registry.histogram("aitown_chat_seconds", "单轮对话总耗时", ["status"])
+
+BATCH_SECONDS = registry.histogram("aitown_batch_seconds", "一次批量生成的总耗时")
+BATCH_SHARD_SECONDS = registry.histogram("aitown_batch_shard_seconds", "批量生成单个分片的耗时", ["status"])
+
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    "aitown_event_loop_lag_seconds",
+    "事件循环延迟(定时任务实际唤醒时间与预期的差值)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+PREWARMS = registry.counter("aitown_prewarm_total", "对话预热次数(requested=预热, used=首轮对话使用了预热结果)", ["result"])
+
+SHARD_FORWARDS = registry.counter("aitown_shard_forwards_total", "转发到其他NPC分片的请求数", ["result"])
+
+AMBIENT_LINES = registry.counter(
+    "aitown_ambient_lines_total",
+    "环境台词数(source=monologue独白/conversation对话, state=generated生成/shown已播放/expired作废)",
+    ["source", "state"]
+)
+
+LLM_CALLS = registry.counter("aitown_llm_calls_total", "LLM调用次数", ["caller"])
+LLM_TOKENS = registry.counter("aitown_llm_tokens_total", "LLM token数(按文本估算)", ["caller", "kind"])
+LLM_WAIT_SECONDS = registry.histogram("aitown_llm_wait_seconds", "LLM调用等待并发名额的耗时", ["caller"])
+
+
+def chat_stage(stage:str)->_Timer:
+    """记录对话单个阶段的耗时(with语句使用)"""
+    return _Timer(CHAT_STAGE_SECONDS, (stage,))
+
+
+def record_llm_call(caller:str, prompt:str, completion:str):
+    """
+    记录一次LLM调用及其token数
+    :param caller: 调用方(chat/batch/affinity)
+    :param prompt: 提示词文本
+    :param completion: 输出文本
+    """
+    LLM_CALLS.inc(1, caller)
+    LLM_TOKENS.inc(estimate_tokens(prompt), caller, "prompt")
+    LLM_TOKENS.inc(estimate_tokens(completion), caller, "completion")
+
+
+# 环境台词来源对应的LLM调用方
+AMBIENT_CALLERS = {"monologue": "batch", "conversation": "conversation"}
+
+
+def ambient_tokens_per_line()->Dict[str, float]:
+    """
+    每句已播放环境台词的平均LLM token数(含未播放即作废的台词的成本)
+    :return: {source: token数}, 还没有播放过的来源不返回
+    """
+    tokens = LLM_TOKENS.values()
+    lines = AMBIENT_LINES.values()
+    costs = {}
+    for source, caller in AMBIENT_CALLERS.items():
+        shown = lines.get((source, "shown"), 0)
+        if shown:
+            costs[source] = sum(value for (name, _), value in tokens.items() if name == caller) / shown
+    return costs
+
+
+def render_metrics()->str:
+    """导出全部指标"""
+    return registry.render()
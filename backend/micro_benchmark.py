@@ -0,0 +1,270 @@
+"""热点路径微基准测试与性能回归检查
+
+覆盖每次请求/每轮更新都会执行的纯Python代码:
+批量响应解析、好感度分析解析、记忆上下文构建、系统提示词、批量提示词、
+状态查询、好感度等级/修饰词, 以及 models.py 中的模型序列化
+
+不同机器速度不同, 基线按校准负载的耗时归一化后保存(data/micro_benchmark_baseline.json),
+检查时比较归一化耗时, 超过容差即视为回归
+
+使用方法:
+  python micro_benchmark.py                 # 运行并与基线对比
+  python micro_benchmark.py --check         # 有回归时返回非零退出码(用于CI)
+  python micro_benchmark.py --save          # 保存当前结果为新基线
+  python micro_benchmark.py --filter parse  # 只运行名称包含parse的基准
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 基准测试只调用本地代码, 不访问LLM; 未配置时填入占位值使LLM客户端能正常创建
+os.environ.setdefault("LLM_API_KEY", "benchmark")
+os.environ.setdefault("LLM_BASE_URL", "http://127.0.0.1:9/v1")
+os.environ.setdefault("LOG_CONSOLE", "false")
+
+BASELINE_FILE = Path(__file__).parent / "data" / "micro_benchmark_baseline.json"
+
+# 默认容差: 归一化耗时比基线慢25%以上视为回归
+DEFAULT_TOLERANCE = 0.25
+
+# 每个基准交替测量的轮数(每轮先测校准负载再测基准, 取比值的中位数, 抵消机器负载波动)
+ROUNDS = 7
+
+
+def _calibration():
+    """校准负载: 混合字典、字符串、列表操作, 代表本项目热点代码的典型开销"""
+    data = {f"npc{i}": f"第{i}句对话内容" for i in range(20)}
+    parts = []
+    for key, value in data.items():
+        if value.startswith("第"):
+            parts.append(f"{key}: {value}")
+    return "\n".join(sorted(parts))
+
+
+def _timer(func:Callable[[], object])->Tuple[timeit.Timer, int]:
+    """创建计时器, 选择使每轮约0.1秒的循环次数"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    return timer, max(1, int(number * 0.1 / max(elapsed, 1e-9)))
+
+
+def measure(func:Callable[[], object], calibration:Tuple[timeit.Timer, int])->Tuple[float, float, float]:
+    """
+    交替测量基准和校准负载
+    :return: (基准单次耗时ns, 校准负载单次耗时ns, 归一化耗时=两者比值的中位数)
+    """
+    timer, number = _timer(func)
+    calibration_timer, calibration_number = calibration
+
+    samples, calibration_samples, ratios = [], [], []
+    for _ in range(ROUNDS):
+        calibration_ns = calibration_timer.timeit(calibration_number) / calibration_number * 1e9
+        ns = timer.timeit(number) / number * 1e9
+        samples.append(ns)
+        calibration_samples.append(calibration_ns)
+        ratios.append(ns / calibration_ns)
+
+    return min(samples), min(calibration_samples), statistics.median(ratios)
+
+
+# ==================== 基准定义 ====================
+
+def build_benchmarks()->List[Tuple[str, Callable[[], object]]]:
+    """构建所有基准(名称, 无参函数)"""
+    from hello_agents.memory import MemoryItem
+
+    from agents import NPCAgentManager, create_system_prompt
+    from batch_generator import get_batch_generator
+    from models import ChatResponse, NPCInfo, NPCListResponse, NPCStatusResponse
+    from relationship_manager import RelationshipManager
+    from roster import get_roster
+    from state_manager import NPCStateManager
+
+    roster = get_roster()
+    names = roster.names()
+    generator = get_batch_generator()
+    relationship = RelationshipManager(generator.llm)
+
+    # 批量响应(干净JSON / 带代码块和多余文字)
+    dialogues = {name: f"{roster.roles[name]['activity']}中,今天的进度还不错,再坚持一下。" for name in names}
+    clean_response = json.dumps(dialogues, ensure_ascii=False)
+    messy_response = f"好的,以下是生成的对话:\n```json\n{json.dumps(dialogues, ensure_ascii=False, indent=2)}\n```\n希望符合要求!"
+
+    # 好感度分析响应
+    clean_analysis = '{"should_change": true, "change_amount": 5, "reason": "友好问候", "sentiment": "positive"}'
+    messy_analysis = f"分析结果如下:\n{clean_analysis}\n以上。"
+
+    # 记忆(_build_memory_context 不依赖实例状态, 跳过Agent和记忆系统的初始化)
+    agent_manager = NPCAgentManager.__new__(NPCAgentManager)
+    now = datetime.now()
+    memories = [
+        MemoryItem(
+            id=str(i), content=f"玩家说: 第{i}次聊天,最近在忙什么项目?", memory_type="working",
+            user_id=names[0], timestamp=now - timedelta(minutes=i), importance=0.5
+        )
+        for i in range(5)
+    ]
+
+    # 状态管理器(不启动后台更新)
+    state_manager = NPCStateManager(update_interval=30)
+    with state_manager._publish_lock:
+        state_manager._apply_changes(dialogues)
+        state_manager._apply_changes({names[0]: "刚刚更新的一句话"})
+    state_manager.last_update = now
+    latest_version = state_manager.version
+    full_state = state_manager.get_current_state()
+
+    context = "上午工作时间,大家精神饱满"
+    role = roster.roles[names[0]]
+    affinities = [5.0, 25.0, 45.0, 65.0, 85.0]
+
+    def affinity_resolution():
+        for affinity in affinities:
+            relationship.get_affinity_level(affinity)
+            relationship.get_affinity_modifier(affinity)
+
+    npc_list = [NPCInfo(name=name, **{k: roster.roles[name][k] for k in ("title", "location", "activity")}) for name in names]
+
+    return [
+        ("batch._parse_response.clean", lambda: generator._parse_response(clean_response)),
+        ("batch._parse_response.messy", lambda: generator._parse_response(messy_response)),
+        ("batch._build_batch_prompt", lambda: generator._build_batch_prompt(context, names)),
+        ("relationship._parse_analysis.clean", lambda: relationship._parse_analysis(clean_analysis)),
+        ("relationship._parse_analysis.messy", lambda: relationship._parse_analysis(messy_analysis)),
+        ("relationship.affinity_level_modifier", affinity_resolution),
+        ("agents._build_memory_context", lambda: agent_manager._build_memory_context(memories)),
+        ("agents.create_system_prompt", lambda: create_system_prompt(names[0], role)),
+        ("state.get_current_state.full", lambda: state_manager.get_current_state()),
+        ("state.get_current_state.delta", lambda: state_manager.get_current_state(since=latest_version - 1)),
+        ("models.ChatResponse.dump", lambda: ChatResponse(
+            npc_name=names[0], npc_title=role["title"], message=clean_analysis, request_id="benchmark"
+        ).model_dump_json()),
+        ("models.NPCStatusResponse.dump", lambda: NPCStatusResponse(**full_state).model_dump(mode="json")),
+        ("models.NPCListResponse.dump", lambda: NPCListResponse(npcs=npc_list, total=len(npc_list)).model_dump(mode="json")),
+    ]
+
+
+# ==================== 运行与对比 ====================
+
+def run(name_filter:Optional[str] = None, names:Optional[List[str]] = None)->Dict:
+    """
+    运行基准, 返回结果(含校准耗时和归一化耗时)
+    :param name_filter: 只运行名称包含该字符串的基准
+    :param names: 只运行这些基准
+    """
+    benchmarks = build_benchmarks()
+    if name_filter:
+        benchmarks = [(name, func) for name, func in benchmarks if name_filter in name]
+    if names is not None:
+        benchmarks = [(name, func) for name, func in benchmarks if name in names]
+
+    calibration = _timer(_calibration)
+    results = {}
+    calibrations = []
+    for name, func in benchmarks:
+        ns, calibration_ns, relative = measure(func, calibration)
+        calibrations.append(calibration_ns)
+        results[name] = {"ns": round(ns, 1), "relative": round(relative, 4)}
+    calibration_ns = min(calibrations) if calibrations else 0.0
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ns": round(calibration_ns, 1),
+        "benchmarks": results
+    }
+
+
+def compare(current:Dict, baseline:Dict, tolerance:float)->List[str]:
+    """
+    与基线对比并打印结果
+    :return: 发生回归的基准名称
+    """
+    regressions = []
+    print(f"\n{'基准':<42}{'耗时(μs)':>12}{'基线(μs)':>12}{'变化':>10}")
+    print("-" * 76)
+
+    scale = current["calibration_ns"] / baseline["calibration_ns"] if baseline else 1.0
+    for name, result in current["benchmarks"].items():
+        base = (baseline or {}).get("benchmarks", {}).get(name)
+        if base is None:
+            print(f"{name:<42}{result['ns'] / 1000:>12.2f}{'-':>12}{'新增':>10}")
+            continue
+
+        # 按校准负载换算到当前机器速度
+        expected_ns = base["relative"] * current["calibration_ns"]
+        change = result["relative"] / base["relative"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = " ❌"
+        elif change < -tolerance:
+            flag = " 🚀"
+        print(f"{name:<42}{result['ns'] / 1000:>12.2f}{expected_ns / 1000:>12.2f}{change:>+10.1%}{flag}")
+
+    if baseline:
+        print(f"\n校准负载: {current['calibration_ns']:.0f}ns (基线 {baseline['calibration_ns']:.0f}ns, 机器速度比 {scale:.2f})")
+    return regressions
+
+
+def load_baseline()->Optional[Dict]:
+    if not BASELINE_FILE.exists():
+        return None
+    with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(result:Dict):
+    BASELINE_FILE.parent.mkdir(exist_ok=True)
+    with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"\n💾 基线已保存: {BASELINE_FILE}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点路径微基准测试")
+    parser.add_argument("--save", action="store_true", help="保存结果为新基线")
+    parser.add_argument("--check", action="store_true", help="有回归时返回非零退出码")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="允许的变慢比例(默认0.25)")
+    parser.add_argument("--filter", help="只运行名称包含该字符串的基准")
+    args = parser.parse_args()
+
+    current = run(args.filter)
+    baseline = load_baseline()
+    regressions = compare(current, baseline, args.tolerance)
+
+    if args.save:
+        if args.filter and baseline:
+            # 只更新本次运行的基准, 归一化值可直接合并
+            baseline["benchmarks"].update(current["benchmarks"])
+            current = dict(baseline, benchmarks=baseline["benchmarks"])
+        save_baseline(current)
+        return
+
+    if baseline is not None and regressions:
+        # 单次测量可能受机器负载影响, 回归的基准重新测量确认
+        print(f"\n🔁 重新测量{len(regressions)}个疑似回归的基准...")
+        regressions = compare(run(names=regressions), baseline, args.tolerance)
+
+    if baseline is None:
+        print("\n⚠️  没有基线, 使用 --save 保存当前结果")
+    elif regressions:
+        print(f"\n❌ {len(regressions)}个基准变慢超过{args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+    else:
+        print(f"\n✅ 没有超过{args.tolerance:.0%}的性能回归")
+
+
+if __name__ == "__main__":
+    main()
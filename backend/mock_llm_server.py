@@ -0,0 +1,299 @@
+"""本地模拟LLM服务(OpenAI兼容接口), 用于压测和离线开发
+
+只依赖标准库, 可在离线的Linux机器上运行。支持:
+- POST /v1/chat/completions (含 stream=true 的SSE流式输出)
+- GET  /v1/models
+- 可配置的延迟分布、逐token流式间隔和失败率
+
+根据提示词内容返回合理的结果:
+- 批量对话提示词 -> 包含输出格式中每个NPC的JSON
+- 好感度分析提示词 -> 分析结果JSON
+- 问候语池提示词 -> 每个好感度等级若干句问候语的JSON
+- 环境对话提示词 -> 每个对话组参与者轮流发言的JSON
+- 其他(NPC对话) -> 一句简短回复
+
+使用方法:
+  python mock_llm_server.py                                   # 默认端口9000, 对数正态延迟
+  python mock_llm_server.py --port 9100 --latency fixed:200   # 固定200ms
+  python mock_llm_server.py --latency uniform:100:800 --failure-rate 0.05 --token-ms 20
+
+后端连接模拟服务:
+  LLM_BASE_URL=http://127.0.0.1:9000/v1 LLM_API_KEY=mock LLM_MODEL_ID=mock-model python main.py
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+# 批量提示词中的输出格式条目: "张三": "..."
+_FORMAT_ENTRY_PATTERN = re.compile(r'"([^"]+)": "\.\.\."')
+# 问候语池提示词中的好感度等级条目: - 陌生: ...
+_GREETING_LEVEL_PATTERN = re.compile(r"^- (\S+?): ", re.MULTILINE)
+# 环境对话提示词中的对话组: 1. 地点: 工位区, 参与者: 张三、李四
+_CONVERSATION_GROUP_PATTERN = re.compile(r"^(\d+)\. 地点: .*?, 参与者: ([^(\n]+)", re.MULTILINE)
+
+# 模拟回复内容
+_CHAT_REPLIES = [
+    "你好!我正在忙手头的工作,有什么可以帮你的吗?",
+    "这个问题挺有意思的,我们可以一起看看。",
+    "最近项目有点忙,不过聊几句还是可以的。",
+    "哈哈,你说得对,我也是这么想的。"
+]
+_AMBIENT_LINES = [
+    "这个bug终于找到原因了,原来是缓存没有失效。",
+    "下午的会议要准备一下材料。",
+    "来杯咖啡提提神,继续干活!",
+    "今天的进度还不错,再坚持一下。"
+]
+_GREETINGS = [
+    "嗨,你来啦!我正好在忙,有事尽管说。",
+    "哟,是你啊,今天过得怎么样?",
+    "你好,有什么我可以帮忙的吗?",
+    "来得正好,我刚想找人聊聊。"
+]
+_VERDICTS = [
+    {"should_change": True, "change_amount": 3, "reason": "友好交流", "sentiment": "positive"},
+    {"should_change": False, "change_amount": 0, "reason": "普通闲聊", "sentiment": "neutral"},
+    {"should_change": True, "change_amount": -3, "reason": "态度冷淡", "sentiment": "negative"}
+]
+
+
+def parse_latency(spec:str)->Callable[[], float]:
+    """
+    解析延迟分布
+    :param spec: fixed:MS / uniform:MIN_MS:MAX_MS / normal:MEAN_MS:STD_MS / lognormal:MEDIAN_MS:SIGMA
+    :return: 返回一次采样延迟(秒)的函数
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal" and len(values) == 2:
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"无法解析延迟分布: {spec}")
+
+
+class MockLLMConfig:
+    """模拟服务配置"""
+
+    def __init__(
+            self,
+            latency:str = "lognormal:400:0.5",
+            token_ms:float = 10,
+            failure_rate:float = 0.0,
+            failure_status:int = 500
+    ):
+        """
+        :param latency: 首token延迟分布(见 parse_latency)
+        :param token_ms: 流式输出时每个分块的间隔(毫秒)
+        :param failure_rate: 请求失败的概率
+        :param failure_status: 失败时返回的HTTP状态码(500/429/503)
+        """
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.token_ms = token_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+
+        # 统计
+        self.requests = 0
+        self.failures = 0
+        self.streams = 0
+        self._lock = threading.Lock()
+
+    def stats(self)->Dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "streams": self.streams,
+            "latency": self.latency,
+            "failure_rate": self.failure_rate
+        }
+
+
+def generate_reply(messages:List[Dict])->str:
+    """根据提示词生成模拟回复"""
+    text = "\n".join(str(message.get("content", "")) for message in messages)
+
+    if "情感分析" in text:
+        return json.dumps(random.choice(_VERDICTS), ensure_ascii=False)
+
+    if "开场白" in text and "等级名称" in text:
+        levels = _GREETING_LEVEL_PATTERN.findall(text)
+        return json.dumps({level: random.sample(_GREETINGS, 2) for level in levels}, ensure_ascii=False)
+
+    if "【对话组】" in text:
+        conversations = {}
+        for index, participants in _CONVERSATION_GROUP_PATTERN.findall(text):
+            speakers = participants.strip().split("、")
+            conversations[index] = [[speakers[turn % len(speakers)], random.choice(_AMBIENT_LINES)] for turn in range(6)]
+        return json.dumps(conversations, ensure_ascii=False)
+
+    names = _FORMAT_ENTRY_PATTERN.findall(text)
+    if names:
+        return json.dumps({name: random.choice(_AMBIENT_LINES) for name in names}, ensure_ascii=False)
+
+    return random.choice(_CHAT_REPLIES)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """OpenAI兼容接口处理器"""
+
+    config:MockLLMConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 压测时不输出访问日志
+        pass
+
+    def _send_json(self, status:int, payload:Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.config.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        config = self.config
+        with config._lock:
+            config.requests += 1
+
+        # 模拟首token延迟
+        time.sleep(config.sample_latency())
+
+        if random.random() < config.failure_rate:
+            with config._lock:
+                config.failures += 1
+            self._send_json(config.failure_status, {
+                "error": {"message": "mock failure", "type": "server_error"}
+            })
+            return
+
+        reply = generate_reply(request.get("messages", []))
+        model = request.get("model", "mock-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if request.get("stream"):
+            with config._lock:
+                config.streams += 1
+            self._stream(completion_id, model, reply)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": sum(len(str(m.get("content", ""))) for m in request.get("messages", [])),
+                "completion_tokens": len(reply),
+                "total_tokens": 0
+            }
+        })
+
+    def _stream(self, completion_id:str, model:str, reply:str):
+        """SSE流式输出(每个分块4个字符)"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(delta:Dict, finish_reason:Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        for i in range(0, len(reply), 4):
+            send({"content": reply[i:i + 4]})
+            if self.config.token_ms:
+                time.sleep(self.config.token_ms / 1000)
+        send({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def create_server(host:str = "127.0.0.1", port:int = 9000, config:Optional[MockLLMConfig] = None)->ThreadingHTTPServer:
+    """
+    创建模拟服务(调用方负责 serve_forever / shutdown)
+    :param port: 端口, 0表示随机分配
+    """
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {"config": config or MockLLMConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟LLM服务(OpenAI兼容接口)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="lognormal:400:0.5",
+                        help="首token延迟分布: fixed:MS / uniform:MIN:MAX / normal:MEAN:STD / lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--token-ms", type=float, default=10, help="流式输出每个分块的间隔(毫秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="请求失败概率(0-1)")
+    parser.add_argument("--failure-status", type=int, default=500, help="失败时返回的HTTP状态码")
+    args = parser.parse_args()
+
+    config = MockLLMConfig(args.latency, args.token_ms, args.failure_rate, args.failure_status)
+    server = create_server(args.host, args.port, config)
+
+    print(f"🧪 模拟LLM服务已启动: http://{args.host}:{server.server_address[1]}/v1")
+    print(f"   延迟: {args.latency}, 分块间隔: {args.token_ms}ms, 失败率: {args.failure_rate:.0%}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n📊 {json.dumps(config.stats(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
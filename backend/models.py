@@ -8,12 +8,14 @@ class ChatRequest(BaseModel):
     """单个NPC对话请求"""
     npc_name:str = Field(..., description="NPC名称")
     message:str = Field(..., description="玩家消息")
+    player_id:str = Field("player", description="玩家ID(记忆和好感度按玩家区分)")
 
     class Config:
         json_schema_extra = {
             "example": {
                 "npc_name": "张三",
-                "message": "你好,你在做什么?"
+                "message": "你好,你在做什么?",
+                "player_id": "player"
             }
         }
 
@@ -24,6 +26,7 @@ class ChatResponse(BaseModel):
     message:str = Field(..., description="NPC回复")
     success:bool = Field(default=True, description="是否成功")
     timestamp:Optional[datetime] = Field(default_factory=datetime.now, description="时间戳")
+    request_id:Optional[str] = Field(default=None, description="请求ID(对应追踪和对话日志)")
 
     class config:
         json_shema_extra = {
@@ -45,9 +48,12 @@ class NPCInfo(BaseModel):
 
 class NPCStatusResponse(BaseModel):
     """NPC状态响应"""
-    dialogues:Dict[str, str] = Field(..., description="NPC当前对话内容")
+    dialogues:Dict[str, str] = Field(..., description="NPC当前对话内容(增量模式下只包含变化的NPC)")
     last_update:Optional[datetime] = Field(None, description="上次更新时间")
     next_update_in:int = Field(..., description="下次更新倒计时")
+    version:int = Field(0, description="状态版本号")
+    full:bool = Field(True, description="是否为全量状态")
+    removed:List[str] = Field(default_factory=list, description="已移除的NPC(增量模式)")
 
     class config:
         json_schema_extra = {
@@ -58,7 +64,10 @@ class NPCStatusResponse(BaseModel):
                     "王五": "这个界面的配色方案还需要优化一下。"
                 },
                 "last_update": "2024-01-15T10:30:00",
-                "next_update_in": 25
+                "next_update_in": 25,
+                "version": 1705285800042,
+                "full": True,
+                "removed": []
             }
         }
 
@@ -66,3 +75,18 @@ class NPCListResponse(BaseModel):
     """NPC列表响应"""
     npcs:List[NPCInfo] = Field(..., description="NPC列表")
     total:int = Field(..., description="NPC总数")
+
+class PlayerPresenceRequest(BaseModel):
+    """玩家位置上报请求"""
+    player_id:str = Field(default="player", description="玩家ID")
+    location:Optional[str] = Field(None, description="玩家所在区域(与NPC位置名称一致)")
+    nearby_npcs:List[str] = Field(default_factory=list, description="玩家附近/视野内的NPC")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "player_id": "player",
+                "location": "工位区",
+                "nearby_npcs": ["张三", "李四"]
+            }
+        }
@@ -6,10 +6,24 @@ import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'HelloAgents'))
 
 from hello_agents import SimpleAgent, HelloAgentsLLM
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 import json
+import random
 import re
 
+from clock import get_clock
+from config import settings
+from llm_limiter import llm_slot
+from logger import LOGS_DIR, log_record
+from affinity_rules import get_rule_classifier
+from json_extractor import extract_json_object
+from metrics import record_llm_call
+from shared_state import get_shared_state
+from tracing import span
+
+# LLM判定记录文件(供 affinity_benchmark.py 离线评估规则一致性)
+VERDICTS_FILE = LOGS_DIR / "affinity_verdicts.jsonl"
+
 class RelationshipManager:
     """NPC好感度管理器
        功能:
@@ -30,6 +44,20 @@ class RelationshipManager:
         # 格式: {npc_name: {player_id: affinity_score}}
         self.affinity_scores:Dict[str, Dict[str, float]] = {}
 
+        # 多进程共享存储(启用时好感度读写都走共享存储, affinity_scores不再使用)
+        self.shared_state = get_shared_state()
+        self._shared_seq = self.shared_state.affinity_seq() if self.shared_state else 0
+
+        # 本地规则分类器(明显的正面/负面消息直接判定,不调用LLM)
+        self.rule_classifier = get_rule_classifier()
+        self.rule_threshold = settings.AFFINITY_RULE_THRESHOLD
+
+        # 分析来源统计
+        self.analysis_stats:Dict[str, int] = {"rule": 0, "llm": 0}
+
+        # 好感度变化订阅者(如响应缓存失效)
+        self._listeners:List[Callable[[str, str], None]] = []
+
         # 创建好感度分析Agent
         self.analyzer_agent = SimpleAgent(
             name="AffinityAnalyzer",
@@ -116,12 +144,15 @@ class RelationshipManager:
         :param player_id: 玩家ID
         :return:好感度(0-100)
         """
+        if self.shared_state:
+            return self.shared_state.get_affinity(npc_name, player_id)
 
         if npc_name not in self.affinity_scores:
             self.affinity_scores[npc_name] = {}
 
         if player_id not in self.affinity_scores[npc_name]:
             self.affinity_scores[npc_name][player_id] = 50.0 # 初始好感度为0
+            self._notify(npc_name, player_id)
 
         return self.affinity_scores[npc_name][player_id]
 
@@ -133,12 +164,59 @@ class RelationshipManager:
         :param player_id:玩家ID
         """
 
-        if npc_name not in self.affinity_scores:
-            self.affinity_scores[npc_name] = {}
-
         # 限制在0-100范围内
         affinaty = max(0.0, min(100.0, affinaty))
-        self.affinity_scores[npc_name][player_id] = affinaty
+
+        if self.shared_state:
+            self.shared_state.set_affinity(npc_name, player_id, affinaty)
+        else:
+            self.affinity_scores.setdefault(npc_name, {})[player_id] = affinaty
+        self._notify(npc_name, player_id)
+
+    def _adjust_affinity(self, npc_name:str, delta:float, player_id:str = "player"):
+        """
+        增减好感度
+        :return: (变化前, 变化后)
+        """
+        if self.shared_state:
+            # 共享存储中原子地读-改-写, 多个进程同时更新同一玩家时不会丢失变化
+            old, new = self.shared_state.adjust_affinity(npc_name, player_id, delta)
+            self._notify(npc_name, player_id)
+            return old, new
+
+        old = self.get_affinity(npc_name, player_id)
+        new = max(0.0, min(100.0, old + delta))
+        self.set_affinity(npc_name, new, player_id)
+        return old, new
+
+    def sync_shared_changes(self)->int:
+        """
+        通知其他进程写入的好感度变化(定时调用, 使本进程的缓存失效)
+        :return: 变化条数
+        """
+        if not self.shared_state:
+            return 0
+
+        changes = self.shared_state.affinity_changes(self._shared_seq)
+        for npc_name, player_id, seq in changes:
+            self._notify(npc_name, player_id)
+            self._shared_seq = seq
+        return len(changes)
+
+    def subscribe(self, listener:Callable[[str, str], None]):
+        """
+        订阅好感度变化
+        :param listener: 回调函数(npc_name, player_id)
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, npc_name:str, player_id:str):
+        """通知订阅者好感度已变化"""
+        for listener in self._listeners:
+            try:
+                listener(npc_name, player_id)
+            except Exception as e:
+                print(f"❌ 好感度变化处理失败: {e}")
 
     def _parse_analysis(self, response:str):
         """
@@ -150,19 +228,12 @@ class RelationshipManager:
             analysis = json.loads(response)
             return analysis
         except json.JSONDecodeError:
-            # 尝试提取json部分
-
-            # 查找第一个 { 和最后一个 }
-            start = response.find('{')
-            end = response.find('}') + 1
-
-            if start != -1 and end > start:
-                json_str = response[start:end]
-                try:
-                    analysis = json.loads(json_str)
-                    return analysis
-                except json.JSONDecodeError:
-                    pass
+            # 尝试提取json部分(支持前后多余文字和嵌套括号)
+            analysis = extract_json_object(response)
+            if analysis and "should_change" in analysis and "change_amount" in analysis:
+                analysis.setdefault("reason", "未知")
+                analysis.setdefault("sentiment", "neutral")
+                return analysis
 
             # 尝试使用正则表达式提取
             # 匹配 "should_change": true/false
@@ -179,6 +250,67 @@ class RelationshipManager:
                     "sentiment": sentiment_match.group(1) if sentiment_match else "neutral"
                 }
 
+    def _fast_path_analysis(self, player_message:str)->Optional[Dict]:
+        """
+        本地规则快速判定
+        :param player_message:玩家消息
+        :return:置信度达到阈值时返回分析结果,否则返回None
+        """
+        if not settings.AFFINITY_RULE_ENABLED:
+            return None
+
+        analysis = self.rule_classifier.classify(player_message)
+        if analysis["confidence"] < self.rule_threshold:
+            return None
+
+        self.analysis_stats["rule"] += 1
+        return analysis
+
+    def _llm_analysis(self, npc_name:str, player_message:str, npc_response:str)->Dict:
+        """
+        调用LLM分析对话
+        :param npc_name:NPC名称
+        :param player_message:玩家消息
+        :param npc_response:NPC回复
+        :return:解析后的分析结果
+        """
+        # 构建分析提示
+        prompt = f"""
+        请分析以下对话:
+
+        玩家: {player_message}
+        {npc_name}: {npc_response}
+
+        请判断是否应该改变好感度,并给出变化量。
+        """
+
+        # 调用分析agent
+        with span("llm.affinity"), llm_slot("affinity"):
+            response = self.analyzer_agent.run(prompt)
+        # 每次判定相互独立, 不保留历史(否则提示词随对话次数无限增长)
+        self.analyzer_agent.clear_history()
+        self.analysis_stats["llm"] += 1
+        record_llm_call("affinity", (self.analyzer_agent.system_prompt or "") + prompt, response)
+
+        # 解析json响应
+        return self._parse_analysis(response)
+
+    def _record_verdict(self, npc_name:str, player_message:str, npc_response:str, analysis:Dict, rule:Optional[Dict] = None):
+        """
+        记录LLM判定结果(JSON Lines, 经后台日志线程写入),用于离线评估规则分类器
+        :param rule: 规则命中时的规则判定(影子对照), 未命中为None
+        """
+        record = {
+            "timestamp": get_clock().now().isoformat(),
+            "npc_name": npc_name,
+            "player_message": player_message,
+            "npc_response": npc_response,
+            "verdict": analysis,
+            "rule": rule,
+            "shadow_rate": settings.AFFINITY_VERDICT_SHADOW_RATE if rule else None
+        }
+        log_record(VERDICTS_FILE.name, record, settings.AFFINITY_VERDICT_MAX_BYTES)
+
     def get_affinity_level(self, affinity:float):
         """
         获取好感度等级
@@ -211,29 +343,28 @@ class RelationshipManager:
         :param player_id:玩家ID
         :return:分析结果字典
         """
-        # 构建分析提示
-        prompt = f"""
-        请分析以下对话:
-
-        玩家: {player_message}
-        {npc_name}: {npc_response}
-
-        请判断是否应该改变好感度,并给出变化量。
-        """
         try:
-            # 调用分析agent
-            response = self.analyzer_agent.run(prompt)
-
-            # 解析json响应
-            analysis = self._parse_analysis(response)
+            # 先尝试本地规则快速判定,不确定时才调用LLM
+            with span("affinity.rule") as rule_span:
+                analysis = self._fast_path_analysis(player_message)
+                rule_span.set("hit", analysis is not None)
+
+            if analysis is None:
+                analysis = self._llm_analysis(npc_name, player_message, npc_response)
+                if settings.AFFINITY_VERDICT_RECORDING and analysis:
+                    self._record_verdict(npc_name, player_message, npc_response, analysis)
+            elif settings.AFFINITY_VERDICT_RECORDING and random.random() < settings.AFFINITY_VERDICT_SHADOW_RATE:
+                # 规则命中的消息按比例同时调用LLM, 记录两者的判定(否则评估数据中没有规则覆盖的消息)
+                verdict = self._llm_analysis(npc_name, player_message, npc_response)
+                if verdict:
+                    self._record_verdict(npc_name, player_message, npc_response, verdict, rule=analysis)
 
             if analysis["should_change"]:
                 # 更新好感度
-                current_affinity = self.get_affinity(npc_name, player_id)
-                new_affinity = current_affinity + analysis["change_amount"]
-                new_affinity = max(0.0, min(100.0, new_affinity))
-
-                self.set_affinity(npc_name, new_affinity, player_id)
+                with span("affinity.write"):
+                    current_affinity, new_affinity = self._adjust_affinity(
+                        npc_name, analysis["change_amount"], player_id
+                    )
 
                 # 获取好感度等级
                 old_level = self.get_affinity_level(current_affinity)
@@ -294,12 +425,13 @@ class RelationshipManager:
         :return:所有的NPC的好感度消息
         """
         result = {}
-        for npc_name in self.affinity_scores:
-          affinity = self.get_affinity(npc_name, player_id)
-          result[npc_name] = {
-               "affinity": affinity,
+        npc_names = self.shared_state.player_affinities(player_id) if self.shared_state else self.affinity_scores
+        for npc_name in npc_names:
+            affinity = self.get_affinity(npc_name, player_id)
+            result[npc_name] = {
+                "affinity": affinity,
                 "level": self.get_affinity_level(affinity),
                 "modifier": self.get_affinity_modifier(affinity)
-          }
+            }
 
-          return result
+        return result
@@ -0,0 +1,166 @@
+"""预序列化响应缓存 - 读多写少的接口直接返回缓存的JSON字节"""
+
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi.responses import Response
+
+from config import settings
+
+# orjson为可选依赖, 未安装时退回标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj:Any):
+    """标准库json无法处理的类型"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps(obj:Any)->bytes:
+    """序列化为JSON字节(优先使用orjson)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    快速JSON响应
+    - 内容为bytes时视为已序列化, 直接发送
+    - 其他内容使用 dumps 序列化(跳过FastAPI的jsonable_encoder)
+    """
+    media_type = "application/json"
+
+    def render(self, content:Any)->bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+class ResponseCache:
+    """
+    响应缓存
+
+    键为元组, 第一个元素表示资源类型, 例如:
+    ("npcs",) / ("npc", npc_name) / ("affinity", npc_name, player_id) / ("affinities", player_id)
+
+    键中包含客户端传入的player_id, 条目数按LRU限制在 max_entries 以内;
+    构建期间键被失效时(每次构建记录一个代号, 失效时作废), 构建结果不写回缓存, 避免写入过期内容
+    """
+
+    def __init__(self, max_entries:int = 2048):
+        """
+        :param max_entries: 最多缓存的条目数(超出时淘汰最久未使用的)
+        """
+        self.max_entries = max_entries
+        self._entries:"OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._versioned:Dict[Hashable, Tuple[int, bytes]] = {}  # 按版本缓存(只保留最新版本)
+        self._building:Dict[Hashable, int] = {}  # 构建中的键 -> 构建代号
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key:Hashable, builder:Callable[[], Any])->bytes:
+        """
+        获取缓存的响应, 不存在时调用builder构建并序列化
+        :param key: 缓存键
+        :param builder: 返回可序列化对象的函数
+        :return: JSON字节
+        """
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+            generation = self._building[key] = next(self._generations)
+
+        body = dumps(builder())
+        with self._lock:
+            # 构建期间被失效(或被更新的构建取代)时不写回
+            if self._building.get(key) == generation:
+                del self._building[key]
+                self._entries[key] = body
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return body
+
+    def get_versioned(self, key:Hashable, version:int, builder:Callable[[], Any])->bytes:
+        """
+        按版本获取缓存的响应片段, 版本变化时重新构建(旧版本被替换)
+        并发构建不同版本时, 只有不低于已缓存版本的结果写回, 较旧的构建结果不会覆盖较新的版本
+        :param key: 缓存键
+        :param version: 数据版本
+        :param builder: 返回可序列化对象的函数
+        :return: JSON字节
+        """
+        with self._lock:
+            entry = self._versioned.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        body = dumps(builder())
+        with self._lock:
+            entry = self._versioned.get(key)
+            if entry is None or version >= entry[0]:
+                self._versioned[key] = (version, body)
+        return body
+
+    def invalidate(self, kind:Optional[str] = None, *args:Any):
+        """
+        使缓存失效
+        :param kind: 资源类型, 为空时清空全部
+        :param args: 资源键的其余部分, 为空时使该类型全部失效
+        """
+        with self._lock:
+            if kind is None:
+                self._entries.clear()
+                self._versioned.clear()
+                self._building.clear()
+                return
+
+            if args:
+                self._entries.pop((kind, *args), None)
+                self._building.pop((kind, *args), None)
+                return
+
+            for entries in (self._entries, self._building):
+                for key in [k for k in entries if k[0] == kind]:
+                    del entries[key]
+
+    def stats(self)->Dict[str, Any]:
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+# 全局单例
+_response_cache = None
+
+def get_response_cache()->ResponseCache:
+    """获取响应缓存单例"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES)
+    return _response_cache
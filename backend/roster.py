@@ -0,0 +1,211 @@
+"""NPC角色名册 - 从数据文件加载NPC设定和预设对话, 支持热加载"""
+
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import settings
+
+# 每个NPC必须包含的角色字段
+ROLE_FIELDS = ("title", "location", "activity", "personality", "expertise", "style", "hobbies")
+
+# 预设对话的时间段
+PRESET_PERIODS = ("morning", "noon", "afternoon", "evening")
+
+
+class NPCRoster:
+    """
+    NPC角色名册
+
+    功能:
+    1. 从JSON数据文件加载NPC角色设定和预设对话
+    2. 维护按名称、位置、职位的索引
+    3. 检测文件变化并热加载, 通知订阅者哪些NPC发生了变化
+    """
+
+    def __init__(self, path:Optional[str] = None):
+        """
+        初始化名册
+        :param path: 名册文件路径, 默认使用 settings.NPC_ROSTER_FILE
+        """
+        self.path = Path(path or settings.NPC_ROSTER_FILE)
+
+        # 角色设定: {npc_name: {title, location, ...}}
+        self.roles:Dict[str, Dict[str, str]] = {}
+        # 预设对话: {period: {npc_name: dialogue}}
+        self.presets:Dict[str, Dict[str, str]] = {period: {} for period in PRESET_PERIODS}
+        # 索引
+        self.by_location:Dict[str, List[str]] = {}
+        self.by_title:Dict[str, List[str]] = {}
+
+        self._file_signature = None
+        self._listeners:List[Callable[[Dict], None]] = []
+        self._watch_task:Optional[asyncio.Task] = None
+
+        self.load()
+
+    @staticmethod
+    def _parse(raw:Dict):
+        """
+        解析名册数据
+        :param raw: 文件内容 {"npcs": {name: {...role, "presets": {...}}}}
+        :return: (roles, presets)
+        :raises ValueError: 结构或字段类型不正确
+        """
+        npcs = raw.get("npcs") if isinstance(raw, dict) else None
+        if not isinstance(npcs, dict) or not npcs:
+            raise ValueError("名册文件缺少npcs字段或为空")
+
+        roles = {}
+        presets = {period: {} for period in PRESET_PERIODS}
+
+        for name, entry in npcs.items():
+            if not isinstance(entry, dict):
+                raise ValueError(f"NPC '{name}' 的设定必须是对象")
+
+            missing = [field for field in ROLE_FIELDS if not entry.get(field)]
+            if missing:
+                raise ValueError(f"NPC '{name}' 缺少字段: {', '.join(missing)}")
+            invalid = [field for field in ROLE_FIELDS if not isinstance(entry[field], str)]
+            if invalid:
+                raise ValueError(f"NPC '{name}' 的字段必须是字符串: {', '.join(invalid)}")
+
+            roles[name] = {field: entry[field] for field in ROLE_FIELDS}
+
+            entry_presets = entry.get("presets") or {}
+            if not isinstance(entry_presets, dict):
+                raise ValueError(f"NPC '{name}' 的presets必须是对象")
+            for period, dialogue in entry_presets.items():
+                if period in presets and dialogue:
+                    if not isinstance(dialogue, str):
+                        raise ValueError(f"NPC '{name}' 的预设对话 {period} 必须是字符串")
+                    presets[period][name] = dialogue
+
+        return roles, presets
+
+    def _signature(self):
+        """文件签名(修改时间+大小), 用于判断是否需要重新加载"""
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self)->Dict:
+        """
+        加载(或重新加载)名册文件
+        :return: 变化详情 {"added", "removed", "changed", "presets_changed"}
+        """
+        start = time.perf_counter()
+        signature = self._signature()
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            roles, presets = self._parse(json.load(f))
+
+        # 构建索引
+        by_location:Dict[str, List[str]] = {}
+        by_title:Dict[str, List[str]] = {}
+        for name, role in roles.items():
+            by_location.setdefault(role["location"], []).append(name)
+            by_title.setdefault(role["title"], []).append(name)
+
+        old_roles = self.roles
+        diff = {
+            "added": [name for name in roles if name not in old_roles],
+            "removed": [name for name in old_roles if name not in roles],
+            "changed": [name for name in roles if name in old_roles and roles[name] != old_roles[name]],
+            "presets_changed": presets != self.presets
+        }
+
+        # 整体替换引用,读取方不会看到构建中的数据
+        self.roles = roles
+        self.presets = presets
+        self.by_location = by_location
+        self.by_title = by_title
+        self._file_signature = signature
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"📇 NPC名册已加载: {len(roles)}个NPC ({elapsed_ms:.1f}ms, {self.path.name})")
+        return diff
+
+    def reload_if_changed(self)->Optional[Dict]:
+        """
+        文件有变化时重新加载并通知订阅者
+        :return: 变化详情, 没有变化或加载失败返回None
+        """
+        try:
+            if self._signature() == self._file_signature:
+                return None
+            diff = self.load()
+        except Exception as e:
+            # 文件写到一半或格式错误时保留旧名册
+            print(f"❌ NPC名册热加载失败, 继续使用旧名册: {e}")
+            return None
+
+        if diff["added"] or diff["removed"] or diff["changed"] or diff["presets_changed"]:
+            print(f"🔄 NPC名册变化: 新增{diff['added']} 移除{diff['removed']} 修改{diff['changed']}")
+            for listener in self._listeners:
+                try:
+                    listener(diff)
+                except Exception as e:
+                    print(f"❌ 名册变化处理失败: {e}")
+        return diff
+
+    def subscribe(self, listener:Callable[[Dict], None]):
+        """订阅名册变化"""
+        self._listeners.append(listener)
+
+    async def _watch_loop(self, interval:float):
+        """定时检查名册文件"""
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                self.reload_if_changed()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # 单次检查出错不能让热加载停止
+                print(f"❌ NPC名册检查失败: {e}")
+
+    def start_watching(self, interval:Optional[float] = None):
+        """启动热加载检查任务"""
+        if self._watch_task is None:
+            interval = interval or settings.NPC_ROSTER_RELOAD_INTERVAL
+            self._watch_task = asyncio.create_task(self._watch_loop(interval))
+            print(f"👀 NPC名册热加载已启用 (检查间隔: {interval}秒)")
+
+    async def stop_watching(self):
+        """停止热加载检查任务"""
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def get(self, npc_name:str)->Optional[Dict[str, str]]:
+        """按名称获取角色设定"""
+        return self.roles.get(npc_name)
+
+    def names(self)->List[str]:
+        """所有NPC名称"""
+        return list(self.roles.keys())
+
+    def find_by_location(self, location:str)->List[str]:
+        """按位置查找NPC"""
+        return list(self.by_location.get(location, []))
+
+    def find_by_title(self, title:str)->List[str]:
+        """按职位查找NPC"""
+        return list(self.by_title.get(title, []))
+
+
+# 全局单例
+_roster = None
+
+def get_roster()->NPCRoster:
+    """获取NPC名册单例"""
+    global _roster
+    if _roster is None:
+        _roster = NPCRoster()
+    return _roster
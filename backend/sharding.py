@@ -0,0 +1,154 @@
+"""NPC分片 - 按一致性哈希把NPC分配到多个进程, 对话请求转发到拥有该NPC的进程
+
+每个NPC的Agent会话和记忆管理器只在一个进程中加载, 记忆检索始终命中本进程的热数据;
+记忆检索、解析等CPU开销分散到所有进程(多核)
+
+分片成员通过共享状态(shared_state)的心跳表发现, 进程上线/下线或名册变化时重新分配:
+一致性哈希保证只有少量NPC换进程
+"""
+
+import asyncio
+import bisect
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import settings
+from shared_state import SharedStateStore, get_shared_state
+
+# 转发请求的标记头(收到已转发的请求时直接本地处理, 避免成员视图不一致时循环转发)
+FORWARDED_HEADER = "X-Shard-Forwarded"
+
+
+def _hash(key:str)->int:
+    """稳定的64位哈希(不受PYTHONHASHSEED影响, 所有进程结果一致)"""
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环(每个节点多个虚拟节点, 节点增减时只迁移少量键)"""
+
+    def __init__(self, nodes:Iterable[str], virtual_nodes:int = 64):
+        """
+        :param nodes: 节点(分片地址)
+        :param virtual_nodes: 每个节点的虚拟节点数
+        """
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key:str)->Optional[str]:
+        """键所属的节点(环为空时返回None)"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class ShardRouter:
+    """
+    NPC分片路由
+
+    功能:
+    1. 定时心跳登记本进程, 读取在线分片并重建哈希环
+    2. 计算NPC所属的分片
+    3. 分片成员变化时通知订阅者(重新加载/释放NPC)
+    """
+
+    def __init__(self, store:SharedStateStore, url:str):
+        """
+        :param store: 共享状态存储(分片心跳)
+        :param url: 本进程对外地址
+        """
+        self.store = store
+        self.url = url.rstrip("/")
+        self.ring = HashRing([self.url], settings.SHARD_VIRTUAL_NODES)
+        self._listeners:List[Callable[[], None]] = []
+        self._task:Optional[asyncio.Task] = None
+
+        # 启动时立即登记, 初始化Agent前即可知道本进程拥有哪些NPC
+        self.refresh()
+
+    def refresh(self)->bool:
+        """
+        心跳并同步在线分片
+        :return: 分片成员是否变化
+        """
+        self.store.heartbeat_shard(self.url, settings.SHARD_HEARTBEAT_TTL)
+        nodes = self.store.live_shards()
+        if nodes == self.ring.nodes:
+            return False
+
+        self.ring = HashRing(nodes, settings.SHARD_VIRTUAL_NODES)
+        print(f"🧩 分片成员变化: {len(nodes)}个进程 {nodes}")
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"❌ 分片变化处理失败: {e}")
+        return True
+
+    def owner(self, npc_name:str)->str:
+        """NPC所属分片的地址"""
+        return self.ring.owner(npc_name) or self.url
+
+    def is_local(self, npc_name:str)->bool:
+        """NPC是否由本进程负责"""
+        return self.owner(npc_name) == self.url
+
+    def assignments(self, npc_names:Iterable[str])->Dict[str, List[str]]:
+        """各分片负责的NPC {分片地址: [npc_name]}"""
+        result:Dict[str, List[str]] = {node: [] for node in self.ring.nodes}
+        for name in npc_names:
+            result.setdefault(self.owner(name), []).append(name)
+        return result
+
+    def subscribe(self, listener:Callable[[], None]):
+        """订阅分片成员变化"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """启动心跳循环"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """停止心跳并注销(其他进程下一次心跳时接管本进程的NPC)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.store.remove_shard()
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.SHARED_STATE_POLL_INTERVAL)
+                self.refresh()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"❌ 分片心跳失败: {e}")
+
+
+# 全局单例(未启用分片时为None)
+_shard_router = None
+
+def get_shard_router()->Optional[ShardRouter]:
+    """获取分片路由, 未启用(SHARDING_ENABLED=false)或缺少共享状态/SHARD_URL时返回None"""
+    global _shard_router
+    if _shard_router is None and settings.SHARDING_ENABLED:
+        store = get_shared_state()
+        if store is None or not settings.SHARD_URL:
+            print("⚠️  NPC分片需要 SHARED_STATE_ENABLED=true 并设置 SHARD_URL, 已禁用分片")
+            settings.SHARDING_ENABLED = False
+            return None
+        _shard_router = ShardRouter(store, settings.SHARD_URL)
+    return _shard_router
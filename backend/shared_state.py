@@ -0,0 +1,326 @@
+"""多进程共享状态 - 多个worker(uvicorn --workers N)共享NPC对话快照、好感度和玩家位置
+
+使用本地SQLite(WAL模式)作为共享存储, 同一台机器上的多个进程可同时读写:
+- dialogues: NPC当前对话(带版本号, 删除的NPC保留墓碑行, 供其他进程计算增量)
+- affinity:  好感度(seq递增, 其他进程据此使缓存失效)
+- presence:  玩家位置上报(只有生成对话的进程需要全部玩家的位置)
+- leases:    租约(选举唯一执行批量生成的leader)
+- shards:    NPC分片进程的心跳(按一致性哈希分配NPC)
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from clock import get_clock
+from config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogues (
+    npc_name TEXT PRIMARY KEY,
+    dialogue TEXT,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dialogues_version ON dialogues(version);
+
+CREATE TABLE IF NOT EXISTS affinity (
+    npc_name TEXT NOT NULL,
+    player_id TEXT NOT NULL,
+    affinity REAL NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (npc_name, player_id)
+);
+CREATE INDEX IF NOT EXISTS idx_affinity_seq ON affinity(seq);
+
+CREATE TABLE IF NOT EXISTS presence (
+    player_id TEXT PRIMARY KEY,
+    location TEXT,
+    nearby_npcs TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shards (
+    worker_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SharedStateStore:
+    """
+    共享状态存储
+
+    功能:
+    1. 每个线程独立的SQLite连接(WAL模式, 读写互不阻塞)
+    2. NPC对话快照按版本增量同步
+    3. 好感度读写(原子增减)和变化序号
+    4. 基于租约的leader选举
+    5. 分片进程心跳
+    """
+
+    def __init__(self, db_path:str, initial_affinity:float = 50.0):
+        """
+        初始化共享存储
+        :param db_path: SQLite数据库文件路径
+        :param initial_affinity: 未记录时的初始好感度
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.initial_affinity = initial_affinity
+
+        # 本进程标识(主机:进程号:随机后缀, 进程号复用时也不会冲突)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self)->sqlite3.Connection:
+        """当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        """写事务(BEGIN IMMEDIATE, 读-改-写期间其他进程不能写入)"""
+        return _Transaction(self._connection())
+
+    # ==================== NPC对话 ====================
+
+    def write_dialogues(self, changes:Iterable[Tuple[str, Optional[str], int]], version:int):
+        """
+        写入对话变化
+        :param changes: [(npc_name, dialogue, version)], dialogue为None表示NPC已移除
+        :param version: 写入后的快照版本
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO dialogues (npc_name, dialogue, version) VALUES (?, ?, ?)",
+                list(changes)
+            )
+            self._set_meta(conn, "state_version", version)
+
+    def read_dialogues(self, since:Optional[int] = None)->List[Tuple[str, Optional[str], int]]:
+        """
+        读取对话(按版本排序)
+        :param since: 只返回此版本之后的变化, 为空时返回全部(含墓碑行)
+        """
+        conn = self._connection()
+        if since is None:
+            return conn.execute("SELECT npc_name, dialogue, version FROM dialogues ORDER BY version").fetchall()
+        return conn.execute(
+            "SELECT npc_name, dialogue, version FROM dialogues WHERE version > ? ORDER BY version", (since,)
+        ).fetchall()
+
+    def state_version(self)->Optional[int]:
+        """当前快照版本(从未写入时为None)"""
+        value = self.get_meta("state_version")
+        return int(value) if value is not None else None
+
+    # ==================== 元数据 ====================
+
+    @staticmethod
+    def _set_meta(conn:sqlite3.Connection, key:str, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def set_meta(self, key:str, value):
+        with self._transaction() as conn:
+            self._set_meta(conn, key, value)
+
+    def get_meta(self, key:str)->Optional[str]:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def delete_meta(self, key:str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+    # ==================== 好感度 ====================
+
+    def get_affinity(self, npc_name:str, player_id:str)->float:
+        """获取好感度(未记录时返回初始值, 不写入)"""
+        row = self._connection().execute(
+            "SELECT affinity FROM affinity WHERE npc_name = ? AND player_id = ?", (npc_name, player_id)
+        ).fetchone()
+        return row[0] if row else self.initial_affinity
+
+    def set_affinity(self, npc_name:str, player_id:str, affinity:float):
+        """设置好感度"""
+        with self._transaction() as conn:
+            self._write_affinity(conn, npc_name, player_id, affinity)
+
+    def adjust_affinity(self, npc_name:str, player_id:str, delta:float)->Tuple[float, float]:
+        """
+        原子地增减好感度(多个进程同时分析同一玩家的对话时不会互相覆盖)
+        :return: (变化前, 变化后), 限制在0-100范围内
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT affinity FROM affinity WHERE npc_name = ? AND player_id = ?", (npc_name, player_id)
+            ).fetchone()
+            old = row[0] if row else self.initial_affinity
+            new = max(0.0, min(100.0, old + delta))
+            self._write_affinity(conn, npc_name, player_id, new)
+        return old, new
+
+    @staticmethod
+    def _write_affinity(conn:sqlite3.Connection, npc_name:str, player_id:str, affinity:float):
+        """写入好感度并分配新的变化序号(调用方持有写事务)"""
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM affinity").fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO affinity (npc_name, player_id, affinity, seq) VALUES (?, ?, ?, ?)",
+            (npc_name, player_id, affinity, seq)
+        )
+
+    def player_affinities(self, player_id:str)->Dict[str, float]:
+        """玩家与所有NPC的好感度 {npc_name: affinity}"""
+        rows = self._connection().execute(
+            "SELECT npc_name, affinity FROM affinity WHERE player_id = ?", (player_id,)
+        ).fetchall()
+        return dict(rows)
+
+    def affinity_seq(self)->int:
+        """最新的好感度变化序号"""
+        return self._connection().execute("SELECT COALESCE(MAX(seq), 0) FROM affinity").fetchone()[0]
+
+    def affinity_changes(self, since_seq:int)->List[Tuple[str, str, int]]:
+        """指定序号之后变化的好感度 [(npc_name, player_id, seq)]"""
+        return self._connection().execute(
+            "SELECT npc_name, player_id, seq FROM affinity WHERE seq > ? ORDER BY seq", (since_seq,)
+        ).fetchall()
+
+    # ==================== 玩家位置 ====================
+
+    def report_presence(self, player_id:str, location:Optional[str], nearby_npcs:Optional[Iterable[str]]):
+        """记录玩家位置上报(上报时间为游戏内时间, 与单进程的兴趣区域一致)"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO presence (player_id, location, nearby_npcs, last_seen) VALUES (?, ?, ?, ?)",
+                (player_id, location, json.dumps(list(nearby_npcs or []), ensure_ascii=False), get_clock().time())
+            )
+
+    def active_presence(self, ttl:float)->List[Tuple[str, Optional[str], List[str]]]:
+        """
+        TTL内上报过的玩家
+        :return: [(player_id, location, nearby_npcs)]
+        """
+        rows = self._connection().execute(
+            "SELECT player_id, location, nearby_npcs FROM presence WHERE last_seen >= ?", (get_clock().time() - ttl,)
+        ).fetchall()
+        return [(player_id, location, json.loads(nearby)) for player_id, location, nearby in rows]
+
+    def has_presence(self)->bool:
+        """是否收到过位置上报"""
+        return self._connection().execute("SELECT 1 FROM presence LIMIT 1").fetchone() is not None
+
+    # ==================== 租约 ====================
+
+    def acquire_lease(self, name:str, ttl:float)->bool:
+        """
+        获取或续期租约
+        :param name: 租约名称
+        :param ttl: 有效期(秒), 持有者超过此时间未续期时其他进程可以接管
+        :return: 本进程是否持有租约
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.worker_id and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, self.worker_id, now + ttl)
+            )
+        return True
+
+    def release_lease(self, name:str):
+        """释放本进程持有的租约(其他进程可立即接管)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+
+    def lease_owner(self, name:str)->Optional[str]:
+        """租约当前持有者(已过期时为None)"""
+        row = self._connection().execute(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    # ==================== 分片 ====================
+
+    def heartbeat_shard(self, url:str, ttl:float):
+        """
+        登记/续期本进程的分片
+        :param url: 本进程对外地址(其他进程转发请求用)
+        :param ttl: 有效期(秒), 超时未续期的分片视为下线
+        """
+        with self._transaction() as conn:
+            # 同一地址重启后旧进程的登记立即作废
+            conn.execute("DELETE FROM shards WHERE url = ? AND worker_id != ?", (url, self.worker_id))
+            conn.execute(
+                "INSERT OR REPLACE INTO shards (worker_id, url, expires_at) VALUES (?, ?, ?)",
+                (self.worker_id, url, time.time() + ttl)
+            )
+
+    def remove_shard(self):
+        """注销本进程的分片"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM shards WHERE worker_id = ?", (self.worker_id,))
+
+    def live_shards(self)->List[str]:
+        """在线分片的地址(已排序)"""
+        rows = self._connection().execute(
+            "SELECT DISTINCT url FROM shards WHERE expires_at > ? ORDER BY url", (time.time(),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+class _Transaction:
+    """写事务上下文: 正常结束时提交, 异常时回滚"""
+
+    __slots__ = ("conn",)
+
+    def __init__(self, conn:sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self)->sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+# 全局单例(未启用共享状态时为None)
+_shared_state = None
+
+def get_shared_state()->Optional[SharedStateStore]:
+    """获取共享状态存储, 未启用(SHARED_STATE_ENABLED=false)时返回None"""
+    global _shared_state
+    if _shared_state is None and settings.SHARED_STATE_ENABLED:
+        _shared_state = SharedStateStore(settings.SHARED_STATE_DB)
+    return _shared_state
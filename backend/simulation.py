@@ -0,0 +1,402 @@
+"""无头加速模拟 - 用虚拟时钟在几分钟内跑完游戏内的数天, 统计LLM调用、token、记忆增长和延迟
+
+不启动HTTP服务, 在进程内直接驱动NPC状态管理器和NPC Agent管理器:
+- 虚拟时钟(clock.VirtualClock)从 --start 开始, 每一步直接推进到下一个事件, 不等待真实时间
+- 环境对话按更新间隔(游戏内时间)批量更新, 只为附近有玩家的NPC生成
+- NPC之间的环境对话按播放间隔逐句播放, 有空闲的对话组时批量生成
+- 玩家按脚本走近NPC: 上报位置、预热、问候, 每隔一段时间说一句话, 说完离开
+- 问候语池按刷新间隔检查过期; 会话历史摘要在后台线程中照常执行
+- LLM默认使用进程内的模拟服务(mock_llm_server), 也可用 --llm-base-url 指向任意OpenAI兼容服务
+
+报告按游戏内每天统计: 各调用方的LLM调用次数和token、记忆条数和数据库大小、对话和批量更新的真实耗时,
+以及独白/对话两种环境台词的生成、播放、作废句数和每句已播放台词的token成本
+
+使用方法:
+  python simulation.py                                  # 3名玩家, 模拟7天
+  python simulation.py --days 1 --players 10 --sessions-per-day 8
+  python simulation.py --speed 100 --days 1             # 按100倍速推进(游戏内一天约14分钟)
+  python simulation.py --script data/sim_script.json    # 按脚本对话
+  python simulation.py --json report.json               # 同时保存JSON报告
+
+脚本文件格式(JSON数组, day从0开始):
+  [{"day": 0, "time": "09:30", "player_id": "p1", "npc_name": "张三", "messages": ["你好", "在忙什么?"]}]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+from load_test import percentile
+from mock_llm_server import MockLLMConfig, create_server
+
+# 未指定脚本时玩家随机说的话
+PLAYER_MESSAGES = [
+    "你好,最近在忙什么?",
+    "今天的项目进度怎么样?",
+    "能给我讲讲你负责的工作吗?",
+    "你的代码写得真好,向你学习!",
+    "中午一起吃饭吗?",
+    "这个bug你有什么思路吗?",
+    "周末有什么安排?",
+    "推荐一本你最近在看的书吧。"
+]
+
+
+def build_script(args, npc_names:List[str], day_start:datetime)->List[Dict]:
+    """
+    玩家会话脚本
+    :param day_start: 第0天零点
+    :return: [{"at", "player_id", "npc_name", "messages"}], 按开始时间排序
+    """
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        sessions = []
+        for entry in entries:
+            hour, minute = map(int, entry["time"].split(":"))
+            sessions.append({
+                "at": day_start + timedelta(days=entry["day"], hours=hour, minutes=minute),
+                "player_id": entry["player_id"],
+                "npc_name": entry["npc_name"],
+                "messages": entry["messages"]
+            })
+    else:
+        # 每名玩家每天在8点到20点之间随机走近NPC, 每次说1-3句话
+        rng = random.Random(args.seed)
+        sessions = [
+            {
+                "at": day_start + timedelta(days=day, seconds=rng.uniform(8 * 3600, 20 * 3600)),
+                "player_id": f"sim{player}",
+                "npc_name": rng.choice(npc_names),
+                "messages": rng.sample(PLAYER_MESSAGES, rng.randint(1, 3))
+            }
+            for day in range(args.days)
+            for player in range(args.players)
+            for _ in range(args.sessions_per_day)
+        ]
+    return sorted(sessions, key=lambda session: session["at"])
+
+
+class Simulation:
+    """
+    事件驱动的模拟
+
+    事件按游戏内时刻排序, 每处理一个事件前把虚拟时钟推进到该时刻;
+    --speed 大于0时在两个事件之间按倍速等待真实时间
+    """
+
+    def __init__(self, args, clock, npc_manager, state_manager, store):
+        self.args = args
+        self.clock = clock
+        self.npc_manager = npc_manager
+        self.state_manager = state_manager
+        self.store = store
+        self.start = clock.now()
+        self.end = self.start + timedelta(days=args.days)
+
+        self._events:List = []
+        self._sequence = itertools.count()
+        self._real_start = time.perf_counter()
+
+        # 当天的统计(每天零点结算一次)
+        self.days:List[Dict] = []
+        self._chat_latencies:List[float] = []
+        self._update_latencies:List[float] = []
+        self._updates = {"generated": 0, "skipped": 0}
+        self._chats = 0
+        self._baseline = self._counters()
+
+    def schedule(self, at:datetime, action:Callable[[], Awaitable[None]]):
+        heapq.heappush(self._events, (at, next(self._sequence), action))
+
+    def _counters(self)->Dict:
+        """当前累计值(LLM调用、token、记忆、公开的对话行数)"""
+        from metrics import AMBIENT_LINES, LLM_CALLS, LLM_TOKENS
+        return {
+            "calls": {caller: count for (caller,), count in LLM_CALLS.values().items()},
+            "tokens": {f"{caller}.{kind}": count for (caller, kind), count in LLM_TOKENS.values().items()},
+            "ambient": {f"{source}.{state}": count for (source, state), count in AMBIENT_LINES.values().items()},
+            "memories": self.store.count(),
+            "state_version": self.state_manager.version
+        }
+
+    def _db_bytes(self)->int:
+        """记忆数据库大小(含WAL)"""
+        path = Path(self.store.db_path)
+        return sum(p.stat().st_size for p in (path, Path(f"{path}-wal")) if p.exists())
+
+    # ==================== 事件 ====================
+
+    async def _ambient_update(self):
+        """环境对话批量更新(附近没有玩家时跳过, 不调用LLM)"""
+        before = self._counters()["calls"].get("batch", 0)
+        start = time.perf_counter()
+        await self.state_manager.force_update()
+        if self._counters()["calls"].get("batch", 0) > before:
+            self._update_latencies.append(time.perf_counter() - start)
+            self._updates["generated"] += 1
+        else:
+            self._updates["skipped"] += 1
+        self.schedule(self.clock.now() + timedelta(seconds=self.state_manager.update_interval), self._ambient_update)
+
+    async def _refresh_greetings(self):
+        """问候语池过期检查"""
+        from config import settings
+        await asyncio.to_thread(self.npc_manager.greetings.refresh)
+        self.schedule(self.clock.now() + timedelta(seconds=settings.GREETING_REFRESH_INTERVAL), self._refresh_greetings)
+
+    async def _conversation_turn(self):
+        """NPC环境对话播放一轮(有空闲的对话组时批量生成)"""
+        from config import settings
+        generating = await self.state_manager.conversations.tick()
+        if generating:
+            # 虚拟时钟不随真实时间推进: 等待生成完成后再安排下一轮
+            await generating
+        self.schedule(self.clock.now() + timedelta(seconds=settings.AMBIENT_CONVERSATION_TURN_INTERVAL), self._conversation_turn)
+
+    async def _close_day(self):
+        """结算当天的统计"""
+        counters = self._counters()
+        previous = self._baseline
+        chat_latencies, update_latencies = sorted(self._chat_latencies), sorted(self._update_latencies)
+        self.days.append({
+            "day": len(self.days) + 1,
+            "llm_calls": {k: v - previous["calls"].get(k, 0) for k, v in counters["calls"].items()},
+            "llm_tokens": {k: v - previous["tokens"].get(k, 0) for k, v in counters["tokens"].items()},
+            "memories": counters["memories"],
+            "memories_added": counters["memories"] - previous["memories"],
+            "db_bytes": self._db_bytes(),
+            "chats": self._chats,
+            "chat_p50_ms": round(percentile(chat_latencies, 0.5) * 1000, 1),
+            "chat_p95_ms": round(percentile(chat_latencies, 0.95) * 1000, 1),
+            "updates": dict(self._updates),
+            "update_p50_ms": round(percentile(update_latencies, 0.5) * 1000, 1),
+            "update_p95_ms": round(percentile(update_latencies, 0.95) * 1000, 1),
+            "ambient_lines": counters["state_version"] - previous["state_version"],
+            "ambient": {k: v - previous["ambient"].get(k, 0) for k, v in counters["ambient"].items()},
+            "real_seconds": round(time.perf_counter() - self._real_start, 1)
+        })
+        self._baseline = counters
+        self._chat_latencies, self._update_latencies = [], []
+        self._updates = {"generated": 0, "skipped": 0}
+        self._chats = 0
+
+        day = self.days[-1]
+        print(f"📅 第{day['day']}天: LLM调用{sum(day['llm_calls'].values())}次, 记忆{day['memories']}条, "
+              f"对话{day['chats']}轮, 已用{day['real_seconds']}秒", file=sys.__stdout__, flush=True)
+
+    def _session(self, session:Dict):
+        """玩家的一次会话: 走近(上报位置/预热/问候), 每隔 message_gap 说一句, 说完离开"""
+        npc_name, player_id = session["npc_name"], session["player_id"]
+        role = self.npc_manager.roster.get(npc_name)
+        gap = timedelta(seconds=self.args.message_gap)
+
+        async def arrive():
+            self.state_manager.report_presence(player_id, role["location"] if role else None, [npc_name])
+            await asyncio.to_thread(self.npc_manager.prewarm, npc_name, player_id)
+            await asyncio.to_thread(self.npc_manager.greet, npc_name, player_id)
+
+        def say(message:str):
+            async def action():
+                start = time.perf_counter()
+                await asyncio.to_thread(self.npc_manager.chat, npc_name, message, player_id)
+                self._chat_latencies.append(time.perf_counter() - start)
+                self._chats += 1
+            return action
+
+        async def leave():
+            self.state_manager.interest.leave(player_id)
+
+        self.schedule(session["at"], arrive)
+        for index, message in enumerate(session["messages"], start=1):
+            self.schedule(session["at"] + gap * index, say(message))
+        self.schedule(session["at"] + gap * (len(session["messages"]) + 1), leave)
+
+    # ==================== 主循环 ====================
+
+    async def _wait_until(self, at:datetime):
+        """推进虚拟时钟到事件时刻(--speed 大于0时先按倍速等待真实时间)"""
+        if self.args.speed > 0:
+            delay = (at - self.start).total_seconds() / self.args.speed - (time.perf_counter() - self._real_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.clock.advance_to(at)
+
+    async def run(self, sessions:List[Dict])->List[Dict]:
+        for session in sessions:
+            if session["at"] < self.end:
+                self._session(session)
+        self.schedule(self.start, self._ambient_update)
+        self.schedule(self.start, self._refresh_greetings)
+        if self.state_manager.conversations.enabled:
+            self.schedule(self.start, self._conversation_turn)
+        for day in range(1, self.args.days + 1):
+            self.schedule(self.start + timedelta(days=day), self._close_day)
+
+        while self._events and self._events[0][0] <= self.end:
+            at, _, action = heapq.heappop(self._events)
+            await self._wait_until(at)
+            await action()
+
+        # 等待后台的会话摘要完成(计入最后一天之后的总计)
+        while self.npc_manager.history.pending:
+            await asyncio.sleep(0.05)
+        return self.days
+
+
+def print_report(days:List[Dict], summary:Dict):
+    """打印模拟报告"""
+    print("\n" + "=" * 100)
+    print(f"📊 模拟结果: 游戏内{summary['days']}天, {summary['players']}名玩家, 真实耗时{summary['real_seconds']}秒 "
+          f"(相当于{summary['effective_speed']}倍速)")
+    print("=" * 100)
+    print(f"{'天':<4}{'LLM调用':>8}{'输入token':>11}{'输出token':>11}{'对话':>6}{'对话p50/p95(ms)':>18}"
+          f"{'批量生成/跳过':>14}{'批量p50/p95(ms)':>18}{'对话行':>8}{'记忆':>8}{'数据库(KB)':>12}")
+    for day in days:
+        prompt = sum(v for k, v in day["llm_tokens"].items() if k.endswith(".prompt"))
+        completion = sum(v for k, v in day["llm_tokens"].items() if k.endswith(".completion"))
+        print(f"{day['day']:<4}{sum(day['llm_calls'].values()):>8}{prompt:>11}{completion:>11}{day['chats']:>6}"
+              f"{str(day['chat_p50_ms']) + '/' + str(day['chat_p95_ms']):>18}"
+              f"{str(day['updates']['generated']) + '/' + str(day['updates']['skipped']):>14}"
+              f"{str(day['update_p50_ms']) + '/' + str(day['update_p95_ms']):>18}"
+              f"{day['ambient_lines']:>8}{day['memories']:>8}{day['db_bytes'] / 1024:>12.1f}")
+
+    print("\n🤖 LLM调用(按调用方):")
+    for caller, calls in sorted(summary["llm_calls"].items(), key=lambda item: -item[1]):
+        tokens = summary["llm_tokens"]
+        print(f"   {caller:<16}{calls:>8}次  输入{tokens.get(caller + '.prompt', 0):>10} token  "
+              f"输出{tokens.get(caller + '.completion', 0):>10} token")
+    from metrics import AMBIENT_CALLERS
+    print("\n🗣️  环境台词(生成/播放/作废, 每句已播放台词的token):")
+    for source, caller in AMBIENT_CALLERS.items():
+        lines = {state: summary["ambient"].get(f"{source}.{state}", 0) for state in ("generated", "shown", "expired")}
+        tokens = summary["llm_tokens"].get(caller + ".prompt", 0) + summary["llm_tokens"].get(caller + ".completion", 0)
+        cost = f"{tokens / lines['shown']:.1f}" if lines["shown"] else "-"
+        print(f"   {source:<16}{lines['generated']:>8}/{lines['shown']}/{lines['expired']}句  {cost:>8} token/句")
+    print(f"💾 记忆增长: {summary['memories']}条, 平均每天{summary['memories'] / max(summary['days'], 1):.0f}条")
+    if summary.get("mock_llm"):
+        print(f"🧪 模拟LLM: {summary['mock_llm']['requests']}次请求")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无头加速模拟(虚拟时钟)")
+    parser.add_argument("--days", type=int, default=7, help="模拟的游戏内天数")
+    parser.add_argument("--start", default=None, help="游戏内起始时刻(ISO格式), 默认今天07:00")
+    parser.add_argument("--speed", type=float, default=0, help="时间倍速, 0表示不等待真实时间(尽快完成)")
+    parser.add_argument("--players", type=int, default=3, help="随机脚本: 玩家数")
+    parser.add_argument("--sessions-per-day", type=int, default=6, help="随机脚本: 每名玩家每天的会话数")
+    parser.add_argument("--message-gap", type=float, default=40, help="玩家两句话之间的游戏内间隔(秒)")
+    parser.add_argument("--script", default=None, help="会话脚本文件(JSON), 指定时不随机生成")
+    parser.add_argument("--seed", type=int, default=0, help="随机脚本的种子")
+    parser.add_argument("--update-interval", type=int, default=None, help="环境对话更新间隔(游戏内秒), 默认 NPC_UPDATE_INTERVAL")
+    parser.add_argument("--llm-base-url", default=None, help="使用指定的OpenAI兼容服务(默认进程内模拟服务)")
+    parser.add_argument("--mock-latency", default="fixed:5", help="模拟LLM延迟分布")
+    parser.add_argument("--data-dir", default=None, help="记忆数据库和日志目录(默认临时目录, 结束后删除)")
+    parser.add_argument("--verbose", action="store_true", help="输出各模块的运行日志")
+    parser.add_argument("--json", default=None, help="保存JSON报告")
+    args = parser.parse_args()
+
+    # 模拟LLM服务(需在创建LLM客户端之前启动)
+    server, mock_config = None, None
+    if args.llm_base_url is None:
+        mock_config = MockLLMConfig(args.mock_latency, token_ms=0)
+        server = create_server("127.0.0.1", 0, mock_config)
+        threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+        os.environ.update({
+            "LLM_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+            "LLM_API_KEY": "mock",
+            "LLM_MODEL_ID": "mock-model"
+        })
+        print(f"🧪 模拟LLM服务: {os.environ['LLM_BASE_URL']} (延迟: {args.mock_latency})")
+    else:
+        os.environ["LLM_BASE_URL"] = args.llm_base_url
+
+    # 配置在导入各模块时读取: 记忆数据库和日志都写到数据目录, 不写世界快照、追踪和好感度判定记录
+    data_dir = Path(args.data_dir or tempfile.mkdtemp(prefix="aitown_sim_"))
+    os.environ.update({
+        "MEMORY_DB_FILE": str(data_dir / "memories.db"),
+        "LOGS_DIR": str(data_dir / "logs"),
+        "WORLD_SNAPSHOT_ENABLED": "false",
+        "TRACE_ENABLED": "false",
+        "AFFINITY_VERDICT_RECORDING": "false",
+        "LOG_CONSOLE": "false"
+    })
+
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now().replace(hour=7, minute=0, second=0, microsecond=0)
+
+    from clock import VirtualClock, set_clock
+    clock = VirtualClock(start, speed=0)
+    set_clock(clock)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8"))
+    real_start = time.perf_counter()
+    try:
+        with quiet:
+            from agents import get_npc_manager
+            from config import settings
+            from logger import stop_log_writer
+            from memory_store import get_memory_store
+            from state_manager import get_state_manager
+
+            npc_manager = get_npc_manager()
+            state_manager = get_state_manager(args.update_interval or settings.NPC_UPDATE_INTERVAL)
+            sessions = build_script(args, npc_manager.roster.names(), start.replace(hour=0, minute=0))
+            print(f"🏙️  模拟{args.days}天 (从 {start.isoformat(timespec='minutes')} 开始), "
+                  f"{len(sessions)}次玩家会话", file=sys.__stdout__, flush=True)
+
+            simulation = Simulation(args, clock, npc_manager, state_manager, get_memory_store())
+            days = asyncio.run(simulation.run(sessions))
+            npc_manager.history.stop()
+            stop_log_writer()
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    real_seconds = time.perf_counter() - real_start
+    totals = {"calls": {}, "tokens": {}, "ambient": {}}
+    for day in days:
+        for key, value in day["ambient"].items():
+            totals["ambient"][key] = totals["ambient"].get(key, 0) + value
+        for key, value in day["llm_calls"].items():
+            totals["calls"][key] = totals["calls"].get(key, 0) + value
+        for key, value in day["llm_tokens"].items():
+            totals["tokens"][key] = totals["tokens"].get(key, 0) + value
+    summary = {
+        "days": args.days,
+        "players": len({session["player_id"] for session in sessions}),
+        "sessions": len(sessions),
+        "real_seconds": round(real_seconds, 1),
+        "effective_speed": round(args.days * 86400 / real_seconds),
+        "llm_calls": totals["calls"],
+        "llm_tokens": totals["tokens"],
+        "ambient": totals["ambient"],
+        "memories": days[-1]["memories"] if days else 0,
+        "mock_llm": mock_config.stats() if mock_config else None
+    }
+    print_report(days, summary)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "days": days}, f, ensure_ascii=False, indent=2)
+        print(f"📄 JSON报告已保存: {args.json}")
+
+    if args.data_dir is None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""世界状态快照 - 定时及关闭服务时把世界状态写入紧凑的二进制文件, 重启时直接恢复
+
+快照内容: 好感度表、当前NPC对话快照(含版本号)、各NPC Agent的会话历史及更早对话的摘要、问候语池;
+记忆已持久化在记忆数据库(memory_store)中, 写快照时执行WAL检查点, 重启时无需回放日志
+
+文件格式(各段按8字节对齐, 数值为写入机器的字节序):
+  头部: 魔数 + 格式版本 + 目录长度 + JSON目录(各段的偏移/类型码/长度, 以及标量元数据和会话摘要)
+  字符串表: 所有字符串(去重)拼接后的UTF-8编码 + 字符偏移数组(uint32)
+  数值段: uint32(字符串编号) / float64(好感度、时间戳) 数组
+加载时内存映射文件, 数值段直接 memoryview.cast 为数组, 字符串表整体解码一次后按偏移切分, 不逐条解析
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from hello_agents.core.message import Message
+
+from config import settings
+from memory_store import get_memory_store
+
+MAGIC = b"AITWSNAP"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sII")  # 魔数, 格式版本, 目录长度
+
+
+def _align(offset:int)->int:
+    """向上对齐到8字节"""
+    return (offset + 7) & ~7
+
+
+class SnapshotWriter:
+    """快照写入: 字符串去重后写入字符串表, 数值按列累积为数组"""
+
+    def __init__(self):
+        self._strings:Dict[str, int] = {}
+        self._columns:Dict[str, array] = {}
+
+    def intern(self, text:str)->int:
+        """字符串编号(相同字符串只存一份, 如NPC名称、玩家ID)"""
+        index = self._strings.get(text)
+        if index is None:
+            index = self._strings[text] = len(self._strings)
+        return index
+
+    def column(self, name:str, typecode:str)->array:
+        """数值列(I=字符串编号, d=浮点数)"""
+        if name not in self._columns:
+            self._columns[name] = array(typecode)
+        return self._columns[name]
+
+    def write(self, path:Path, meta:Dict)->int:
+        """
+        写入快照文件(先写临时文件再替换, 写入中途退出不会损坏旧快照)
+        :return: 文件大小(字节)
+        """
+        offsets = array("I", [0])
+        for text in self._strings:
+            offsets.append(offsets[-1] + len(text))
+
+        sections = [("strings.offsets", "I", offsets.tobytes()), ("strings.data", "B", "".join(self._strings).encode("utf-8"))]
+        sections += [(name, column.typecode, column.tobytes()) for name, column in self._columns.items()]
+
+        directory = {"meta": dict(meta, byteorder=sys.byteorder), "sections": {}}
+        offset = 0
+        for name, typecode, data in sections:
+            directory["sections"][name] = [offset, typecode, len(data)]
+            offset = _align(offset + len(data))
+        directory_bytes = json.dumps(directory, ensure_ascii=False).encode("utf-8")
+        base = _align(_HEADER.size + len(directory_bytes))
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(directory_bytes)))
+            f.write(directory_bytes)
+            for name, _, data in sections:
+                f.seek(base + directory["sections"][name][0])
+                f.write(data)
+            size = base + offset
+            f.truncate(size)
+        os.replace(temp_path, path)
+        return size
+
+
+class SnapshotReader:
+    """快照读取: 内存映射文件, 数值段零拷贝转为数组(用作上下文管理器, 退出时释放映射)"""
+
+    def __init__(self, path:Path):
+        """
+        :raises ValueError: 文件格式或字节序不匹配
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views:List[memoryview] = []
+        try:
+            magic, version, directory_length = _HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"不支持的快照格式 (版本 {version})")
+            directory = json.loads(self._mmap[_HEADER.size:_HEADER.size + directory_length])
+            if directory["meta"].get("byteorder") != sys.byteorder:
+                raise ValueError("快照字节序与本机不一致")
+        except Exception:
+            self._mmap.close()
+            raise
+
+        self.meta:Dict = directory["meta"]
+        self._sections:Dict[str, List] = directory["sections"]
+        self._base = _align(_HEADER.size + directory_length)
+        self._buffer = self._view(memoryview(self._mmap))
+
+        # 字符串表: 整体解码一次, 按字符偏移切分
+        text = str(self.array("strings.data"), "utf-8")
+        offsets = self.array("strings.offsets").tolist()
+        self.strings:List[str] = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def _view(self, view:memoryview)->memoryview:
+        self._views.append(view)
+        return view
+
+    def array(self, name:str)->memoryview:
+        """数值段(零拷贝视图, 不存在时为空; 逐个访问时先 tolist())"""
+        if name not in self._sections:
+            return memoryview(b"")
+        offset, typecode, length = self._sections[name]
+        start = self._base + offset
+        return self._view(self._view(self._buffer[start:start + length]).cast(typecode))
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class WorldSnapshotManager:
+    """
+    世界状态快照管理
+
+    功能:
+    1. 启动时从快照恢复好感度、当前对话和Agent会话历史
+    2. 定时写入快照, 关闭服务时写入最后一次
+    3. 多进程共享状态模式下好感度和对话已持久化在共享数据库, 不写快照
+    """
+
+    def __init__(self, npc_manager, state_manager, path:Optional[str] = None):
+        """
+        :param npc_manager: NPC Agent管理器(会话历史、好感度)
+        :param state_manager: NPC状态管理器(当前对话快照)
+        :param path: 快照文件, 默认 WORLD_SNAPSHOT_FILE
+        """
+        self.npc_manager = npc_manager
+        self.state_manager = state_manager
+        self.path = Path(path or settings.WORLD_SNAPSHOT_FILE)
+        self.enabled = settings.WORLD_SNAPSHOT_ENABLED and state_manager.shared_state is None
+        self._task:Optional[asyncio.Task] = None
+
+        if settings.WORLD_SNAPSHOT_ENABLED and not self.enabled:
+            print("⚠️  共享状态模式下好感度和对话已持久化在共享数据库, 不写世界快照")
+
+    def save(self)->Dict:
+        """
+        写入快照
+        :return: 统计(文件大小、各部分条数、耗时)
+        """
+        start = time.perf_counter()
+        writer = SnapshotWriter()
+
+        # 好感度 {npc_name: {player_id: affinity}}: 按NPC分组连续存放, 加载时每个NPC一次 dict(zip())
+        relationship = self.npc_manager.relationship_manager
+        npc_column, count_column = writer.column("affinity.npc", "I"), writer.column("affinity.count", "I")
+        player_column, score_column = writer.column("affinity.player", "I"), writer.column("affinity.score", "d")
+        if relationship:
+            for npc_name, scores in list(relationship.affinity_scores.items()):
+                scores = dict(scores)
+                npc_column.append(writer.intern(npc_name))
+                count_column.append(len(scores))
+                player_column.extend(map(writer.intern, scores))
+                score_column.extend(scores.values())
+
+        # 当前对话快照
+        dialogues, version, last_update = self.state_manager.export_state()
+        name_column, text_column = writer.column("dialogues.npc", "I"), writer.column("dialogues.text", "I")
+        for npc_name, dialogue in dialogues.items():
+            name_column.append(writer.intern(npc_name))
+            text_column.append(writer.intern(dialogue))
+
+        # Agent会话历史
+        messages = 0
+        history_npc, history_role = writer.column("history.npc", "I"), writer.column("history.role", "I")
+        history_content, history_time = writer.column("history.content", "I"), writer.column("history.time", "d")
+        for npc_name, history in self.npc_manager.export_histories().items():
+            for message in history:
+                history_npc.append(writer.intern(npc_name))
+                history_role.append(writer.intern(message.role))
+                history_content.append(writer.intern(message.content))
+                history_time.append(message.timestamp.timestamp())
+                messages += 1
+
+        size = writer.write(self.path, {
+            "created_at": datetime.now().isoformat(),
+            "state_version": version,
+            "last_update": last_update.isoformat() if last_update else None,
+            "summaries": dict(self.npc_manager.history.summaries),
+            "greetings": self.npc_manager.greetings.export()
+        })
+
+        # 记忆数据库: 把WAL合并回主文件, 重启时无需回放
+        get_memory_store().checkpoint()
+
+        return {
+            "bytes": size,
+            "affinities": len(score_column),
+            "dialogues": len(dialogues),
+            "messages": messages,
+            "ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    def restore(self)->Optional[Dict]:
+        """
+        从快照恢复世界状态(在状态管理器启动前调用)
+        :return: 统计, 没有可用快照时返回None
+        """
+        if not self.enabled or not self.path.exists():
+            return None
+
+        start = time.perf_counter()
+        try:
+            with SnapshotReader(self.path) as reader:
+                strings, column = reader.strings, lambda name: reader.array(name).tolist()
+
+                affinities:Dict[str, Dict[str, float]] = {}
+                players, scores = column("affinity.player"), column("affinity.score")
+                offset = 0
+                for npc_index, count in zip(column("affinity.npc"), column("affinity.count")):
+                    affinities[strings[npc_index]] = dict(zip(
+                        map(strings.__getitem__, players[offset:offset + count]), scores[offset:offset + count]
+                    ))
+                    offset += count
+
+                dialogues = {
+                    strings[npc_index]: strings[text_index]
+                    for npc_index, text_index in zip(column("dialogues.npc"), column("dialogues.text"))
+                }
+
+                histories:Dict[str, List[Message]] = {}
+                for npc_index, role_index, content_index, timestamp in zip(
+                        column("history.npc"), column("history.role"), column("history.content"), column("history.time")
+                ):
+                    histories.setdefault(strings[npc_index], []).append(Message(
+                        strings[content_index], strings[role_index], timestamp=datetime.fromtimestamp(timestamp)
+                    ))
+
+                meta = reader.meta
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  世界快照无法读取, 冷启动: {e}")
+            return None
+
+        relationship = self.npc_manager.relationship_manager
+        if relationship:
+            relationship.affinity_scores = affinities
+        last_update = datetime.fromisoformat(meta["last_update"]) if meta.get("last_update") else None
+        self.state_manager.restore_state(dialogues, meta["state_version"], last_update)
+        self.npc_manager.history.restore_summaries(meta.get("summaries", {}))
+        self.npc_manager.greetings.restore(meta.get("greetings", {}))
+        messages = self.npc_manager.restore_histories(histories)
+
+        stats = {
+            "affinities": len(scores),
+            "dialogues": len(dialogues),
+            "messages": messages,
+            "created_at": meta["created_at"],
+            "ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+        print(f"♻️  已从世界快照恢复 ({stats['created_at']}): 好感度{stats['affinities']}条, "
+              f"对话{stats['dialogues']}条, 会话历史{messages}条, 耗时{stats['ms']}ms")
+        return stats
+
+    def start(self):
+        """启动定时快照"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        """停止定时快照并写入最后一次快照"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self.enabled:
+            try:
+                stats = self.save()
+                print(f"💾 世界快照已保存: {stats['bytes']}字节, 耗时{stats['ms']}ms")
+            except Exception as e:
+                print(f"❌ 保存世界快照失败: {e}")
+
+    async def _snapshot_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.WORLD_SNAPSHOT_INTERVAL)
+                await asyncio.to_thread(self.save)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"❌ 保存世界快照失败: {e}")
@@ -0,0 +1,249 @@
+"""世界快照冷启动/热启动基准测试
+
+1. 端到端: 启动模拟LLM服务和后端进程, 对比没有快照(冷启动, 首轮批量生成对话)和
+   有快照(热启动, 恢复对话/好感度/会话历史)时从启动进程到 /health 可用的耗时,
+   并检查热启动后对话快照和好感度与关闭前一致
+2. 快照读写: 按指定规模构造世界状态, 测量二进制快照的写入/加载耗时和文件大小(以JSON作对照)
+
+使用方法:
+  python snapshot_benchmark.py                              # 默认规模
+  python snapshot_benchmark.py --players 5000 --messages 200
+  python snapshot_benchmark.py --mock-latency fixed:8000    # 模拟更慢的LLM
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict
+
+import httpx
+
+from load_test import _free_port
+from mock_llm_server import MockLLMConfig, create_server
+
+BACKEND_DIR = Path(__file__).parent
+
+
+# ==================== 端到端冷/热启动 ====================
+
+def launch_backend(env:Dict[str, str], port:int, timeout:float = 120)->(subprocess.Popen, float):
+    """
+    启动后端进程并等待 /health 可用
+    :return: (进程, 启动耗时秒)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/health"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"后端进程启动失败(退出码 {process.returncode})")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return process, time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    process.terminate()
+    raise RuntimeError("等待后端启动超时")
+
+
+def stop_backend(process:subprocess.Popen):
+    """正常关闭(SIGTERM, 关闭时写入世界快照)"""
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def world_state(client:httpx.Client, players:int)->Dict:
+    """读取对话快照和各玩家的好感度(用于比较重启前后是否一致)"""
+    status = client.get("/npcs/status").json()
+    affinities = {f"p{i}": client.get("/affinities", params={"player_id": f"p{i}"}).json() for i in range(players)}
+    return {"dialogues": status["dialogues"], "version": status["version"], "affinities": affinities}
+
+
+def run_restart_benchmark(args)->Dict:
+    """端到端冷启动/热启动对比"""
+    config = MockLLMConfig(args.mock_latency, args.mock_token_ms)
+    server = create_server("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+
+    data_dir = Path(tempfile.mkdtemp(prefix="aitown_snapshot_"))
+    env = dict(os.environ)
+    env.update({
+        "LLM_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "LLM_API_KEY": "mock",
+        "LLM_MODEL_ID": "mock-model",
+        "LOG_CONSOLE": "false",
+        "TRACE_ENABLED": "false",
+        "MEMORY_DB_FILE": str(data_dir / "memories.db"),
+        "WORLD_SNAPSHOT_FILE": str(data_dir / "world_snapshot.bin")
+    })
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        print(f"🧊 冷启动(无快照, 模拟LLM延迟 {args.mock_latency})...")
+        process, cold_seconds = launch_backend(env, port)
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            npc_names = [npc["name"] for npc in client.get("/npcs").json()["npcs"]]
+            for i in range(args.e2e_players):
+                for npc_name in npc_names:
+                    client.put(f"/npcs/{npc_name}/affinity", params={"affinity": random.randint(0, 100), "player_id": f"p{i}"})
+            for npc_name in npc_names[:args.e2e_chats]:
+                client.post("/chat", json={"npc_name": npc_name, "message": "你好,最近在忙什么?"})
+            before = world_state(client, args.e2e_players)
+        stop_backend(process)
+        snapshot_bytes = (data_dir / "world_snapshot.bin").stat().st_size
+        cold_requests = config.stats()["requests"]
+
+        print("🔥 热启动(从快照恢复)...")
+        process, warm_seconds = launch_backend(env, port)
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            after = world_state(client, args.e2e_players)
+        stop_backend(process)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "cold_start_ms": round(cold_seconds * 1000, 1),
+        "warm_start_ms": round(warm_seconds * 1000, 1),
+        "speedup": round(cold_seconds / warm_seconds, 2),
+        "snapshot_bytes": snapshot_bytes,
+        "state_preserved": before == after,
+        "cold_llm_requests": cold_requests,
+        "warm_llm_requests": config.stats()["requests"] - cold_requests
+    }
+
+
+# ==================== 快照读写 ====================
+
+def run_snapshot_io_benchmark(args)->Dict:
+    """按指定规模构造世界状态, 测量快照写入/加载"""
+    data_dir = Path(tempfile.mkdtemp(prefix="aitown_snapshot_io_"))
+    os.environ.setdefault("LOG_CONSOLE", "false")
+    os.environ["MEMORY_DB_FILE"] = str(data_dir / "memories.db")
+
+    from hello_agents.core.message import Message
+    from roster import get_roster
+    from snapshot import WorldSnapshotManager
+
+    random.seed(0)
+    npc_names = get_roster().names()
+    affinity_scores = {
+        npc_name: {f"player{i}": float(random.randint(0, 100)) for i in range(args.players)}
+        for npc_name in npc_names
+    }
+    histories = {
+        npc_name: [
+            Message(f"玩家: 第{i}次聊天,今天的项目进度怎么样?" if i % 2 == 0 else f"第{i}次回复,进度还不错,正在调试。",
+                    "user" if i % 2 == 0 else "assistant")
+            for i in range(args.messages)
+        ]
+        for npc_name in npc_names
+    }
+    dialogues = {npc_name: f"{npc_name}正在工作,今天的进度还不错。" for npc_name in npc_names}
+
+    restored = {}
+    npc_manager = SimpleNamespace(
+        relationship_manager=SimpleNamespace(affinity_scores=affinity_scores),
+        history=SimpleNamespace(summaries={}, restore_summaries=lambda summaries: None),
+        greetings=SimpleNamespace(export=lambda: {}, restore=lambda pool: None),
+        export_histories=lambda: histories,
+        restore_histories=lambda loaded: restored.update(histories=loaded) or sum(map(len, loaded.values()))
+    )
+    state_manager = SimpleNamespace(
+        shared_state=None,
+        export_state=lambda: (dialogues, 1, datetime.now()),
+        restore_state=lambda loaded, version, last_update: restored.update(dialogues=loaded)
+    )
+
+    manager = WorldSnapshotManager(npc_manager, state_manager, str(data_dir / "world_snapshot.bin"))
+    save_stats = manager.save()
+    npc_manager.relationship_manager.affinity_scores = {}
+    load_stats = manager.restore()
+
+    # JSON对照(同样的数据)
+    json_path = data_dir / "world_snapshot.json"
+    payload = {
+        "affinity": affinity_scores,
+        "dialogues": dialogues,
+        "histories": {
+            name: [[m.role, m.content, m.timestamp.timestamp()] for m in history] for name, history in histories.items()
+        }
+    }
+    start = time.perf_counter()
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    json_save_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    with open(json_path, "r", encoding="utf-8") as f:
+        loaded = json.load(f)
+    {name: [Message(content, role, timestamp=datetime.fromtimestamp(ts)) for role, content, ts in history]
+     for name, history in loaded["histories"].items()}
+    json_load_ms = (time.perf_counter() - start) * 1000
+    json_bytes = json_path.stat().st_size
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "affinities": save_stats["affinities"],
+        "messages": save_stats["messages"],
+        "snapshot_bytes": save_stats["bytes"],
+        "save_ms": save_stats["ms"],
+        "load_ms": load_stats["ms"],
+        "json_bytes": json_bytes,
+        "json_save_ms": round(json_save_ms, 2),
+        "json_load_ms": round(json_load_ms, 2),
+        "restored_ok": npc_manager.relationship_manager.affinity_scores == affinity_scores
+                       and restored["dialogues"] == dialogues
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="世界快照冷启动/热启动基准测试")
+    parser.add_argument("--players", type=int, default=1000, help="快照读写: 每个NPC的玩家好感度条数")
+    parser.add_argument("--messages", type=int, default=100, help="快照读写: 每个NPC的会话历史条数")
+    parser.add_argument("--e2e-players", type=int, default=3, help="端到端: 设置好感度的玩家数")
+    parser.add_argument("--e2e-chats", type=int, default=2, help="端到端: 关闭前对话的NPC数")
+    parser.add_argument("--mock-latency", default="fixed:3000", help="模拟LLM延迟分布(默认接近真实批量生成耗时)")
+    parser.add_argument("--mock-token-ms", type=float, default=10, help="模拟LLM流式分块间隔(毫秒)")
+    parser.add_argument("--skip-e2e", action="store_true", help="只测快照读写")
+    args = parser.parse_args()
+
+    io = run_snapshot_io_benchmark(args)
+    print(f"\n📦 快照读写 ({io['affinities']}条好感度, {io['messages']}条会话历史)")
+    print(f"{'格式':<10}{'大小(KB)':>12}{'写入(ms)':>12}{'加载(ms)':>12}")
+    print(f"{'二进制':<10}{io['snapshot_bytes'] / 1024:>12.1f}{io['save_ms']:>12.2f}{io['load_ms']:>12.2f}")
+    print(f"{'JSON':<10}{io['json_bytes'] / 1024:>12.1f}{io['json_save_ms']:>12.2f}{io['json_load_ms']:>12.2f}")
+    print(f"恢复结果一致: {'✅' if io['restored_ok'] else '❌'}")
+
+    if args.skip_e2e:
+        return
+
+    e2e = run_restart_benchmark(args)
+    print(f"\n🚀 启动耗时(启动进程到 /health 可用)")
+    print(f"   冷启动: {e2e['cold_start_ms']:.0f}ms")
+    print(f"   热启动: {e2e['warm_start_ms']:.0f}ms ({e2e['speedup']}x, 快照 {e2e['snapshot_bytes']}字节)")
+    print(f"   重启前后对话快照与好感度一致: {'✅' if e2e['state_preserved'] else '❌'}")
+    print(f"   LLM请求数: 冷启动阶段{e2e['cold_llm_requests']}次(含首轮批量生成和对话), 热启动阶段{e2e['warm_llm_requests']}次")
+
+
+if __name__ == "__main__":
+    main()
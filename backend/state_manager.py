@@ -1,9 +1,25 @@
 """NPC状态管理器 - 定时批量更新NPC对话"""
 
 import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
+from ambient_conversations import AmbientConversationEngine
 from batch_generator import get_batch_generator
+from clock import get_clock
+from config import settings
+from interest_manager import InterestManager
+from metrics import AMBIENT_LINES
+from shared_state import get_shared_state
+from tracing import start_trace
+from roster import get_roster
+
+# 批量生成leader租约名称
+LEADER_LEASE = "npc_state_leader"
 
 class NPCStateManager:
     """
@@ -13,6 +29,9 @@ class NPCStateManager:
     1. 定时批量生成NPC对话(降低API成本)
     2. 缓存当前NPC状态
     3. 提供状态查询接口
+    4. 只为活跃玩家附近的NPC生成对话, 远处NPC保留上一句
+    5. 多进程部署时只有持有租约的leader生成对话, 其余进程从共享存储同步同一份快照
+    6. 同一地点的NPC之间的多轮对话逐句播放, 对话中的NPC不生成独白
     """
 
     def __init__(self, update_interval:int = 30):
@@ -23,16 +42,42 @@ class NPCStateManager:
 
         self.update_interval = update_interval
         self.batch_generator = get_batch_generator()
+        self.clock = get_clock()  # 游戏内时间(更新间隔按游戏时间计)
 
         # 当前状态
         self.current_dialogues:Dict[str, str] = {}
         self.last_update:Optional[datetime] = None
         self.next_update_time:Optional[datetime] = None
+        self._publish_lock = threading.Lock()  # 分片并行生成时多个线程同时发布
+
+        # 状态版本: 每条对话变化版本号+1, 以启动时间(毫秒)为起点, 重启后客户端的旧版本会触发全量同步
+        self.version = int(time.time() * 1000)
+        # 变化日志: (版本号, NPC名称), 用于按版本返回增量
+        self._changelog = deque(maxlen=settings.STATUS_CHANGELOG_SIZE)
 
         # 后台任务
         self._update_task:Optional[asyncio.Task] = None
         self._running = False
 
+        # 多进程共享状态(未启用时为None, 本进程始终生成对话)
+        self.shared_state = get_shared_state()
+        self.is_leader = self.shared_state is None
+        self._coordination_task:Optional[asyncio.Task] = None
+        self._synced_version:Optional[int] = None  # 已从共享存储同步到的版本
+
+        # 兴趣区域管理(玩家上报位置)
+        self.roster = get_roster()
+        self.interest = InterestManager(ttl=settings.PLAYER_PRESENCE_TTL)
+        self.last_active_npcs:List[str] = []
+
+        # NPC被移出名册时同步移除其对话
+        self.roster.subscribe(self._on_roster_changed)
+
+        # NPC之间的环境对话(批量生成, 逐句发布到对话快照)
+        self.conversations = AmbientConversationEngine(
+            self.batch_generator, self._publish_conversation_lines, self._select_active_npcs
+        )
+
         print(f"📊 NPC状态管理器初始化完成 (更新间隔: {update_interval}秒)")
 
     async def start(self):
@@ -42,13 +87,25 @@ class NPCStateManager:
             return
 
         self._running = True
+
+        if self.shared_state:
+            # 多进程: 竞选leader, 未当选时只同步快照
+            print(f"🤝 共享状态模式 (worker: {self.shared_state.worker_id})")
+            await self._coordinate()
+            self._coordination_task = asyncio.create_task(self._coordination_loop())
+            return
+
         print("🚀 启动NPC状态自动更新...")
 
-        # 立即执行一次更新
-        await self._update_npc_state()
+        # 立即执行一次更新(从世界快照恢复的对话未过期时沿用, 不调用LLM)
+        if self.last_update and (self.clock.now() - self.last_update).total_seconds() < self.update_interval:
+            print("♻️  沿用快照中的NPC对话")
+        else:
+            await self._update_npc_state()
 
         # 启动定时更新任务
         self._update_task = asyncio.create_task(self._auto_update_loop())
+        self.conversations.start()
 
     async def stop(self):
         """停止后台更新任务"""
@@ -56,13 +113,20 @@ class NPCStateManager:
             return
 
         self._running = False
+        await self.conversations.stop()
 
-        if self._update_task:
-            self._update_task.cancel()
-            try:
-                await self._update_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self._coordination_task, self._update_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        if self.shared_state and self.is_leader:
+            # 主动释放租约, 其他worker无需等待租约过期即可接管
+            self.shared_state.release_lease(LEADER_LEASE)
+            self.is_leader = False
 
         print("🛑 NPC状态自动更新已停止")
 
@@ -70,7 +134,7 @@ class NPCStateManager:
         """自动更新循环"""
         while self._running:
             try:
-                await asyncio.sleep(self.update_interval)
+                await self.clock.sleep(self.update_interval)
                 await self._update_npc_state()
             except asyncio.CancelledError:
                 break
@@ -78,18 +142,152 @@ class NPCStateManager:
                 print(f"❌ 自动更新失败: {e}")
                 # 继续运行,不中断
 
+    async def _coordination_loop(self):
+        """共享状态模式的协调循环: 续期/竞选租约, 同步快照, 处理刷新请求"""
+        while self._running:
+            try:
+                await asyncio.sleep(settings.SHARED_STATE_POLL_INTERVAL)
+                await self._coordinate()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"❌ 共享状态同步失败: {e}")
+
+    async def _coordinate(self):
+        """一次协调: leader续期并响应刷新请求, 其余进程同步leader发布的快照"""
+        store = self.shared_state
+        is_leader = store.acquire_lease(LEADER_LEASE, settings.SHARED_STATE_LEASE_TTL)
+
+        if is_leader and not self.is_leader:
+            # 当选: 先接上共享存储中的快照和版本, 客户端的增量同步不会中断
+            self._sync_from_shared()
+            self.is_leader = True
+            print(f"👑 当选批量生成leader (worker: {store.worker_id})")
+
+            # 快照已过期时立即更新(后台执行, 生成期间协调循环继续续期租约)
+            last_update = store.get_meta("last_update")
+            elapsed = (self.clock.now() - datetime.fromisoformat(last_update)).total_seconds() if last_update else None
+            if elapsed is None or elapsed >= self.update_interval:
+                asyncio.create_task(self._update_npc_state())
+            self._update_task = asyncio.create_task(self._auto_update_loop())
+            self.conversations.start()
+
+        elif not is_leader and self.is_leader:
+            # 租约被接管(例如本进程卡住超过租约有效期), 停止生成
+            print("⚠️  失去批量生成leader租约, 停止生成")
+            self.is_leader = False
+            if self._update_task:
+                self._update_task.cancel()
+                self._update_task = None
+            asyncio.create_task(self.conversations.stop())
+
+        if self.is_leader:
+            if store.get_meta("refresh_requested"):
+                # 其他worker收到的强制刷新请求
+                store.delete_meta("refresh_requested")
+                asyncio.create_task(self._update_npc_state())
+        else:
+            self._sync_from_shared()
+
+    def _sync_from_shared(self):
+        """从共享存储同步对话快照(沿用leader的版本号, 客户端切换worker时增量同步仍然有效)"""
+        store = self.shared_state
+        version = store.state_version()
+        if version is None or version == self._synced_version:
+            return
+
+        with self._publish_lock:
+            if self._synced_version is None or version < self._synced_version:
+                # 首次同步或共享存储被重置: 全量加载
+                self.current_dialogues = {
+                    name: dialogue for name, dialogue, _ in store.read_dialogues() if dialogue is not None
+                }
+                self._changelog.clear()
+            else:
+                dialogues = dict(self.current_dialogues)
+                for name, dialogue, change_version in store.read_dialogues(since=self._synced_version):
+                    if dialogue is None:
+                        dialogues.pop(name, None)
+                    else:
+                        dialogues[name] = dialogue
+                    self._changelog.append((change_version, name))
+                self.current_dialogues = dialogues
+            self.version = version
+            self._synced_version = version
+
+        last_update = store.get_meta("last_update")
+        if last_update:
+            self.last_update = datetime.fromisoformat(last_update)
+
+    def _select_active_npcs(self)->Optional[List[str]]:
+        """
+        选择本轮需要生成对话的NPC
+        :return: NPC名称列表, None表示全部生成(未启用兴趣管理或客户端从未上报位置)
+        """
+        if not settings.INTEREST_MANAGEMENT_ENABLED:
+            return None
+        if self.shared_state:
+            # 玩家的位置上报分散在各个worker, 按共享存储中的全部上报计算
+            if not self.shared_state.has_presence():
+                return None
+            return self._shared_interest().active_npcs(self.roster)
+        if not self.interest.has_reports:
+            return None
+        return self.interest.active_npcs(self.roster)
+
+    def _shared_interest(self)->InterestManager:
+        """由共享存储中TTL内的位置上报构建兴趣区域"""
+        interest = InterestManager(ttl=settings.PLAYER_PRESENCE_TTL)
+        for player_id, location, nearby_npcs in self.shared_state.active_presence(settings.PLAYER_PRESENCE_TTL):
+            interest.report(player_id, location, nearby_npcs)
+        return interest
+
     async def _update_npc_state(self):
         """更新NPC状态"""
-        try:
-            print(f"\n🔄 [{datetime.now().strftime('%H:%M:%S')}] 开始批量更新NPC对话...")
+        with start_trace("npc_state.update") as trace_span:
+            await self._run_update(trace_span)
 
-            # 批量生成对话
-            new_dialogues = self.batch_generator.generate_batch_dialogue()
-
-            # 更新状态
-            self.current_dialogues = new_dialogues
-            self.last_update = datetime.now()
-            self.next_update_time = datetime.now()
+    async def _run_update(self, trace_span):
+        """执行一轮更新(在追踪根片段内)"""
+        try:
+            print(f"\n🔄 [{self.clock.now().strftime('%H:%M:%S')}] 开始批量更新NPC对话...")
+
+            npc_names = self._select_active_npcs()
+
+            # 正在对话的NPC由环境对话逐句播放, 不生成独白
+            busy = self.conversations.busy_npcs()
+            if busy:
+                npc_names = [name for name in (npc_names if npc_names is not None else self.roster.names()) if name not in busy]
+
+            if npc_names is not None:
+                self.last_active_npcs = npc_names
+                trace_span.set("active_npcs", len(npc_names))
+                print(f"🎯 活跃NPC: {len(npc_names)}/{len(self.roster.roles)}")
+
+                if not npc_names:
+                    # 没有玩家在任何NPC附近,不消耗LLM调用
+                    print("💤 没有玩家在NPC附近,跳过本轮生成")
+                    self._mark_updated()
+                    return
+
+            # 批量生成对话(在线程池中运行,流式生成的每条对话闭合后立即发布)
+            # 线程池不会继承上下文, 复制当前上下文使追踪片段挂在本轮更新下
+            loop = asyncio.get_running_loop()
+            new_dialogues = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    contextvars.copy_context().run,
+                    self.batch_generator.generate_batch_dialogue,
+                    on_dialogue=self._publish_dialogue,
+                    npc_names=npc_names
+                )
+            )
+
+            # 更新状态(未生成的远处NPC保留上一句对话)
+            AMBIENT_LINES.inc(len(new_dialogues), "monologue", "generated")
+            with self._publish_lock:
+                self._apply_changes(new_dialogues)
+            self._mark_updated()
 
             # 打印更新结果
             print("📝 NPC对话已更新:")
@@ -99,21 +297,166 @@ class NPCStateManager:
         except Exception as e:
             print(f"❌ 更新NPC状态失败: {e}")
 
-    def get_current_state(self)->Dict:
-        """获取当前状态"""
+    def _mark_updated(self):
+        """记录本轮更新完成时间(共享状态模式下同时发布给其他worker)"""
+        self.last_update = self.clock.now()
+        self.next_update_time = self.last_update
+        if self.shared_state:
+            self.shared_state.set_meta("last_update", self.last_update.isoformat())
+
+    def _apply_changes(self, updates:Dict[str, str], removed:Iterable[str] = (), source:str = "monologue"):
+        """
+        应用对话变化并记录版本(调用方持有 _publish_lock)
+        写时复制: 读取方拿到的始终是完整的字典快照
+        :param source: 台词来源(monologue独白/conversation对话), 统计实际发布的台词数
+        """
+        dialogues = dict(self.current_dialogues)
+        changes = []
+
+        for npc_name, dialogue in updates.items():
+            if dialogues.get(npc_name) != dialogue:
+                dialogues[npc_name] = dialogue
+                self.version += 1
+                self._changelog.append((self.version, npc_name))
+                changes.append((npc_name, dialogue, self.version))
+
+        for npc_name in removed:
+            if npc_name in dialogues:
+                del dialogues[npc_name]
+                self.version += 1
+                self._changelog.append((self.version, npc_name))
+                changes.append((npc_name, None, self.version))
+
+        self.current_dialogues = dialogues
+        if updates:
+            AMBIENT_LINES.inc(sum(1 for _, dialogue, _ in changes if dialogue is not None), source, "shown")
+
+        if self.shared_state and changes:
+            # leader发布到共享存储, 其他worker按版本增量同步
+            self.shared_state.write_dialogues(changes, self.version)
+            self._synced_version = self.version
+
+    def _publish_dialogue(self, npc_name:str, dialogue:str):
+        """
+        发布单个NPC的新对话(流式生成回调, 在生成线程中调用)
+        """
+        with self._publish_lock:
+            self._apply_changes({npc_name: dialogue})
+
+    def _publish_conversation_lines(self, lines:Dict[str, str]):
+        """发布环境对话的一轮台词(每段对话一句)"""
+        with self._publish_lock:
+            self._apply_changes(lines, source="conversation")
+
+    def _on_roster_changed(self, diff:Dict):
+        """名册热加载回调: 移除已删除NPC的当前对话"""
+        if not diff["removed"] or not self.is_leader:
+            # 非leader的快照只从共享存储同步, 由leader发布移除
+            return
+        with self._publish_lock:
+            self._apply_changes({}, removed=diff["removed"])
+
+    def _changes_since(self, since:int):
+        """
+        计算指定版本之后的变化
+        :param since: 客户端已有的版本
+        :return: (changed_dialogues, removed, version), 客户端落后太多或版本无效时返回None
+        """
+        with self._publish_lock:
+            version = self.version
+            dialogues = self.current_dialogues
+
+            if since == version:
+                return {}, [], version
+
+            # 版本超前(服务重启)或变化日志已不包含 since 之后的全部变化
+            if since > version or not self._changelog or self._changelog[0][0] > since + 1:
+                return None
+
+            changed_names = set()
+            for change_version, npc_name in reversed(self._changelog):
+                if change_version <= since:
+                    break
+                changed_names.add(npc_name)
+
+        changed = {name: dialogues[name] for name in changed_names if name in dialogues}
+        removed = [name for name in changed_names if name not in dialogues]
+        return changed, removed, version
+
+    def get_current_state(self, since:Optional[int] = None)->Dict:
+        """
+        获取当前状态
+        :param since: 客户端已有的版本, 提供时只返回之后变化的NPC
+        """
          # 计算下次倒计时
         if self.last_update:
-            elapsed = (datetime.now() - self.last_update).total_seconds()
+            elapsed = (self.clock.now() - self.last_update).total_seconds()
             next_update_in = max(0, int(self.update_interval - elapsed))
         else:
             next_update_in = self.update_interval
 
+        delta = self._changes_since(since) if since is not None else None
+        if delta is None:
+            # 全量状态
+            with self._publish_lock:
+                dialogues, version = self.current_dialogues, self.version
+            removed = []
+            full = True
+        else:
+            dialogues, removed, version = delta
+            full = False
+
         return {
-            "dialogues": self.current_dialogues,
+            "dialogues": dialogues,
             "last_update": self.last_update,
-            "next_update_in": next_update_in
+            "next_update_in": next_update_in,
+            "version": version,
+            "full": full,
+            "removed": removed
         }
 
+    def report_presence(self, player_id:str, location:Optional[str] = None, nearby_npcs:Optional[List[str]] = None)->Dict:
+        """
+        记录玩家位置上报
+        :param player_id: 玩家ID
+        :param location: 玩家所在区域
+        :param nearby_npcs: 玩家附近的NPC
+        :return: 当前活跃情况
+        """
+        if self.shared_state:
+            self.shared_state.report_presence(player_id, location, nearby_npcs)
+            interest = self._shared_interest()
+        else:
+            self.interest.report(player_id, location, nearby_npcs)
+            interest = self.interest
+
+        return {
+            "player_id": player_id,
+            "active_players": interest.active_player_count(),
+            "active_npcs": interest.active_npcs(self.roster)
+        }
+
+    def export_state(self):
+        """
+        导出当前对话快照(写世界快照用)
+        :return: (dialogues, version, last_update)
+        """
+        with self._publish_lock:
+            return self.current_dialogues, self.version, self.last_update
+
+    def restore_state(self, dialogues:Dict[str, str], version:int, last_update:Optional[datetime]):
+        """
+        从世界快照恢复对话(启动前调用)
+        版本号取快照版本和当前时间(毫秒)中较大者: 快照之后可能还发布过变化(崩溃时丢失),
+        不能重新使用这些版本号, 客户端持有的任何重启前版本都会触发全量同步
+        """
+        dialogues = {name: dialogue for name, dialogue in dialogues.items() if name in self.roster.roles}
+        with self._publish_lock:
+            self.current_dialogues = dialogues
+            self.version = max(version, int(time.time() * 1000))
+            self._changelog.clear()
+        self.last_update = last_update
+
     def get_npc_dialogue(self, npc_name:str)->Optional[str]:
         """获取指定NPC的当前对话"""
         return self.current_dialogues.get(npc_name)
@@ -121,7 +464,18 @@ class NPCStateManager:
     async def force_update(self):
         """强制立即更新"""
         print("⚡ 强制更新NPC状态...")
-        await self._update_npc_state()
+        if self.is_leader:
+            await self._update_npc_state()
+            return
+
+        # 非leader: 请求leader刷新, 等待新快照(最多一个更新间隔)
+        store = self.shared_state
+        previous_update = store.get_meta("last_update")
+        store.set_meta("refresh_requested", datetime.now().isoformat())
+        deadline = time.monotonic() + self.update_interval
+        while time.monotonic() < deadline and store.get_meta("last_update") == previous_update:
+            await asyncio.sleep(settings.SHARED_STATE_POLL_INTERVAL / 2)
+        self._sync_from_shared()
 
 
 
@@ -0,0 +1,14 @@
+"""测试公共配置: 把 backend 加入导入路径, 日志和数据文件写到临时目录(需在导入各模块前设置)"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_TEST_DIR = tempfile.mkdtemp(prefix="aitown_test_")
+os.environ.setdefault("LOGS_DIR", os.path.join(_TEST_DIR, "logs"))
+os.environ.setdefault("MEMORY_DB_FILE", os.path.join(_TEST_DIR, "memories.db"))
+os.environ.setdefault("LOG_CONSOLE", "false")
+os.environ.setdefault("TRACE_ENABLED", "false")
@@ -0,0 +1,148 @@
+"""Agent会话历史裁剪和滚动摘要测试"""
+
+import threading
+import time
+
+from hello_agents.core.message import Message
+
+from conversation_history import SUMMARY_HEADER, ConversationHistoryManager
+from metrics import estimate_tokens
+
+
+class FakeAgent:
+    """只实现会话历史管理器用到的 SimpleAgent 接口"""
+
+    def __init__(self, system_prompt="你是张三"):
+        self.system_prompt = system_prompt
+        self._history = []
+
+    def get_history(self):
+        return self._history
+
+    def clear_history(self):
+        self._history = []
+
+    def add_message(self, message):
+        self._history.append(message)
+
+    def turn(self, question, answer):
+        self.add_message(Message(question, "user"))
+        self.add_message(Message(answer, "assistant"))
+
+
+class FakeLLM:
+    def __init__(self, reply="我和玩家聊过周报", gate=None):
+        self.reply = reply
+        self.gate = gate
+        self.prompts = []
+
+    def invoke(self, messages, **kwargs):
+        if self.gate:
+            self.gate.wait(5)
+        self.prompts.append(messages[-1]["content"])
+        return self.reply
+
+
+def make_manager(llm=None, max_turns=3, token_budget=10000):
+    manager = ConversationHistoryManager(llm)
+    manager.max_turns = max_turns
+    manager.token_budget = token_budget
+    return manager
+
+
+def wait_idle(manager, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while manager.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.pending == 0
+
+
+def contents(agent):
+    return [message.content for message in agent.get_history()]
+
+
+def test_keeps_latest_turns():
+    manager, agent = make_manager(max_turns=2), FakeAgent()
+    for i in range(5):
+        agent.turn(f"问{i}", f"答{i}")
+        manager.trim("张三", agent)
+    assert contents(agent) == ["问3", "答3", "问4", "答4"]
+    assert manager.stats["evicted_turns"] == 3
+
+
+def test_token_budget_keeps_at_least_latest_turn():
+    long_answer = "很长的回答" * 50
+    manager, agent = make_manager(max_turns=10, token_budget=estimate_tokens(long_answer)), FakeAgent()
+    agent.turn("问0", "答0")
+    agent.turn("问1", long_answer)
+    manager.trim("张三", agent)
+    assert contents(agent) == ["问1", long_answer]
+
+    agent.turn("问2", long_answer + long_answer)
+    manager.trim("张三", agent)
+    # 单轮超出预算时仍保留最新一轮
+    assert contents(agent) == ["问2", long_answer + long_answer]
+
+
+def test_player_message_replaces_enhanced_prompt():
+    manager, agent = make_manager(), FakeAgent()
+    agent.turn("【好感度】...\n【当前对话】\n玩家: 你好", "你好呀")
+    manager.trim("张三", agent, player_message="你好", player_id="alice")
+    assert contents(agent) == ["玩家alice: 你好", "你好呀"]
+
+
+def test_without_llm_evicted_turns_are_dropped():
+    manager, agent = make_manager(max_turns=1), FakeAgent()
+    agent.turn("问0", "答0")
+    agent.turn("问1", "答1")
+    manager.trim("张三", agent)
+    assert manager.pending == 0
+    assert manager.summaries == {}
+
+
+def test_evicted_turns_fold_into_system_prompt():
+    llm = FakeLLM()
+    manager, agent = make_manager(llm, max_turns=1), FakeAgent()
+    manager.attach("张三", agent)
+    agent.turn("玩家alice: 周报写完了吗", "快了")
+    agent.turn("玩家alice: 下午开会吗", "开")
+    manager.trim("张三", agent)
+    wait_idle(manager)
+
+    assert "周报写完了吗" in llm.prompts[0]
+    assert manager.summaries["张三"] == "我和玩家聊过周报"
+    assert agent.system_prompt.startswith("你是张三")
+    assert SUMMARY_HEADER in agent.system_prompt
+    assert "我和玩家聊过周报" in agent.system_prompt
+    assert manager.stats["summaries"] == 1
+    manager.stop()
+
+
+def test_failed_summary_keeps_previous_prompt():
+    manager, agent = make_manager(FakeLLM(reply="  "), max_turns=1), FakeAgent()
+    manager.attach("张三", agent)
+    agent.turn("问0", "答0")
+    agent.turn("问1", "答1")
+    manager.trim("张三", agent)
+    wait_idle(manager)
+    assert manager.stats["failures"] == 1
+    assert agent.system_prompt == "你是张三"
+    manager.stop()
+
+
+def test_stop_releases_cancelled_jobs():
+    gate = threading.Event()
+    manager, agent = make_manager(FakeLLM(gate=gate), max_turns=1), FakeAgent()
+    for i in range(5):
+        agent.turn(f"问{i}", f"答{i}")
+        manager.trim("张三", agent)
+    assert manager.pending == 4
+
+    manager.stop()
+    gate.set()
+    wait_idle(manager)
+
+    # 停止后的裁剪直接丢弃移出的对话
+    agent.turn("问5", "答5")
+    manager.trim("张三", agent)
+    assert manager.pending == 0
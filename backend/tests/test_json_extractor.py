@@ -0,0 +1,75 @@
+"""增量JSON提取器测试"""
+
+import json
+
+from json_extractor import IncrementalJSONExtractor, extract_json_object
+
+
+def feed_chunks(text, size):
+    """按固定长度分块喂入, 返回 (每个键值对闭合时的块序号, 提取器)"""
+    extractor = IncrementalJSONExtractor()
+    closed = []
+    for index in range(0, len(text), size):
+        for key, _ in extractor.feed(text[index:index + size]):
+            closed.append((key, index // size))
+    return closed, extractor
+
+
+def test_pairs_close_as_soon_as_complete():
+    extractor = IncrementalJSONExtractor()
+    assert extractor.feed('{"张三": "在写代') == []
+    assert extractor.feed('码", "李四"') == [("张三", "在写代码")]
+    assert extractor.feed(': "开会"}') == [("李四", "开会")]
+    assert extractor.done
+    assert extractor.result == {"张三": "在写代码", "李四": "开会"}
+
+
+def test_same_result_for_every_chunk_size():
+    payload = {"张三": "修复了一个{bug}", "李四": ["会议", "复盘"], "王五": {"mood": "开心", "n": 3}}
+    text = "好的, 以下是结果:\n```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```\n希望有帮助"
+    for size in range(1, 12):
+        _, extractor = feed_chunks(text, size)
+        assert extractor.result == payload, size
+
+
+def test_brackets_and_escapes_inside_strings():
+    text = r'{"a": "右括号} 和 , 逗号", "b": "引号\"}\" 反斜杠\\", "c": "[不是数组"}'
+    for size in (1, 3, len(text)):
+        _, extractor = feed_chunks(text, size)
+        assert extractor.result == {"a": "右括号} 和 , 逗号", "b": '引号"}" 反斜杠\\', "c": "[不是数组"}
+
+
+def test_escape_split_across_chunks():
+    extractor = IncrementalJSONExtractor()
+    extractor.feed('{"a": "x\\')
+    extractor.feed('"y", "b": 1}')
+    assert extractor.result == {"a": 'x"y', "b": 1}
+
+
+def test_malformed_pair_is_dropped_without_losing_others():
+    assert extract_json_object('{"a": 1, "b": 缺少引号, "c": "ok"}') == {"a": 1, "c": "ok"}
+
+
+def test_empty_object_in_preamble_is_skipped():
+    assert extract_json_object('示例格式 {} 如下: {"a": 1}') == {"a": 1}
+
+
+def test_stops_after_first_object():
+    extractor = IncrementalJSONExtractor()
+    extractor.feed('{"a": 1} {"b": 2}')
+    assert extractor.done
+    assert extractor.feed('{"c": 3}') == []
+    assert extractor.result == {"a": 1}
+
+
+def test_truncated_output_keeps_closed_pairs():
+    extractor = IncrementalJSONExtractor()
+    extractor.feed('{"a": "完整", "b": "被截')
+    assert extractor.result == {"a": "完整"}
+    assert not extractor.done
+
+
+def test_no_object():
+    assert extract_json_object("") is None
+    assert extract_json_object("没有JSON") is None
+    assert extract_json_object("{}") is None
@@ -0,0 +1,120 @@
+"""记忆数据库测试: 游标分页、按玩家删除、容量限制"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from hello_agents.memory import MemoryItem
+
+from memory_store import MemoryStore, decode_cursor, encode_cursor
+
+BASE_TIME = datetime(2025, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MemoryStore(str(tmp_path / "memories.db"))
+
+
+def add(store, content, player_id="alice", npc_name="张三", seconds=0, memory_type="episodic", importance=0.5):
+    item = MemoryItem(
+        id=str(uuid.uuid4()),
+        content=content,
+        memory_type=memory_type,
+        user_id=npc_name,
+        timestamp=BASE_TIME + timedelta(seconds=seconds),
+        importance=importance,
+        metadata={"player_id": player_id}
+    )
+    store.add(npc_name, item)
+    return item
+
+
+def all_pages(store, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        items, cursor = store.page("张三", limit, cursor=cursor, **filters)
+        pages.append([item.content for item in items])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(1735693200.123456, 42)) == (1735693200.123456, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("不是游标")
+
+
+def test_pages_cover_every_memory_once_in_time_order(store):
+    for i in range(7):
+        add(store, f"记忆{i}", seconds=i)
+    pages = all_pages(store, 3)
+    assert pages == [["记忆6", "记忆5", "记忆4"], ["记忆3", "记忆2", "记忆1"], ["记忆0"]]
+
+
+def test_equal_timestamps_split_by_seq_across_page_boundary(store):
+    # 同一时刻的记忆按写入序号区分, 翻页时既不重复也不遗漏
+    for i in range(5):
+        add(store, f"同时{i}", seconds=10)
+    add(store, "更早", seconds=0)
+    pages = all_pages(store, 2)
+    flat = [content for page in pages for content in page]
+    assert flat == ["同时4", "同时3", "同时2", "同时1", "同时0", "更早"]
+    assert [len(page) for page in pages] == [2, 2, 2]
+
+
+def test_exact_page_size_has_no_next_cursor(store):
+    for i in range(3):
+        add(store, f"记忆{i}", seconds=i)
+    items, cursor = store.page("张三", 3)
+    assert len(items) == 3
+    assert cursor is None
+
+
+def test_page_filters_by_player_and_time(store):
+    for i in range(4):
+        add(store, f"alice{i}", player_id="alice", seconds=i)
+        add(store, f"bob{i}", player_id="bob", seconds=i)
+    items, _ = store.page(
+        "张三", 10, player_id="bob",
+        since=(BASE_TIME + timedelta(seconds=1)).timestamp(), until=(BASE_TIME + timedelta(seconds=3)).timestamp()
+    )
+    assert [item.content for item in items] == ["bob2", "bob1"]
+
+
+def test_delete_player_removes_only_that_player(store):
+    for npc_name in ("张三", "李四"):
+        add(store, "alice的项目进展", player_id="alice", npc_name=npc_name)
+        add(store, "bob的项目进展", player_id="bob", npc_name=npc_name)
+
+    assert store.delete_player("alice") == 2
+    assert store.count() == 2
+    for npc_name in ("张三", "李四"):
+        # 全文索引同步删除: 只能检索到bob的记忆
+        results = store.search(npc_name, "项目进展", ["episodic"], 10, 0.0, None, None)
+        assert [item.content for item in results] == ["bob的项目进展"]
+    assert store.search("张三", "项目进展", ["episodic"], 10, 0.0, None, "alice") == []
+
+
+def test_search_is_partitioned_by_player(store):
+    add(store, "我们讨论了数据库索引", player_id="alice")
+    add(store, "我们讨论了数据库迁移", player_id="bob")
+    results = store.search("张三", "讨论了数据库", ["episodic"], 10, 0.0, None, "alice")
+    assert [item.content for item in results] == ["我们讨论了数据库索引"]
+
+
+def test_prune_forgets_low_importance_then_oldest(store):
+    add(store, "重要但最早", seconds=0, importance=0.9)
+    add(store, "不重要", seconds=1, importance=0.1)
+    add(store, "普通", seconds=2, importance=0.5)
+    add(store, "最新", seconds=3, importance=0.5)
+    add(store, "其他玩家", player_id="bob", seconds=0, importance=0.1)
+
+    assert store.prune("张三", "alice", "episodic", 3, 0.3) == 1
+    items, _ = store.page("张三", 10, player_id="alice")
+    assert [item.content for item in items] == ["最新", "普通", "重要但最早"]
+
+    assert store.prune("张三", "alice", "episodic", 2, 0.3) == 1
+    items, _ = store.page("张三", 10, player_id="alice")
+    assert [item.content for item in items] == ["最新", "普通"]
+    assert store.count() == 3
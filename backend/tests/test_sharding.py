@@ -0,0 +1,50 @@
+"""一致性哈希环测试"""
+
+from sharding import HashRing
+
+NODES = ["http://127.0.0.1:8001", "http://127.0.0.1:8002", "http://127.0.0.1:8003"]
+KEYS = [f"npc-{i}" for i in range(2000)]
+
+
+def assignments(ring):
+    return {key: ring.owner(key) for key in KEYS}
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing([]).owner("张三") is None
+
+
+def test_single_node_owns_everything():
+    ring = HashRing(NODES[:1])
+    assert {ring.owner(key) for key in KEYS} == {NODES[0]}
+
+
+def test_owner_is_independent_of_node_order_and_duplicates():
+    assert assignments(HashRing(NODES)) == assignments(HashRing(list(reversed(NODES)) + NODES[:1]))
+
+
+def test_keys_spread_across_nodes():
+    owners = list(assignments(HashRing(NODES)).values())
+    for node in NODES:
+        # 64个虚拟节点时各节点分到的比例应接近1/3
+        assert 0.2 < owners.count(node) / len(owners) < 0.47
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before = assignments(HashRing(NODES))
+    new_node = "http://127.0.0.1:8004"
+    after = assignments(HashRing(NODES + [new_node]))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved
+    assert all(after[key] == new_node for key in moved)
+    assert len(moved) < len(KEYS) / 2
+
+
+def test_removing_a_node_only_moves_its_keys():
+    before = assignments(HashRing(NODES))
+    after = assignments(HashRing(NODES[:2]))
+    for key in KEYS:
+        if before[key] != NODES[2]:
+            assert after[key] == before[key]
+        else:
+            assert after[key] in NODES[:2]
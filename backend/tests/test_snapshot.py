@@ -0,0 +1,95 @@
+"""世界状态快照文件格式测试: 写入后读回"""
+
+import sys
+
+import pytest
+
+from snapshot import SnapshotReader, SnapshotWriter, _HEADER
+
+
+def write_sample(path):
+    writer = SnapshotWriter()
+    names = writer.column("affinity.npc", "I")
+    values = writer.column("affinity.value", "d")
+    for npc_name, affinity in (("张三", 55.5), ("李四", 70.0), ("张三", 12.25)):
+        names.append(writer.intern(npc_name))
+        values.append(affinity)
+    lines = writer.column("lines", "I")
+    for text in ("", "ascii", "中文台词", "emoji 🎉 和 组合字符 é", "张三"):
+        lines.append(writer.intern(text))
+    size = writer.write(path, {"state_version": 1234567890123, "last_update": None})
+    return size
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "world.bin"
+    size = write_sample(path)
+    assert path.stat().st_size == size
+    assert not path.with_suffix(".bin.tmp").exists()
+
+    with SnapshotReader(path) as reader:
+        assert reader.meta["state_version"] == 1234567890123
+        assert reader.meta["last_update"] is None
+        names = [reader.strings[index] for index in reader.array("affinity.npc").tolist()]
+        assert names == ["张三", "李四", "张三"]
+        assert reader.array("affinity.value").tolist() == [55.5, 70.0, 12.25]
+        lines = [reader.strings[index] for index in reader.array("lines").tolist()]
+        assert lines == ["", "ascii", "中文台词", "emoji 🎉 和 组合字符 é", "张三"]
+
+
+def test_strings_are_interned_once(tmp_path):
+    path = tmp_path / "world.bin"
+    write_sample(path)
+    with SnapshotReader(path) as reader:
+        assert reader.strings.count("张三") == 1
+        assert len(reader.strings) == len(set(reader.strings))
+
+
+def test_sections_are_aligned_for_zero_copy_casts(tmp_path):
+    path = tmp_path / "world.bin"
+    write_sample(path)
+    with SnapshotReader(path) as reader:
+        assert reader._base % 8 == 0
+        for offset, _, _ in reader._sections.values():
+            assert offset % 8 == 0
+
+
+def test_missing_section_is_empty(tmp_path):
+    path = tmp_path / "world.bin"
+    write_sample(path)
+    with SnapshotReader(path) as reader:
+        assert reader.array("不存在").tolist() == []
+
+
+def test_rejects_other_byte_order(tmp_path, monkeypatch):
+    path = tmp_path / "world.bin"
+    other = "big" if sys.byteorder == "little" else "little"
+    monkeypatch.setattr(sys, "byteorder", other)
+    write_sample(path)
+    monkeypatch.undo()
+    with pytest.raises(ValueError):
+        SnapshotReader(path)
+
+
+def test_rejects_unknown_format(tmp_path):
+    path = tmp_path / "world.bin"
+    write_sample(path)
+    data = bytearray(path.read_bytes())
+    data[:8] = b"NOTASNAP"
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        SnapshotReader(path)
+
+
+def test_overwrite_replaces_previous_snapshot(tmp_path):
+    path = tmp_path / "world.bin"
+    write_sample(path)
+    writer = SnapshotWriter()
+    writer.column("lines", "I").append(writer.intern("新快照"))
+    writer.write(path, {"state_version": 1})
+    with SnapshotReader(path) as reader:
+        assert reader.meta["state_version"] == 1
+        assert reader.strings == ["新快照"]
+        assert reader.array("affinity.value").tolist() == []
+        magic, _, _ = _HEADER.unpack_from(path.read_bytes(), 0)
+        assert magic == b"AITWSNAP"
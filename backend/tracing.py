@@ -0,0 +1,277 @@
+"""请求追踪 - 每次对话/每轮NPC状态更新的嵌套耗时片段, 写入本地Chrome Trace文件
+
+追踪文件(logs/traces/trace_YYYY-MM-DD.json)为Chrome Trace Event的JSON数组格式,
+可直接用 chrome://tracing 或 https://ui.perfetto.dev 打开;
+数组不闭合(格式允许), 便于持续追加
+
+采样: 按 TRACE_SAMPLE_RATE 随机保留, 耗时超过 TRACE_SLOW_MS 的请求总是保留(便于排查慢请求)
+"""
+
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import settings
+
+# 追踪文件目录
+TRACES_DIR = Path(settings.LOGS_DIR) / "traces"
+
+
+def new_request_id()->str:
+    """生成请求ID"""
+    return uuid.uuid4().hex[:16]
+
+
+class _Trace:
+    """一次请求的追踪(收集所有片段, 结束时决定是否写入)"""
+
+    __slots__ = ("request_id", "sampled", "events")
+
+    def __init__(self, request_id:str, sampled:bool):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.events:List[Dict] = []  # 多个线程同时追加(list.append是原子操作)
+
+
+class Span:
+    """
+    耗时片段(with语句使用)
+    根片段结束时整个追踪按采样规则写入
+    """
+
+    __slots__ = ("name", "args", "trace", "is_root", "_token", "_start_us", "_start")
+
+    def __init__(self, name:str, trace:_Trace, is_root:bool = False, args:Optional[Dict] = None):
+        self.name = name
+        self.trace = trace
+        self.is_root = is_root
+        self.args = args or {}
+
+    def set(self, key:str, value):
+        """添加片段属性"""
+        self.args[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self._start_us = time.time_ns() // 1000
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+
+        if exc is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.args["request_id"] = self.trace.request_id
+
+        thread = threading.current_thread()
+        self.trace.events.append({
+            "name": self.name,
+            "ph": "X",
+            "ts": self._start_us,
+            "dur": round(duration * 1_000_000),
+            "pid": os.getpid(),
+            "tid": thread.native_id,
+            "args": self.args,
+            "_thread": thread.name
+        })
+
+        if self.is_root:
+            _tracer.finish(self.trace, duration * 1000)
+        return False
+
+
+class _NoopSpan:
+    """未追踪时使用的空片段(不做任何记录)"""
+
+    __slots__ = ()
+
+    def set(self, key:str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# 当前片段(每个请求/线程上下文独立)
+_current_span:contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+class TraceWriter:
+    """
+    追踪写入器
+
+    功能:
+    1. 采样决策: 随机采样 + 慢请求总是保留
+    2. 队列 + 后台线程写入, 按日期滚动文件
+    """
+
+    def __init__(self, traces_dir:Path, sample_rate:float = 0.1, slow_ms:float = 5000):
+        self.traces_dir = traces_dir
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._queue:queue.Queue = queue.Queue(maxsize=1000)
+        self._thread:Optional[threading.Thread] = None
+
+        # 当前打开的文件
+        self._current_date:Optional[str] = None
+        self._file = None
+        self._named_threads = set()
+
+        # 统计
+        self.traces = 0
+        self.written = 0
+        self.dropped = 0
+
+    def sample(self)->bool:
+        """请求开始时的采样决策"""
+        return random.random() < self.sample_rate
+
+    def finish(self, trace:_Trace, duration_ms:float):
+        """根片段结束: 采样命中或超过慢请求阈值时写入"""
+        self.traces += 1
+        if not trace.sampled and duration_ms < self.slow_ms:
+            return
+
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(trace.events)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        """启动后台写入线程(首次写入时)"""
+        self.traces_dir.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """后台写入循环"""
+        while True:
+            events = self._queue.get()
+            if events is None:
+                break
+            try:
+                self._write(events)
+            except Exception as e:
+                self.dropped += 1
+                print(f"❌ 写入追踪失败: {e}")
+
+    def _open_for(self, date_str:str):
+        """按日期打开追踪文件(新文件先写入数组开头)"""
+        if date_str == self._current_date and self._file:
+            return
+        if self._file:
+            self._file.close()
+
+        path = self.traces_dir / f"trace_{date_str}.json"
+        is_new = not path.exists() or path.stat().st_size == 0
+        self._file = open(path, "a", encoding="utf-8")
+        if is_new:
+            self._file.write("[\n")
+        self._current_date = date_str
+        self._named_threads = set()
+
+    def _write(self, events:List[Dict]):
+        """写入一次追踪的所有片段"""
+        self._open_for(datetime.now().strftime("%Y-%m-%d"))
+
+        lines = []
+        for event in sorted(events, key=lambda e: e["ts"]):
+            thread_name = event.pop("_thread")
+            key = (event["pid"], event["tid"])
+            if key not in self._named_threads:
+                # 线程名元数据, 查看器中按线程名显示
+                self._named_threads.add(key)
+                lines.append(json.dumps({
+                    "name": "thread_name", "ph": "M", "pid": event["pid"], "tid": event["tid"],
+                    "args": {"name": thread_name}
+                }, ensure_ascii=False))
+            lines.append(json.dumps(event, ensure_ascii=False, default=str))
+
+        self._file.write(",\n".join(lines) + ",\n")
+        self._file.flush()
+        self.written += 1
+
+    def stop(self, timeout:float = 5.0):
+        """停止写入线程(先写完队列中的追踪)"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._current_date = None
+
+    def stats(self)->Dict:
+        """追踪统计"""
+        return {
+            "traces": self.traces,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms
+        }
+
+
+# 全局写入器
+_tracer = TraceWriter(TRACES_DIR, sample_rate=settings.TRACE_SAMPLE_RATE, slow_ms=settings.TRACE_SLOW_MS)
+
+
+def start_trace(name:str, request_id:Optional[str] = None, **args)->Span:
+    """
+    开始一次追踪(返回根片段, with语句使用)
+    :param name: 根片段名称(如 chat / npc_state.update)
+    :param request_id: 请求ID, 为空时自动生成
+    :param args: 片段属性
+    """
+    if not settings.TRACE_ENABLED:
+        trace = _Trace(request_id or new_request_id(), sampled=False)
+        return Span(name, trace, is_root=False, args=args)
+    trace = _Trace(request_id or new_request_id(), sampled=_tracer.sample())
+    return Span(name, trace, is_root=True, args=args)
+
+
+def span(name:str, **args):
+    """
+    在当前追踪下开始一个子片段(没有进行中的追踪时为空操作)
+    :param name: 片段名称(如 llm.chat / memory.retrieve)
+    :param args: 片段属性
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(name, parent.trace, args=args)
+
+
+def current_request_id()->Optional[str]:
+    """当前请求ID(不在追踪中时为None)"""
+    current = _current_span.get()
+    return current.trace.request_id if current is not None else None
+
+
+def get_trace_stats()->Dict:
+    """获取追踪统计"""
+    return _tracer.stats()
+
+
+def stop_tracing():
+    """停止追踪写入(写完队列中的追踪)"""
+    _tracer.stop()
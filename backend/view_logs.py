@@ -1,44 +1,437 @@
-"""实时查看对话日志"""
+"""对话日志查看与查询工具
 
-import os, time
+日志文件为JSON Lines(每轮对话一条记录), 查询时为每个日志文件建立旁路索引
+(dialogue_YYYY-MM-DD.jsonl.idx / .idx.bin): 按NPC/玩家/情感的偏移量列表 + 稀疏时间索引,
+通过内存映射按偏移量直接读取匹配记录; 归档的 .jsonl.gz 日志按流式读取
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import mmap
+import os
+import time
+from array import array
 from pathlib import Path
 from datetime import datetime
+from typing import Dict, Iterator, List, Optional
 
 # 日志目录
-LOGS_DIR = Path(__file__).parent / "logs"
+LOGS_DIR = Path(os.getenv("LOGS_DIR", Path(__file__).parent / "logs"))
 today = datetime.now().strftime("%Y-%m-%d")
-LOG_FILE = LOGS_DIR / f"dialogue_{today}.log"
+LOG_FILE = LOGS_DIR / f"dialogue_{today}.jsonl"
+
+# 索引文件后缀与稀疏时间索引的间隔(每N条记录记录一次时间和偏移)
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 2
+TIME_INDEX_STRIDE = 256
+
+
+# ==================== 记录格式 ====================
+
+def format_record(record:Dict)->str:
+    """格式化单条记录"""
+    time_str = record.get("timestamp", "")[:19].replace("T", " ")
+
+    if record.get("type") != "dialogue":
+        return f"{time_str} [{record.get('level', 'info')}] {record.get('message', '')}"
+
+    lines = [
+        f"{time_str} 💬 {record.get('npc_name')} <-> {record.get('player_id', 'player')}",
+        f"    📝 玩家: {record.get('player_message')}",
+        f"    💬 回复: {record.get('npc_response', '')}"
+    ]
+
+    affinity = record.get("affinity_result") or {}
+    if affinity.get("changed"):
+        lines.append(
+            f"    💖 好感度: {affinity['old_affinity']:.1f} -> {affinity['new_affinity']:.1f} "
+            f"({affinity.get('reason', '')}, {affinity.get('sentiment', '')})"
+        )
+    if record.get("error"):
+        lines.append(f"    ❌ 错误: {record['error']}")
+    return "\n".join(lines)
+
+
+def _record_keys(record:Dict):
+    """提取索引字段: (时间, NPC, 玩家, 情感)"""
+    sentiment = (record.get("affinity_result") or {}).get("sentiment")
+    return record.get("timestamp", ""), record.get("npc_name"), record.get("player_id"), sentiment
+
+
+def _parse_time(value:Optional[str])->Optional[str]:
+    """
+    解析时间参数为ISO格式字符串(记录时间戳可直接按字符串比较)
+    支持: 2024-01-15 / 2024-01-15 10:30 / 2024-01-15T10:30:00 / 10:30(今天)
+    """
+    if not value:
+        return None
+    value = value.strip().replace(" ", "T")
+    if len(value) <= 8 and ":" in value:
+        value = f"{today}T{value}"
+    return datetime.fromisoformat(value).isoformat(timespec="milliseconds")
+
+
+# ==================== 索引 ====================
+#
+# 索引由两个旁路文件组成:
+#   <日志>.idx      JSON头: 已索引字节数、稀疏时间索引、每个键在偏移量数组中的位置
+#   <日志>.idx.bin  所有键的记录偏移量(int64, 按键连续存放), 查询时内存映射直接切片
+
+INDEX_FIELDS = ("npc", "player", "sentiment")
+
+
+def _index_path(log_file:Path)->Path:
+    return log_file.with_name(log_file.name + INDEX_SUFFIX)
+
+
+def _postings_path(log_file:Path)->Path:
+    return log_file.with_name(log_file.name + INDEX_SUFFIX + ".bin")
+
+
+class LogIndex:
+    """单个日志文件的索引"""
+
+    def __init__(self):
+        self.size = 0  # 已索引的字节数(总是在行边界)
+        self.records = 0
+        self.time_index:List[List] = []  # [[timestamp, offset], ...]
+        # 偏移量列表: {field: {key: 序列}}, 加载后为内存映射的切片, 构建时为array
+        self.postings:Dict[str, Dict[str, object]] = {field: {} for field in INDEX_FIELDS}
+        self._mm = None
+
+    def close(self):
+        """释放内存映射"""
+        self.postings = {field: {} for field in INDEX_FIELDS}
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # 调用方仍持有偏移量切片, 由垃圾回收在引用释放后关闭
+                pass
+            self._mm = None
+
+    def get(self, field:str, key:str):
+        """获取某个键的记录偏移量(升序)"""
+        return self.postings[field].get(key, ())
+
+    @classmethod
+    def load(cls, log_file:Path)->Optional["LogIndex"]:
+        """加载索引文件, 不存在或版本不符时返回None"""
+        header_file, postings_file = _index_path(log_file), _postings_path(log_file)
+        if not header_file.exists() or not postings_file.exists():
+            return None
+
+        try:
+            with open(header_file, "r", encoding="utf-8") as f:
+                header = json.load(f)
+        except ValueError:
+            return None
+        if header.get("version") != INDEX_VERSION:
+            return None
+
+        index = cls()
+        index.size = header["size"]
+        index.records = header["records"]
+        index.time_index = header["time_index"]
+
+        if os.path.getsize(postings_file) > 0:
+            with open(postings_file, "rb") as f:
+                index._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            offsets = memoryview(index._mm).cast("q")
+            for field, keys in header["postings"].items():
+                index.postings[field] = {
+                    key: offsets[start:start + count] for key, (start, count) in keys.items()
+                }
+        return index
+
+    def save(self, log_file:Path):
+        """写入索引文件"""
+        header = {
+            "version": INDEX_VERSION,
+            "size": self.size,
+            "records": self.records,
+            "time_index": self.time_index,
+            "postings": {}
+        }
+
+        position = 0
+        with open(_postings_path(log_file), "wb") as f:
+            for field in INDEX_FIELDS:
+                header["postings"][field] = {}
+                for key, offsets in self.postings[field].items():
+                    data = offsets if isinstance(offsets, array) else array("q", offsets)
+                    data.tofile(f)
+                    header["postings"][field][key] = [position, len(data)]
+                    position += len(data)
+
+        with open(_index_path(log_file), "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_index(log_file:Path, index:Optional[LogIndex] = None)->LogIndex:
+    """
+    建立(或增量更新)日志文件的索引
+    :param log_file: 日志文件
+    :param index: 已有索引, 只索引其后新增的内容
+    :return: 索引
+    """
+    index = index or LogIndex()
+    size = log_file.stat().st_size
+    if size <= index.size:
+        return index
+
+    # 增量更新时将内存映射的偏移量复制为可追加的数组
+    postings = {
+        field: {key: array("q", offsets) for key, offsets in keys.items()}
+        for field, keys in index.postings.items()
+    }
+    index.close()
+    index.postings = postings
+
+    with open(log_file, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = index.size
+            while offset < size:
+                end = mm.find(b"\n", offset, size)
+                if end == -1:
+                    # 最后一行尚未写完,下次再索引
+                    break
+
+                try:
+                    record = json.loads(mm[offset:end])
+                except ValueError:
+                    record = None
+
+                if isinstance(record, dict):
+                    timestamp, npc, player, sentiment = _record_keys(record)
+                    if index.records % TIME_INDEX_STRIDE == 0:
+                        index.time_index.append([timestamp, offset])
+                    for field, key in (("npc", npc), ("player", player), ("sentiment", sentiment)):
+                        if key:
+                            postings[field].setdefault(key, array("q")).append(offset)
+                    index.records += 1
+
+                offset = end + 1
+            index.size = offset
+        finally:
+            mm.close()
+
+    index.save(log_file)
+    return index
+
+
+def load_index(log_file:Path)->LogIndex:
+    """加载索引, 日志有新增内容时增量更新, 日志被截断或替换时重建"""
+    index = LogIndex.load(log_file)
+    if index is not None and index.size > log_file.stat().st_size:
+        index.close()
+        index = None
+    return build_index(log_file, index)
+
+
+# ==================== 查询 ====================
+
+def _read_record(mm:mmap.mmap, offset:int)->Optional[Dict]:
+    """读取指定偏移处的一条记录"""
+    end = mm.find(b"\n", offset)
+    if end == -1:
+        end = len(mm)
+    try:
+        return json.loads(mm[offset:end])
+    except ValueError:
+        return None
+
+
+def _matches(record:Dict, npc=None, player=None, sentiment=None, since=None, until=None)->bool:
+    """校验记录是否满足全部条件"""
+    timestamp, record_npc, record_player, record_sentiment = _record_keys(record)
+    if npc and record_npc != npc:
+        return False
+    if player and record_player != player:
+        return False
+    if sentiment and record_sentiment != sentiment:
+        return False
+    if since and timestamp < since:
+        return False
+    if until and timestamp > until:
+        return False
+    return True
+
+
+def _offset_range(index:LogIndex, since:Optional[str], until:Optional[str]):
+    """根据稀疏时间索引确定需要读取的偏移范围"""
+    times = [entry[0] for entry in index.time_index]
+    start, end = 0, index.size
+
+    # 记录按写入顺序排列,时间戳基本递增(耗时长的对话可能稍晚写入),两端各多留一个采样间隔
+    if since and times:
+        pos = bisect.bisect_left(times, since) - 2
+        if pos >= 0:
+            start = index.time_index[pos][1]
+    if until and times:
+        pos = bisect.bisect_right(times, until) + 1
+        if pos < len(times):
+            end = index.time_index[pos][1]
+    return start, end
+
+
+def query_log_file(log_file:Path, npc=None, player=None, sentiment=None, since=None, until=None)->Iterator[Dict]:
+    """
+    查询单个日志文件(按时间顺序流式返回匹配记录)
+    :param log_file: .jsonl 或 .jsonl.gz 日志文件
+    """
+    if log_file.suffix == ".gz":
+        yield from _query_compressed(log_file, npc, player, sentiment, since, until)
+        return
+
+    if log_file.stat().st_size == 0:
+        return
+
+    index = load_index(log_file)
+    start, end = _offset_range(index, since, until)
+
+    # 有NPC/玩家/情感条件时取偏移量列表的交集,否则顺序扫描时间范围
+    postings = []
+    for field, value in (("npc", npc), ("player", player), ("sentiment", sentiment)):
+        if value:
+            postings.append(index.get(field, value))
+
+    with open(log_file, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if postings:
+                # 从最短的列表开始求交集,先按偏移范围裁剪
+                postings.sort(key=len)
+                shortest = postings[0]
+                lo = bisect.bisect_left(shortest, start)
+                hi = bisect.bisect_left(shortest, end)
+                candidates = shortest[lo:hi]
+                for other in postings[1:]:
+                    other_set = set(other[bisect.bisect_left(other, start):bisect.bisect_left(other, end)])
+                    candidates = [offset for offset in candidates if offset in other_set]
+
+                for offset in candidates:
+                    record = _read_record(mm, offset)
+                    if record and _matches(record, npc, player, sentiment, since, until):
+                        yield record
+            else:
+                offset = start
+                while offset < end:
+                    line_end = mm.find(b"\n", offset, index.size)
+                    if line_end == -1:
+                        break
+                    try:
+                        record = json.loads(mm[offset:line_end])
+                    except ValueError:
+                        record = None
+                    if isinstance(record, dict) and _matches(record, since=since, until=until):
+                        yield record
+                    offset = line_end + 1
+        finally:
+            mm.close()
+            index.close()
+
+
+def _query_compressed(log_file:Path, npc, player, sentiment, since, until)->Iterator[Dict]:
+    """流式读取压缩归档日志"""
+    with gzip.open(log_file, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and _matches(record, npc, player, sentiment, since, until):
+                yield record
+
+
+def _file_date(log_file:Path)->str:
+    """从文件名中取日期: dialogue_2024-01-15.jsonl(.gz)"""
+    return log_file.name[len("dialogue_"):len("dialogue_") + 10]
+
+
+def find_log_files(since:Optional[str] = None, until:Optional[str] = None)->List[Path]:
+    """列出日期范围内的日志文件(含压缩归档, 按日期升序)"""
+    if not LOGS_DIR.exists():
+        return []
+
+    files = list(LOGS_DIR.glob("dialogue_*.jsonl")) + list(LOGS_DIR.glob("dialogue_*.jsonl.gz"))
+    result = []
+    for log_file in sorted(files, key=_file_date):
+        date = _file_date(log_file)
+        if since and date < since[:10]:
+            continue
+        if until and date > until[:10]:
+            continue
+        result.append(log_file)
+    return result
+
+
+def query_logs(npc=None, player=None, sentiment=None, since=None, until=None,
+               files:Optional[List[Path]] = None)->Iterator[Dict]:
+    """
+    跨日志文件查询
+    :param since/until: ISO格式时间字符串
+    :param files: 指定日志文件, 默认按时间范围选择
+    """
+    for log_file in files if files is not None else find_log_files(since, until):
+        yield from query_log_file(log_file, npc, player, sentiment, since, until)
+
+
+# ==================== 命令 ====================
+
+def tail_log_file(filename:Optional[Path] = None, interval:float = 1):
+    """实时查看日志文件(跨天时自动切换到新的日志文件)"""
+    follow_today = filename is None
+    filename = filename or LOG_FILE
 
-def tail_log_file(filename, interval=1):
-    """实时查看日志文件"""
     print("\n" + "=" * 60)
     print(f"📝 实时查看对话日志")
     print(f"📂 日志文件: {filename}")
     print("=" * 60)
     print("\n按 Ctrl+C 停止查看\n")
 
-    # 如果文件存在,等待创建
+    # 如果文件不存在,等待创建
     while not filename.exists():
         print(f"⏳ 等待日志文件创建: {filename}")
         time.sleep(interval)
 
-    # 打开文件
-    with open(filename, "r", encoding="utf-8") as f:
-        # 移动到文件结尾
-        f.seek(0, os.SEEK_END)
+    position = filename.stat().st_size
+    pending = b""
+
+    try:
+        while True:
+            size = filename.stat().st_size if filename.exists() else 0
+            if size > position:
+                with open(filename, "rb") as f:
+                    f.seek(position)
+                    data = pending + f.read(size - position)
+                position = size
+
+                *lines, pending = data.split(b"\n")
+                for line in lines:
+                    try:
+                        print(format_record(json.loads(line)))
+                    except ValueError:
+                        continue
+            elif follow_today:
+                # 跨天后切换到新文件
+                current = LOGS_DIR / f"dialogue_{datetime.now().strftime('%Y-%m-%d')}.jsonl"
+                if current != filename and current.exists():
+                    print(f"\n📂 切换到新日志文件: {current}\n")
+                    filename, position, pending = current, 0, b""
+                    continue
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n\n✅ 停止查看日志")
+
+
+def view_full_log(filename:Optional[Path] = None):
+    """查看完整日志(逐条流式输出)"""
+    filename = filename or LOG_FILE
 
-        try:
-            while True:
-                line = f.readline()
-                if line:
-                    print(line, end='')
-                else:
-                    time.sleep(interval)
-        except KeyboardInterrupt:
-            print("\n\n✅ 停止查看日志")
-
-def view_full_log(filename):
-    """查看完整日志"""
     print("\n" + "=" * 60)
     print(f"📝 查看完整对话日志")
     print(f"📂 日志文件: {filename}")
@@ -48,14 +441,14 @@ def view_full_log(filename):
         print(f"❌ 日志文件不存在: {filename}")
         return
 
-    with open(filename, 'r', encoding='utf-8') as f:
-        content = f.read()
-        print(content)
+    for record in query_log_file(filename):
+        print(format_record(record))
 
     print("\n" + "=" * 60)
     print("✅ 日志查看完成")
     print("=" * 60 + "\n")
 
+
 def list_log_files():
     """列出所有的日志文件"""
     print("\n" + "=" * 60)
@@ -66,43 +459,93 @@ def list_log_files():
     if not LOGS_DIR.exists():
         print("❌ 日志目录不存在")
         return
-    log_files = sorted(LOGS_DIR.glob("dialogue_*.log"), reverse=True)
+    log_files = list(reversed(find_log_files()))
 
     if not log_files:
         print("📭 暂无日志文件")
         return
 
+    print(f"找到 {len(log_files)} 个日志文件:")
     for i, log_file in enumerate(log_files, 1):
         size = log_file.stat().st_size
         size_kb = size / 1024
         mtime = datetime.fromtimestamp(log_file.stat().st_mtime)
-        print(f"找到 {len(log_files)} 个日志文件:")
-        print(f"{i}. {log_file.name}")
+        indexed = "已索引" if _index_path(log_file).exists() else ("归档" if log_file.suffix == ".gz" else "未索引")
+        print(f"{i}. {log_file.name} ({indexed})")
         print(f"   大小: {size_kb:.2f} KB")
         print(f"   修改时间: {mtime.strftime('%Y-%m-%d %H:%M:%S')}")
         print()
 
-if __name__ == '__main__':
-    import sys
-
-    if len(sys.argv) > 1:
-        command = sys.argv[1]
-
-        if command == "tail":
-            # 实时查看
-            tail_log_file()
-        elif command == "view":
-            # 查看完整日志
-            view_full_log()
-        elif command == "list":
-            # 列出所有日志
-            list_log_files()
+
+def run_query(args):
+    """执行查询命令"""
+    since = _parse_time(args.since)
+    until = _parse_time(args.until)
+    files = [Path(args.file)] if args.file else None
+
+    start = time.perf_counter()
+    count = 0
+    for record in query_logs(args.npc, args.player, args.sentiment, since, until, files):
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
         else:
-            print(f"❌ 未知命令: {command}")
-            print("\n使用方法:")
-            print("  python view_logs.py tail   # 实时查看日志")
-            print("  python view_logs.py view   # 查看完整日志")
-            print("  python view_logs.py list   # 列出所有日志文件")
+            print(format_record(record))
+        count += 1
+        if args.limit and count >= args.limit:
+            break
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"\n🔎 匹配 {count} 条记录 ({elapsed_ms:.1f}ms)")
+
+
+def run_index(args):
+    """为日志文件建立索引"""
+    files = [Path(args.file)] if args.file else [f for f in find_log_files() if f.suffix == ".jsonl"]
+    for log_file in files:
+        start = time.perf_counter()
+        index = load_index(log_file)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"✅ {log_file.name}: {index.records}条记录 ({elapsed_ms:.1f}ms)")
+        index.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="对话日志查看与查询工具")
+    subparsers = parser.add_subparsers(dest="command")
+
+    tail_parser = subparsers.add_parser("tail", help="实时查看日志")
+    tail_parser.add_argument("--file", help="日志文件(默认今天)")
+
+    view_parser = subparsers.add_parser("view", help="查看完整日志")
+    view_parser.add_argument("--file", help="日志文件(默认今天)")
+
+    subparsers.add_parser("list", help="列出所有日志文件")
+
+    query_parser = subparsers.add_parser("query", help="按条件查询日志")
+    query_parser.add_argument("--npc", help="NPC名称")
+    query_parser.add_argument("--player", help="玩家ID")
+    query_parser.add_argument("--sentiment", choices=["positive", "neutral", "negative"], help="情感倾向")
+    query_parser.add_argument("--since", help="开始时间, 如 2024-01-15 或 '2024-01-15 10:30'")
+    query_parser.add_argument("--until", help="结束时间")
+    query_parser.add_argument("--file", help="只查询指定日志文件")
+    query_parser.add_argument("--limit", type=int, default=0, help="最多返回条数")
+    query_parser.add_argument("--json", action="store_true", help="输出原始JSON")
+
+    index_parser = subparsers.add_parser("index", help="建立/更新日志索引")
+    index_parser.add_argument("--file", help="只索引指定日志文件")
+
+    args = parser.parse_args()
+
+    if args.command == "tail":
+        tail_log_file(Path(args.file) if args.file else None)
+    elif args.command == "view":
+        view_full_log(Path(args.file) if args.file else None)
+    elif args.command == "list":
+        list_log_files()
+    elif args.command == "query":
+        run_query(args)
+    elif args.command == "index":
+        run_index(args)
     else:
         # 默认实时查看
-        tail_log_file(LOG_FILE)
\ No newline at end of file
+        tail_log_file()